@@ -0,0 +1,179 @@
+"""
+Emulates the CSI the csi_extractor IP sends over DMA while someone gestures
+near the antennas, so the host side can be exercised without an RFSoC.
+
+The channel is a set of static multipath components plus reflections off the
+hand and forearm, whose path lengths change as they follow a gesture
+trajectory. Everything is computed for whole blocks of packets at once.
+"""
+
+import numpy as np
+
+from csi_decode import NUM_SUBCARRIERS, SUBCARRIERS, encode
+
+# WiFi channel 1
+CARRIER_FREQ = 2412e6
+SUBCARRIER_SPACING = 20e6 / 64
+SPEED_OF_LIGHT = 299_792_458.0
+
+# CSI frames in each DMA transfer
+FRAMES_PER_TRANSFER = 8
+
+# Antenna positions (m)
+TX_POS = np.array([-0.5, 0.0, 0.0])
+RX_POS = np.array([0.5, 0.0, 0.0])
+# Hand and forearm positions (m) at rest, in front of the link
+HAND_REST = np.array([0.0, 0.6, 0.2])
+FOREARM_REST = np.array([0.0, 0.8, 0.05])
+
+
+def _out_and_back(u):
+    """
+    0 -> 1 -> 0 over u in [0, 1] with zero velocity at both ends
+    """
+    return np.sin(np.pi * u) ** 2
+
+
+# Hand displacement (m) from rest over a gesture, as a function of u in [0, 1]
+GESTURES = {
+    "idle": lambda u: np.zeros((len(u), 3)),
+    "push": lambda u: np.outer(_out_and_back(u), [0.0, -0.25, 0.0]),
+    "pull": lambda u: np.outer(_out_and_back(u), [0.0, 0.2, 0.0]),
+    "swipe_left": lambda u: np.outer(_out_and_back(u), [-0.3, 0.0, 0.0]),
+    "swipe_right": lambda u: np.outer(_out_and_back(u), [0.3, 0.0, 0.0]),
+    "raise": lambda u: np.outer(_out_and_back(u), [0.0, 0.0, 0.25]),
+    "circle": lambda u: 0.15
+    * np.stack(
+        (np.sin(2 * np.pi * u), np.zeros_like(u), 1 - np.cos(2 * np.pi * u)), axis=1
+    ),
+}
+GESTURE_NAMES = list(GESTURES)
+
+
+def path_delay(pos):
+    """
+    Delay (s) of the TX -> pos -> RX reflection for an (..., 3) array of positions
+    """
+    length = np.linalg.norm(pos - TX_POS, axis=-1) + np.linalg.norm(
+        pos - RX_POS, axis=-1
+    )
+    return length / SPEED_OF_LIGHT
+
+
+class ChannelEmulator:
+    """
+    Generates CSI for a sequence of gestures at a fixed packet rate.
+
+    amplitude is the magnitude of the strongest static path in CSI units,
+    snr_db sets the per-subcarrier noise and hand/forearm are the reflection
+    strengths relative to that static path.
+    """
+
+    def __init__(
+        self,
+        packet_rate=100.0,
+        snr_db=30.0,
+        amplitude=2000.0,
+        num_static_paths=6,
+        hand=0.15,
+        forearm=0.25,
+        random_phase=True,
+        seed=None,
+    ):
+        self.packet_rate = packet_rate
+        self.amplitude = amplitude
+        self.noise_std = amplitude * 10 ** (-snr_db / 20) / np.sqrt(2)
+        self.hand = hand
+        self.forearm = forearm
+        self.random_phase = random_phase
+        self.rng = np.random.default_rng(seed)
+        self.freqs = CARRIER_FREQ + SUBCARRIERS * SUBCARRIER_SPACING
+        # The direct path plus reflections off the room, fixed for the session
+        delays = np.concatenate(
+            (
+                [np.linalg.norm(RX_POS - TX_POS) / SPEED_OF_LIGHT],
+                self.rng.uniform(5e-9, 150e-9, num_static_paths - 1),
+            )
+        )
+        gains = np.concatenate(
+            ([1.0], self.rng.uniform(0.05, 0.5, num_static_paths - 1))
+        )
+        gains = gains * np.exp(2j * np.pi * self.rng.uniform(size=num_static_paths))
+        self.static_csi = amplitude * (
+            gains @ np.exp(-2j * np.pi * np.outer(delays, self.freqs))
+        )
+
+    def trajectory(self, gesture, num_packets, scale=1.0):
+        """
+        Hand and forearm positions for each packet of a gesture, (num_packets, 3) each
+        """
+        u = np.linspace(0, 1, num_packets, endpoint=False)
+        offset = scale * GESTURES[gesture](u)
+        # The forearm pivots about the elbow, so it moves about half as far
+        return HAND_REST + offset, FOREARM_REST + offset / 2
+
+    def csi(self, gesture, duration, scale=1.0):
+        """
+        Complex CSI (num_packets, 52) for one gesture lasting `duration` seconds,
+        quantized to int16 like the equalizer's output
+        """
+        num_packets = max(int(round(duration * self.packet_rate)), 1)
+        hand_pos, forearm_pos = self.trajectory(gesture, num_packets, scale)
+        h = np.broadcast_to(self.static_csi, (num_packets, NUM_SUBCARRIERS)).copy()
+        for pos, strength in ((hand_pos, self.hand), (forearm_pos, self.forearm)):
+            delay = path_delay(pos)
+            # Bistatic reflections fall off with the square of the path length
+            gain = strength * (path_delay(HAND_REST) / delay) ** 2
+            h += (self.amplitude * gain)[:, None] * np.exp(
+                -2j * np.pi * np.outer(delay, self.freqs)
+            )
+        if self.random_phase:
+            # Every packet has its own carrier phase offset
+            h *= np.exp(2j * np.pi * self.rng.uniform(size=(num_packets, 1)))
+        h += self.noise_std * (
+            self.rng.standard_normal(h.shape) + 1j * self.rng.standard_normal(h.shape)
+        )
+        re = np.clip(np.round(h.real), -(2**15), 2**15 - 1)
+        im = np.clip(np.round(h.imag), -(2**15), 2**15 - 1)
+        return re + 1j * im
+
+    def random_schedule(self, duration, gap=(0.5, 2.0), length=(0.6, 1.5)):
+        """
+        Random (gesture, duration, scale) list filling roughly `duration`
+        seconds, with idle gaps between gestures
+        """
+        schedule = []
+        total = 0.0
+        while total < duration:
+            idle = self.rng.uniform(*gap)
+            gesture = self.rng.choice(GESTURE_NAMES[1:])
+            seconds = self.rng.uniform(*length)
+            schedule.append(("idle", idle, 1.0))
+            schedule.append((str(gesture), seconds, self.rng.uniform(0.7, 1.3)))
+            total += idle + seconds
+        return schedule
+
+    def session(self, schedule):
+        """
+        CSI and per-packet gesture labels (index into GESTURE_NAMES) for a schedule
+        """
+        csi = []
+        labels = []
+        for gesture, duration, scale in schedule:
+            block = self.csi(gesture, duration, scale)
+            csi.append(block)
+            labels.append(np.full(len(block), GESTURE_NAMES.index(gesture)))
+        return np.concatenate(csi), np.concatenate(labels)
+
+    def transfers(self, schedule, frames_per_transfer=FRAMES_PER_TRANSFER):
+        """
+        Yield the schedule as DMA buffers of frames_per_transfer * 52 int32 words,
+        the same as `out_buffer` after `dma.recvchannel.wait()`
+        """
+        leftover = np.zeros((0, NUM_SUBCARRIERS), dtype=complex)
+        for gesture, duration, scale in schedule:
+            csi = np.concatenate((leftover, self.csi(gesture, duration, scale)))
+            num_full = len(csi) // frames_per_transfer * frames_per_transfer
+            words = encode(csi[:num_full])
+            yield from words.reshape(-1, frames_per_transfer * NUM_SUBCARRIERS)
+            leftover = csi[num_full:]
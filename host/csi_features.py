@@ -0,0 +1,187 @@
+"""
+Streaming features of a CSI stream for gesture recognition.
+
+For every frame:
+  - amplitude, normalized per subcarrier by its mean over the last `window`
+    frames (so gain and the static paths drop out)
+  - phase with the linear trend across subcarriers removed, which is where
+    the sampling time offset (slope) and CFO / carrier phase (offset) end up
+
+and every `hop` frames a Doppler spectrogram: the power spectrum over the
+last `window` frames of the normalized, sanitized CSI, averaged over groups
+of neighbouring subcarriers. The spectrum is kept up to date with a sliding
+DFT, so each frame costs O(window) per subcarrier instead of an FFT over the
+whole window, and a batch of frames is folded in with one matrix multiply.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from csi_decode import NUM_SUBCARRIERS, SUBCARRIERS
+from csi_ring import CSIRing
+
+# Per-frame amplitude and phase (n, 52), and the spectrograms (m, groups,
+# window) that ended after each of doppler_frames frames
+Features = namedtuple("Features", ["amplitude", "phase", "doppler", "doppler_frames"])
+
+# Subcarriers in ascending order, to unwrap the phase across them
+_ORDER = np.argsort(SUBCARRIERS)
+_INDEX = SUBCARRIERS[_ORDER].astype(np.float64)
+
+
+def sanitize_phase(csi):
+    """
+    Phase of (n, 52) CSI minus its least squares linear fit across subcarriers
+    """
+    phase = np.unwrap(np.angle(csi[:, _ORDER]), axis=1)
+    # The subcarriers are symmetric about 0, so the fit's intercept is the mean
+    slope = phase @ _INDEX / (_INDEX @ _INDEX)
+    out = np.empty_like(phase)
+    out[:, _ORDER] = phase - slope[:, None] * _INDEX - phase.mean(axis=1, keepdims=True)
+    return out
+
+
+class CSIFeatures:
+    """
+    Computes Features for CSI frames pushed through update(), in batches of
+    any size. The sliding sums are recomputed from scratch every `resync`
+    frames so rounding errors can't build up.
+    """
+
+    def __init__(self, window=64, hop=8, groups=4, resync=4096):
+        self.window = window
+        self.hop = hop
+        self.resync = resync
+        self.group_starts = np.array(
+            [g[0] for g in np.array_split(np.arange(NUM_SUBCARRIERS), groups)]
+        )
+        self.group_sizes = np.diff(np.append(self.group_starts, NUM_SUBCARRIERS))
+        # Normalized, sanitized CSI and raw amplitude of the last frames
+        self._x = CSIRing(window + hop)
+        self._amp = CSIRing(window + hop, np.float32)
+        self._amp_sum = np.zeros(NUM_SUBCARRIERS)
+        # Sliding DFT of each subcarrier over the last `window` frames
+        self._spectrum = np.zeros((NUM_SUBCARRIERS, window), dtype=np.complex128)
+        # _rotation[p, k] advances bin k by p frames
+        k = np.arange(window)
+        self._rotation = np.exp(2j * np.pi * np.outer(np.arange(hop + 1), k) / window)
+        self.count = 0
+
+    def update(self, frames):
+        """
+        Push a (n, 52) batch of CSI frames, returning their Features
+        """
+        frames = np.asarray(frames)
+        amplitude, phase, doppler, doppler_frames = [], [], [], []
+        done = 0
+        while done < len(frames):
+            # Stop at the next spectrogram
+            n = min(len(frames) - done, self.hop - self.count % self.hop)
+            amp, ph = self._fold(frames[done : done + n])
+            amplitude.append(amp)
+            phase.append(ph)
+            done += n
+            if self.count % self.hop == 0 and self.count >= self.window:
+                if self.count % self.resync < self.hop:
+                    self._resync()
+                doppler.append(self.doppler())
+                doppler_frames.append(self.count)
+        doppler = (
+            np.stack(doppler)
+            if doppler
+            else np.zeros((0, len(self.group_starts), self.window), np.float32)
+        )
+        return Features(
+            np.concatenate(amplitude) if amplitude else np.zeros((0, NUM_SUBCARRIERS)),
+            np.concatenate(phase) if phase else np.zeros((0, NUM_SUBCARRIERS)),
+            doppler,
+            np.array(doppler_frames, dtype=np.int64),
+        )
+
+    def _leaving(self, ring, n):
+        """
+        The n frames that drop out of the window as the next n arrive
+        (zeros for the frames before the first)
+        """
+        start = self.count - self.window
+        out = np.zeros((n, NUM_SUBCARRIERS), dtype=ring.dtype)
+        if start + n > 0:
+            out[max(-start, 0) :] = ring.window(max(start, 0), start + n)
+        return out
+
+    def _fold(self, frames):
+        """
+        Fold up to `hop` frames into the sliding sums
+        """
+        n = len(frames)
+        amp = np.abs(frames).astype(np.float32)
+        phase = sanitize_phase(frames).astype(np.float32)
+        sums = self._amp_sum + np.cumsum(amp - self._leaving(self._amp, n), axis=0)
+        self._amp_sum = sums[-1]
+        counts = np.minimum(np.arange(self.count + 1, self.count + n + 1), self.window)
+        norm_amp = (amp / np.maximum(sums / counts[:, None], 1e-12)).astype(np.float32)
+        x = (norm_amp * np.exp(1j * phase)).astype(np.complex64)
+        # X_k <- X_k e^{j 2 pi k n / W} + sum_m (x_new - x_old)_m e^{j 2 pi k (n - m) / W}
+        delta = x - self._leaving(self._x, n)
+        self._spectrum *= self._rotation[n]
+        self._spectrum += delta.T @ self._rotation[n - np.arange(n)]
+        self._amp.append(amp)
+        self._x.append(x)
+        self.count += n
+        return norm_amp, phase
+
+    def _resync(self):
+        self._amp_sum = self._amp.latest(self.window).sum(axis=0, dtype=np.float64)
+        self._spectrum = np.fft.fft(self._x.latest(self.window), axis=0).T
+
+    def doppler(self):
+        """
+        Doppler spectrogram (groups, window) of the last `window` frames, with
+        zero Doppler in the middle
+        """
+        # Drop the mean (the static paths), then apply a Hann window as a
+        # convolution across the bins
+        spectrum = self._spectrum.copy()
+        spectrum[:, 0] = 0
+        windowed = 0.5 * spectrum - 0.25 * (
+            np.roll(spectrum, 1, axis=1) + np.roll(spectrum, -1, axis=1)
+        )
+        power = np.abs(windowed) ** 2
+        grouped = np.add.reduceat(power, self.group_starts, axis=0)
+        grouped /= self.group_sizes[:, None]
+        return np.fft.fftshift(grouped, axes=1).astype(np.float32)
+
+
+if __name__ == "__main__":
+    import time
+
+    from channel_emulator import ChannelEmulator
+
+    emulator = ChannelEmulator(packet_rate=500, seed=0)
+    csi, _ = emulator.session(emulator.random_schedule(20))
+    features = CSIFeatures()
+    start = time.perf_counter()
+    out = [features.update(batch) for batch in np.array_split(csi, len(csi) // 8)]
+    elapsed = time.perf_counter() - start
+    amplitude = np.concatenate([f.amplitude for f in out])
+    phase = np.concatenate([f.phase for f in out])
+    doppler = np.concatenate([f.doppler for f in out])
+    doppler_frames = np.concatenate([f.doppler_frames for f in out])
+
+    # Reference: a windowed FFT over every window from scratch
+    x = (amplitude * np.exp(1j * phase)).astype(np.complex64)
+    hann = np.hanning(features.window + 1)[: features.window, None]
+    ref = []
+    for end in doppler_frames:
+        w = x[end - features.window : end]
+        power = np.abs(np.fft.fft((w - w.mean(axis=0)) * hann, axis=0)) ** 2
+        grouped = np.add.reduceat(power.T, features.group_starts, axis=0)
+        ref.append(np.fft.fftshift(grouped / features.group_sizes[:, None], axes=1))
+    error = np.max(np.abs(doppler - ref)) / np.max(np.abs(ref))
+    assert error < 1e-4, error
+    print(
+        f"{len(csi)} frames, {len(doppler)} spectrograms match a full FFT "
+        f"(max relative error {error:.1e}), {len(csi) / elapsed:.0f} frames/s, "
+        f"{1e6 * elapsed / len(out):.0f} us per 8 frame batch"
+    )
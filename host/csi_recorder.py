@@ -0,0 +1,274 @@
+"""
+Append-only on-disk recording of CSI frames and their receive timestamps.
+
+A recording is a directory of chunks, each a pair of raw files: csi_NNNNN.bin
+holding (frames, 52) complex64 CSI and time_NNNNN.bin holding one float64
+timestamp per frame, plus recording.json describing them. Appending only
+copies the frames into an in-memory block; a background thread writes blocks
+out once they fill up or every `flush_interval` seconds, so the DMA loop never
+waits on the disk and a crash loses at most the last block.
+
+Recording() memory maps whatever has been written so far, including while
+the recording is still going.
+"""
+
+import json
+import queue
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+import csi_decode
+
+META_FILE = "recording.json"
+
+
+class CSIRecorder:
+    """
+    Records CSI frames to the directory `path`.
+
+    append() never blocks on I/O: full blocks are queued for the writer thread,
+    and if it falls behind more blocks are allocated rather than waiting. The
+    directory must be new or empty.
+    """
+
+    def __init__(
+        self,
+        path,
+        chunk_frames=1 << 16,
+        block_frames=4096,
+        flush_interval=1.0,
+        dtype=np.complex64,
+    ):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        # Appending to old chunks would throw off the chunk and frame indexing
+        if any(self.path.iterdir()):
+            raise FileExistsError(f"{self.path} is not empty")
+        self.chunk_frames = chunk_frames
+        self.block_frames = block_frames
+        self.flush_interval = flush_interval
+        self.dtype = np.dtype(dtype)
+        (self.path / META_FILE).write_text(
+            json.dumps(
+                {
+                    "dtype": self.dtype.str,
+                    "subcarriers": csi_decode.NUM_SUBCARRIERS,
+                    "chunk_frames": chunk_frames,
+                }
+            )
+        )
+        self._spare = queue.SimpleQueue()
+        self.blocks_allocated = 0
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+        self._block = self._new_block()
+        self._fill = 0
+        self._written = 0
+        self._files = None
+        self._thread = None
+        self.frames = 0
+
+    def _new_block(self):
+        try:
+            return self._spare.get_nowait()
+        except queue.Empty:
+            self.blocks_allocated += 1
+            return (
+                np.empty((self.block_frames, csi_decode.NUM_SUBCARRIERS), self.dtype),
+                np.empty(self.block_frames, np.float64),
+            )
+
+    def append(self, frames, timestamp=None):
+        """
+        Record a (n, 52) batch of frames received at `timestamp` (time.time()
+        if not given), which may be a scalar or one timestamp per frame
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        timestamps = np.broadcast_to(timestamp, len(frames))
+        with self._lock:
+            done = 0
+            while done < len(frames):
+                n = min(len(frames) - done, self.block_frames - self._fill)
+                csi, t = self._block
+                csi[self._fill : self._fill + n] = frames[done : done + n]
+                t[self._fill : self._fill + n] = timestamps[done : done + n]
+                self._fill += n
+                done += n
+                if self._fill == self.block_frames:
+                    self._swap_block()
+            self.frames += len(frames)
+
+    def _swap_block(self):
+        """
+        Hand the current block to the writer and start a new one (holding
+        the lock)
+        """
+        self._pending.put((self._block, self._fill))
+        self._block = self._new_block()
+        self._fill = 0
+
+    def _write(self, csi, t):
+        done = 0
+        while done < len(t):
+            chunk, offset = divmod(self._written, self.chunk_frames)
+            if offset == 0:
+                self._open_chunk(chunk)
+            n = min(len(t) - done, self.chunk_frames - offset)
+            # CSI first, so readers never see a timestamp without its frame
+            for f, data in zip(self._files, (csi, t)):
+                f.write(data[done : done + n])
+                f.flush()
+            self._written += n
+            done += n
+
+    def _open_chunk(self, chunk):
+        if self._files is not None:
+            for f in self._files:
+                f.close()
+        self._files = [
+            open(self.path / f"{prefix}_{chunk:05d}.bin", "xb")
+            for prefix in ("csi", "time")
+        ]
+
+    def _writer_loop(self):
+        while True:
+            try:
+                item = self._pending.get(timeout=self.flush_interval)
+            except queue.Empty:
+                # Nothing filled up in a while, write out the partial block
+                with self._lock:
+                    if self._fill:
+                        self._swap_block()
+                continue
+            if item is None:
+                break
+            block, n = item
+            self._write(block[0][:n], block[1][:n])
+            self._spare.put(block)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        """
+        Write out everything appended so far and stop the writer
+        """
+        with self._lock:
+            if self._fill:
+                self._swap_block()
+        self._pending.put(None)
+        if self._thread is not None:
+            self._thread.join()
+        else:
+            # Never started, so write everything out here
+            self._writer_loop()
+        if self._files is not None:
+            for f in self._files:
+                f.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Recording:
+    """
+    Read-only view of a recording, memory mapping every chunk written so far.
+    Call refresh() to pick up frames written since.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        meta = json.loads((self.path / META_FILE).read_text())
+        self.dtype = np.dtype(meta["dtype"])
+        self.subcarriers = meta["subcarriers"]
+        self.chunk_frames = meta["chunk_frames"]
+        self.refresh()
+
+    def refresh(self):
+        self.chunks = []
+        for csi_path in sorted(self.path.glob("csi_*.bin")):
+            time_path = csi_path.with_name(csi_path.name.replace("csi_", "time_"))
+            frame_bytes = self.subcarriers * self.dtype.itemsize
+            # The timestamps are written second, so they say what is complete
+            n = min(
+                csi_path.stat().st_size // frame_bytes,
+                time_path.stat().st_size // 8 if time_path.exists() else 0,
+            )
+            if n == 0:
+                break
+            csi = np.memmap(csi_path, self.dtype, "r", shape=(n, self.subcarriers))
+            t = np.memmap(time_path, np.float64, "r", shape=(n,))
+            self.chunks.append((csi, t))
+        return self
+
+    def __len__(self):
+        return sum(len(t) for _, t in self.chunks)
+
+    def read(self, start=0, stop=None):
+        """
+        Copy frames start..stop-1 and their timestamps out of the chunks
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        csi = np.empty((max(stop - start, 0), self.subcarriers), self.dtype)
+        t = np.empty(len(csi))
+        for n, (chunk_csi, chunk_t) in enumerate(self.chunks):
+            base = n * self.chunk_frames
+            lo, hi = max(start, base), min(stop, base + len(chunk_t))
+            if lo < hi:
+                csi[lo - start : hi - start] = chunk_csi[lo - base : hi - base]
+                t[lo - start : hi - start] = chunk_t[lo - base : hi - base]
+        return csi, t
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    rng = np.random.default_rng(0)
+    batch = (rng.standard_normal((8, 52)) + 1j * rng.standard_normal((8, 52))).astype(
+        np.complex64
+    )
+    num_batches = 200_000
+    with tempfile.TemporaryDirectory() as path:
+        worst = 0
+        start = time.perf_counter()
+        with CSIRecorder(path) as recorder:
+            for n in range(num_batches):
+                t = time.perf_counter()
+                recorder.append(batch, n)
+                worst = max(worst, time.perf_counter() - t)
+                if n == num_batches // 2:
+                    # Readable while it is still being written
+                    live = len(Recording(path))
+        elapsed = time.perf_counter() - start
+        recording = Recording(path)
+        csi, t = recording.read()
+        assert len(recording) == 8 * num_batches
+        assert (csi.reshape(num_batches, 8, 52) == batch).all()
+        assert (t == np.repeat(np.arange(num_batches), 8)).all()
+        # An existing recording is never appended to
+        try:
+            CSIRecorder(path)
+        except FileExistsError:
+            pass
+        else:
+            raise AssertionError("CSIRecorder accepted a non-empty directory")
+        print(
+            f"{8 * num_batches / elapsed:.0f} frames/s to {len(recording.chunks)} "
+            f"chunks, worst append {1e6 * worst:.0f} us, {live} frames readable "
+            f"halfway, {recorder.blocks_allocated} blocks allocated"
+        )
+
+    # close() without start() still writes everything out
+    with tempfile.TemporaryDirectory() as path:
+        recorder = CSIRecorder(path, block_frames=16)
+        recorder.append(np.repeat(batch, 5, axis=0), 0)
+        recorder.close()
+        assert (Recording(path).read()[0] == np.repeat(batch, 5, axis=0)).all()
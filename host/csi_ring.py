@@ -0,0 +1,123 @@
+"""
+Fixed-capacity history of CSI frames.
+
+Frames are written twice, at i and i + capacity, into storage twice the
+capacity. The last `capacity` frames are then always contiguous, so reading
+them in chronological order is a plain slice (no copy, no wraparound), while
+appending stays O(1) per frame and memory stays flat.
+"""
+
+import numpy as np
+
+import csi_decode
+
+
+class CSIRing:
+    """
+    Holds the last `capacity` CSI frames.
+
+    Frames are numbered from 0 in the order they were appended; `count` is
+    the number of the next frame. Views returned by the read methods are
+    only valid until that part of the ring is overwritten, so copy them if
+    they need to outlive `capacity` further frames.
+    """
+
+    def __init__(self, capacity, dtype=np.complex64):
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        # int16 rings keep the DMA's (im, re) pairs
+        frame_shape = (csi_decode.NUM_SUBCARRIERS,)
+        if self.dtype == np.int16:
+            frame_shape += (2,)
+        self._data = np.zeros((2 * capacity,) + frame_shape, dtype=self.dtype)
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, frames):
+        """
+        Append a (n, 52) batch of frames (or (n, 52, 2) for int16 rings)
+        """
+        frames = np.asarray(frames)
+        if len(frames) > self.capacity:
+            self.count += len(frames) - self.capacity
+            frames = frames[-self.capacity :]
+        pos = self.count % self.capacity
+        n = len(frames)
+        # Write both copies, splitting the batch where it wraps
+        first = min(n, self.capacity - pos)
+        for offset in (0, self.capacity):
+            self._data[offset + pos : offset + pos + first] = frames[:first]
+        if first < n:
+            self._data[: n - first] = frames[first:]
+            self._data[self.capacity : self.capacity + n - first] = frames[first:]
+        self.count += n
+
+    def window(self, start, stop=None):
+        """
+        Zero-copy view of frames start..stop-1 (absolute frame numbers)
+        """
+        stop = self.count if stop is None else stop
+        if start < self.count - self.capacity or stop > self.count or start > stop:
+            raise IndexError(
+                f"Frames {start}-{stop} are not in the ring "
+                f"(holds {max(self.count - self.capacity, 0)}-{self.count})"
+            )
+        # Frame k is stored at k % capacity and again `capacity` later, so
+        # the frames held run on contiguously from the oldest one
+        base = self.count - len(self)
+        offset = base % self.capacity
+        return self._data[offset + start - base : offset + stop - base]
+
+    def view(self):
+        """
+        Zero-copy view of every frame held, oldest first
+        """
+        return self.window(self.count - len(self))
+
+    def latest(self, n):
+        """
+        Zero-copy view of the newest n frames (fewer if the ring holds fewer)
+        """
+        return self.window(self.count - min(n, len(self)))
+
+    def since(self, index):
+        """
+        Frames appended since frame number `index`, and the number to pass
+        next time. Frames that have already been overwritten are skipped.
+        """
+        start = max(index, self.count - len(self))
+        return self.window(start), self.count
+
+
+if __name__ == "__main__":
+    import time
+
+    rng = np.random.default_rng(0)
+    ring = CSIRing(1000)
+    reference = []
+    for _ in range(500):
+        batch = (
+            rng.standard_normal((8, 52)) + 1j * rng.standard_normal((8, 52))
+        ).astype(np.complex64)
+        ring.append(batch)
+        reference.append(batch)
+        expected = np.concatenate(reference)[-1000:]
+        assert (ring.view() == expected).all()
+        assert np.shares_memory(ring.view(), ring._data)
+    # Constant time per batch, against the notebook's np.append growth (which
+    # copies the whole history every time, so gets slower the longer it runs)
+    batch = reference[0]
+    for name, step in (
+        ("CSIRing.append", lambda state: ring.append(batch) or state),
+        ("np.append", lambda state: np.append(state, batch, axis=0)),
+    ):
+        state = batch
+        start = time.perf_counter()
+        for _ in range(2000):
+            state = step(state)
+        print(
+            f"{name:>14}: {1e6 * (time.perf_counter() - start) / 2000:.1f} us "
+            "per batch over 2000 batches"
+        )
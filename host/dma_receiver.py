@@ -0,0 +1,275 @@
+"""
+Background, double-buffered receiver for the CSI DMA stream.
+
+A receive thread always has a transfer in flight into one of a ring of
+preallocated buffers, while a decode thread turns the previously filled
+buffer into CSI frames and hands them out through a bounded queue. Where the
+words come from is up to a backend: PynqBackend for the board, or
+GeneratorBackend to replay an emulator or a recording anywhere else.
+"""
+
+import queue
+import threading
+import time
+
+import numpy as np
+
+import csi_decode
+
+# CSI frames in each DMA transfer
+FRAMES_PER_TRANSFER = 8
+
+
+class PynqBackend:
+    """
+    Receives into pynq buffers from an AXI DMA's receive channel
+    """
+
+    def __init__(self, dma):
+        self.channel = dma.recvchannel
+
+    def allocate(self, num_words):
+        from pynq import allocate
+
+        return allocate(num_words, dtype=np.int32)
+
+    def start(self, buf):
+        self.channel.transfer(buf)
+
+    def wait(self):
+        self.channel.wait()
+
+
+class GeneratorBackend:
+    """
+    Stands in for the DMA by copying arrays of CSI words from `source` (e.g.
+    ChannelEmulator.transfers() or file_source()) into the buffers, at most
+    `rate` transfers per second if given
+    """
+
+    def __init__(self, source, rate=None):
+        self.source = iter(source)
+        self.period = 1 / rate if rate else 0
+        self.next_time = time.perf_counter()
+        self.buf = None
+
+    def allocate(self, num_words):
+        return np.zeros(num_words, dtype=np.int32)
+
+    def start(self, buf):
+        self.buf = buf
+
+    def wait(self):
+        """
+        Raises StopIteration when the source runs out
+        """
+        words = next(self.source)
+        if self.period:
+            self.next_time += self.period
+            delay = self.next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        self.buf[:] = words
+
+
+def file_source(path, num_words, loop=False):
+    """
+    Yield num_words CSI words at a time from a file of raw int32 DMA words
+    """
+    words = np.memmap(path, dtype=np.int32, mode="r")
+    while True:
+        for start in range(0, len(words) - num_words + 1, num_words):
+            yield words[start : start + num_words]
+        if not loop:
+            return
+
+
+class DMAReceiver:
+    """
+    Keeps a DMA transfer in flight while the previous one is decoded.
+
+    Frames come out of get() as (frames_per_transfer, 52) arrays. If the
+    consumer falls behind the decoded batches are dropped, and if the decoder
+    falls behind for more than `overrun_wait` seconds with no buffer free, the
+    oldest filled buffer is reused (an overrun); both are counted in stats().
+    With lossless=True the receiver waits for the decoder and consumer
+    instead, which is what you want when replaying a file.
+
+    The buffers cover num_buffers * frames_per_transfer / packet_rate seconds
+    of decoder stall, e.g. 32 ms for the default 8 buffers of 8 frames at
+    2000 packets/s; allow for the longest pause the decode thread can see
+    (GIL contention, garbage collection, the notebook redrawing).
+    """
+
+    def __init__(
+        self,
+        backend,
+        num_buffers=8,
+        frames_per_transfer=FRAMES_PER_TRANSFER,
+        queue_size=64,
+        decoder=csi_decode.decode,
+        lossless=False,
+        overrun_wait=0.02,
+    ):
+        if num_buffers < 2:
+            raise ValueError("Need at least two buffers to double buffer")
+        self.backend = backend
+        self.decoder = decoder
+        self.lossless = lossless
+        self.overrun_wait = overrun_wait
+        num_words = frames_per_transfer * csi_decode.NUM_SUBCARRIERS
+        self.buffers = [backend.allocate(num_words) for _ in range(num_buffers)]
+        self.frames = queue.Queue(maxsize=queue_size)
+        # Indices of buffers that are free / waiting to be decoded
+        self._free = queue.Queue()
+        self._filled = queue.Queue()
+        for idx in range(num_buffers):
+            self._free.put(idx)
+        self._running = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self.transfers = 0
+        self.dropped = 0
+        self.overruns = 0
+        self.finished = threading.Event()
+
+    def start(self):
+        self._running.set()
+        self._threads = [
+            threading.Thread(target=self._receive_loop, daemon=True),
+            threading.Thread(target=self._decode_loop, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._running.clear()
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _next_buffer(self):
+        """
+        Index of the buffer to receive into next, or None once stopped
+        """
+        deadline = time.perf_counter() + self.overrun_wait
+        while self._running.is_set():
+            wait = 0.1
+            if not self.lossless:
+                wait = min(max(deadline - time.perf_counter(), 0.001), wait)
+            try:
+                return self._free.get(timeout=wait)
+            except queue.Empty:
+                pass
+            if self.lossless or time.perf_counter() < deadline:
+                continue
+            # The decoder is still behind: throw away the oldest filled buffer
+            try:
+                idx = self._filled.get_nowait()
+            except queue.Empty:
+                # Everything is being decoded, wait for a buffer to come back
+                continue
+            with self._lock:
+                self.overruns += 1
+            return idx
+        return None
+
+    def _receive_loop(self):
+        idx = self._next_buffer()
+        if idx is None:
+            self._filled.put(None)
+            return
+        self.backend.start(self.buffers[idx])
+        while self._running.is_set():
+            try:
+                self.backend.wait()
+            except StopIteration:
+                break
+            # Start the next transfer before handing this buffer over
+            next_idx = self._next_buffer()
+            if next_idx is not None:
+                self.backend.start(self.buffers[next_idx])
+            with self._lock:
+                self.transfers += 1
+            self._filled.put(idx)
+            if next_idx is None:
+                break
+            idx = next_idx
+        self._filled.put(None)
+
+    def _decode_loop(self):
+        while True:
+            try:
+                idx = self._filled.get(timeout=0.1)
+            except queue.Empty:
+                if not self._running.is_set():
+                    break
+                continue
+            if idx is None:
+                break
+            frames = self.decoder(self.buffers[idx])
+            self._free.put(idx)
+            if self.lossless:
+                while self._running.is_set():
+                    try:
+                        self.frames.put(frames, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                continue
+            try:
+                self.frames.put_nowait(frames)
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+        self.finished.set()
+
+    def get(self, timeout=None):
+        """
+        The next batch of frames, or None if the stream has ended
+        """
+        while True:
+            try:
+                return self.frames.get(timeout=0.1 if timeout is None else timeout)
+            except queue.Empty:
+                if self.finished.is_set() and self.frames.empty():
+                    return None
+                if timeout is not None:
+                    raise
+
+    def __iter__(self):
+        while (frames := self.get()) is not None:
+            yield frames
+
+    def stats(self):
+        with self._lock:
+            return {
+                "transfers": self.transfers,
+                "dropped": self.dropped,
+                "overruns": self.overruns,
+                "queued": self.frames.qsize(),
+            }
+
+
+if __name__ == "__main__":
+    from channel_emulator import ChannelEmulator
+
+    emulator = ChannelEmulator(packet_rate=2000, seed=0)
+    schedule = emulator.random_schedule(30)
+    backend = GeneratorBackend(emulator.transfers(schedule))
+    start = time.perf_counter()
+    num_frames = 0
+    with DMAReceiver(backend, lossless=True) as receiver:
+        for frames in receiver:
+            num_frames += len(frames)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{num_frames} frames in {elapsed:.2f}s "
+        f"({num_frames / elapsed:.0f} frames/s), {receiver.stats()}"
+    )
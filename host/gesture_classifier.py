@@ -0,0 +1,259 @@
+"""
+Gesture classification of CSI feature windows.
+
+MLPClassifier is a small NumPy MLP whose weights live in an .npz file (it can
+also be built in closed form as a nearest-template classifier). The
+InferenceEngine runs it on a background thread: windows are submitted without
+blocking, gathered into micro-batches of up to `max_batch` (waiting at most
+`max_wait` seconds for a batch to fill) and classified with one set of matrix
+multiplies per batch, and the submit-to-result latency of every window is
+recorded.
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+def window_features(doppler):
+    """
+    Log power of (..., groups, window) Doppler spectrograms averaged over the
+    subcarrier groups, (..., window)
+    """
+    doppler = np.asarray(doppler, dtype=np.float32)
+    return np.log(doppler.mean(axis=-2) + 1e-6)
+
+
+class MLPClassifier:
+    """
+    ReLU MLP on standardized inputs, with a softmax over `labels` at the end.
+    weights and biases are lists with one (inputs, outputs) matrix and one
+    bias vector per layer.
+    """
+
+    def __init__(self, weights, biases, labels, mean, std):
+        self.weights = [np.asarray(w, dtype=np.float32) for w in weights]
+        self.biases = [np.asarray(b, dtype=np.float32) for b in biases]
+        self.labels = list(labels)
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.std = np.asarray(std, dtype=np.float32)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            num_layers = sum(1 for k in f.files if k.startswith("W"))
+            return cls(
+                [f[f"W{n}"] for n in range(num_layers)],
+                [f[f"b{n}"] for n in range(num_layers)],
+                [str(label) for label in f["labels"]],
+                f["mean"],
+                f["std"],
+            )
+
+    def save(self, path):
+        np.savez(
+            path,
+            labels=np.array(self.labels),
+            mean=self.mean,
+            std=self.std,
+            **{f"W{n}": w for n, w in enumerate(self.weights)},
+            **{f"b{n}": b for n, b in enumerate(self.biases)},
+        )
+
+    @classmethod
+    def from_templates(cls, x, y, labels):
+        """
+        Nearest class mean classifier as a single layer: argmin |x - c|^2 is
+        argmax 2 x.c - |c|^2. The inputs are only centred, scaling them by
+        their spread would blow up the bins that are mostly noise. Every
+        class needs at least one example.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y)
+        missing = [labels[n] for n in range(len(labels)) if not np.any(y == n)]
+        if missing:
+            raise ValueError(f"No examples of {', '.join(map(str, missing))}")
+        mean = x.mean(axis=0)
+        std = np.ones_like(mean)
+        z = x - mean
+        templates = np.stack([z[y == n].mean(axis=0) for n in range(len(labels))])
+        return cls(
+            [2 * templates.T],
+            [-np.sum(templates**2, axis=1)],
+            labels,
+            mean,
+            std,
+        )
+
+    def predict_proba(self, x):
+        """
+        Class probabilities (n, labels) for (n, features) inputs
+        """
+        h = (np.asarray(x, dtype=np.float32) - self.mean) / self.std
+        for n, (w, b) in enumerate(zip(self.weights, self.biases)):
+            h = h @ w + b
+            if n < len(self.weights) - 1:
+                np.maximum(h, 0, out=h)
+        h -= h.max(axis=1, keepdims=True)
+        np.exp(h, out=h)
+        return h / h.sum(axis=1, keepdims=True)
+
+    def predict(self, x):
+        return np.argmax(self.predict_proba(x), axis=1)
+
+
+class InferenceEngine:
+    """
+    Classifies feature windows on a background thread.
+
+    submit() returns a concurrent.futures.Future for the label index and
+    never waits for the classifier. Latencies of the last `history` windows
+    are kept for latency_percentiles().
+    """
+
+    def __init__(self, model, max_batch=32, max_wait=0.002, history=10_000):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.SimpleQueue()
+        self._latencies = deque(maxlen=history)
+        # Guards _latencies and the counters, which _run updates
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.windows = 0
+
+    def submit(self, window):
+        future = Future()
+        self._queue.put((time.perf_counter(), np.asarray(window), future))
+        return future
+
+    def _next_batch(self):
+        """
+        Wait for a window, then take whatever else arrives within max_wait
+        """
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish this batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while (batch := self._next_batch()) is not None:
+            submitted, windows, futures = zip(*batch)
+            try:
+                labels = self.model.predict(np.stack(windows))
+            except Exception as exc:
+                for future in futures:
+                    future.set_exception(exc)
+                continue
+            done = time.perf_counter()
+            for future, label in zip(futures, labels):
+                future.set_result(int(label))
+            with self._lock:
+                self._latencies.extend(done - t for t in submitted)
+                self.batches += 1
+                self.windows += len(batch)
+
+    def latency_percentiles(self, percentiles=(50, 90, 99)):
+        """
+        Submit-to-result latency percentiles in ms
+        """
+        with self._lock:
+            latencies = np.array(self._latencies)
+        if not len(latencies):
+            return {p: float("nan") for p in percentiles}
+        values = np.percentile(1e3 * latencies, percentiles)
+        return dict(zip(percentiles, values))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Classify everything already submitted, then stop
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+
+    from channel_emulator import ChannelEmulator, GESTURE_NAMES
+    from csi_features import CSIFeatures
+
+    def labelled_windows(seed, duration):
+        """
+        Doppler windows of an emulated session and the gesture most of each
+        window's frames belong to
+        """
+        emulator = ChannelEmulator(packet_rate=500, seed=seed)
+        csi, labels = emulator.session(emulator.random_schedule(duration))
+        features = CSIFeatures(window=128, hop=16).update(csi)
+        y = np.array(
+            [
+                np.bincount(labels[end - 128 : end], minlength=len(GESTURE_NAMES))
+                for end in features.doppler_frames
+            ]
+        ).argmax(axis=1)
+        return window_features(features.doppler), y
+
+    # Train and test on different emulated rooms
+    train = [labelled_windows(seed, 150) for seed in (0, 2, 3, 4)]
+    x_train = np.concatenate([x for x, _ in train])
+    y_train = np.concatenate([y for _, y in train])
+    x_test, y_test = labelled_windows(1, 60)
+    model = MLPClassifier.from_templates(x_train, y_train, GESTURE_NAMES)
+    # A class with no training windows has no template
+    try:
+        MLPClassifier.from_templates(x_train, np.minimum(y_train, 1), GESTURE_NAMES)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Trained without examples of every class")
+    with tempfile.TemporaryDirectory() as path:
+        model.save(Path(path) / "model.npz")
+        model = MLPClassifier.load(Path(path) / "model.npz")
+
+    # Windows arrive every hop (32 ms at 500 packets/s); submit them faster
+    # than that to exercise the batching
+    with InferenceEngine(model) as engine:
+        futures = []
+        for x in x_test:
+            futures.append(engine.submit(x))
+            time.sleep(0.0005)
+        predicted = np.array([f.result() for f in futures])
+    gesture = y_test > 0
+    latency = engine.latency_percentiles()
+    print(
+        f"{len(x_test)} windows in {engine.batches} batches, accuracy "
+        f"{np.mean(predicted == y_test):.2f} (always idle would be "
+        f"{np.mean(~gesture):.2f}), {np.mean(predicted[gesture] == y_test[gesture]):.2f}"
+        " on gestures, latency "
+        + ", ".join(f"p{p} {v:.2f} ms" for p, v in latency.items())
+    )
@@ -0,0 +1,141 @@
+"""
+Live CSI heatmap that redraws at a fixed rate, independent of acquisition.
+
+Acquisition appends frames to a CSIRing as fast as they arrive. A render
+thread wakes up `fps` times a second and takes whatever arrived since its last
+tick (only the newest `rows` frames if more than that arrived, the rest are
+never drawn), takes the log magnitude of just those rows and pushes the heatmap
+to the plot. A slow browser therefore only lowers the render rate; it never
+holds up the DMA.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+import csi_decode
+from csi_ring import CSIRing
+
+
+class LiveHeatmap:
+    """
+    Redraws the newest `rows` frames of `ring` on a heatmap.
+
+    `render` is called with the (rows, 52) log magnitude (newest frame first)
+    on every tick, use heatmap_renderer() to draw onto a plotly FigureWidget.
+    If `scale_row` is given an extra first row with that value is drawn, to
+    pin the bottom of the colour scale.
+    """
+
+    def __init__(self, ring, render, rows=128, fps=10, scale_row=None):
+        self.ring = ring
+        self.render = render
+        self.rows = rows
+        self.period = 1 / fps
+        self.scale_row = scale_row
+        self.log_mag = CSIRing(rows, np.float32)
+        self.z = np.zeros((rows + (scale_row is not None), csi_decode.NUM_SUBCARRIERS))
+        if scale_row is not None:
+            self.z[0] = scale_row
+        # First row of z the frames go in
+        self._offset = len(self.z) - rows
+        self.seen = 0
+        self.ticks = 0
+        self.skipped = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_time = None
+        self._stop_time = None
+        self._start_count = 0
+
+    def tick(self):
+        """
+        Draw the frames that arrived since the last tick
+        """
+        count = self.ring.count
+        # Anything older than the newest `rows` frames would never be seen
+        start = max(self.seen, count - self.rows)
+        self.skipped += start - self.seen
+        new = self.ring.window(start, count)
+        self.log_mag.append(np.log(np.abs(new) + 1))
+        self.seen = count
+        latest = self.log_mag.latest(self.rows)[::-1]
+        self.z[self._offset : self._offset + len(latest)] = latest
+        self.render(self.z)
+        self.ticks += 1
+
+    def _render_loop(self):
+        next_time = time.perf_counter()
+        while not self._stop.is_set():
+            self.tick()
+            next_time += self.period
+            delay = next_time - time.perf_counter()
+            if delay < 0:
+                # Rendering is slower than fps, don't try to catch up
+                next_time -= delay
+                delay = 0
+            self._stop.wait(delay)
+
+    def start(self):
+        self._start_time = time.perf_counter()
+        self._stop_time = None
+        self._start_count = self.ring.count
+        self.seen = self.ring.count
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._render_loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._stop_time = time.perf_counter()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self):
+        """
+        Acquisition and render rates between start() and stop() (or now)
+        """
+        elapsed = (self._stop_time or time.perf_counter()) - self._start_time
+        return {
+            "acquisition_fps": (self.ring.count - self._start_count) / elapsed,
+            "render_fps": self.ticks / elapsed,
+            "skipped_frames": self.skipped,
+        }
+
+
+def heatmap_renderer(fig, name="csi"):
+    """
+    A LiveHeatmap render callback that updates the named trace of a plotly
+    FigureWidget
+    """
+
+    def render(z):
+        fig.update_traces(selector={"name": name}, z=z)
+
+    return render
+
+
+if __name__ == "__main__":
+    from channel_emulator import ChannelEmulator
+    from dma_receiver import DMAReceiver, GeneratorBackend
+
+    def slow_render(z):
+        # Roughly what a FigureWidget redraw costs
+        time.sleep(0.05)
+
+    emulator = ChannelEmulator(packet_rate=2000, seed=0)
+    backend = GeneratorBackend(emulator.transfers(emulator.random_schedule(10)))
+    history = CSIRing(4096)
+    with DMAReceiver(backend, lossless=True) as receiver:
+        with LiveHeatmap(history, slow_render, fps=10) as view:
+            for frames in receiver:
+                history.append(frames)
+    print({k: round(v, 1) for k, v in view.stats().items()}, receiver.stats())
@@ -0,0 +1,266 @@
+"""
+Stand-in for the 20241208_final overlay, so the host code can run off-board.
+
+MockOverlay has the parts of the overlay the notebook uses: axi_dma_0 with a
+receive channel that fills caller-allocated buffers with CSI words, and
+usp_rf_data_converter_0 with ADC tiles that accept the mixer settings. The
+CSI words come from any iterable of int32 arrays (ChannelEmulator.transfers(),
+dma_receiver.file_source(), ...) and are delivered as if packets arrived at
+`packet_rate` per second with random jitter.
+
+Like the PL, packets keep arriving whether or not a transfer is in flight:
+they wait in a FIFO of `fifo_frames` frames and are lost once it is full, so
+a slow host sees real overruns. Arrivals follow a link clock that stops while
+the source generates words, so only the host's own stalls cause overruns.
+overrun_rate additionally drops a random burst of packets before that fraction
+of transfers.
+
+install() puts fake `pynq` and `xrfdc` modules in sys.modules, so the
+notebook's cells run unchanged:
+
+    import mock_overlay
+    mock_overlay.install(packet_rate=1000)
+"""
+
+import sys
+import time
+import types
+from collections import deque
+
+import numpy as np
+
+import csi_decode
+
+# xrfdc event ids
+EVENT_MIXER = 1
+
+
+def emulator_source(seed=None, packet_rate=100.0, **kwargs):
+    """
+    Endless CSI words from a ChannelEmulator running random gestures
+    """
+    from channel_emulator import ChannelEmulator
+
+    emulator = ChannelEmulator(packet_rate=packet_rate, seed=seed, **kwargs)
+    while True:
+        yield from emulator.transfers(emulator.random_schedule(60))
+
+
+class MockRecvChannel:
+    """
+    The receive channel of an AXI DMA, delivering frames of CSI words at a
+    packet rate
+    """
+
+    def __init__(
+        self,
+        source,
+        packet_rate=1000.0,
+        jitter=0.1,
+        fifo_frames=64,
+        overrun_rate=0.0,
+        max_burst=32,
+        seed=None,
+    ):
+        self.source = iter(source)
+        self.period = 1 / packet_rate
+        self.jitter = jitter
+        self.fifo_frames = fifo_frames
+        self.overrun_rate = overrun_rate
+        self.max_burst = max_burst
+        self.rng = np.random.default_rng(seed)
+        self._words = np.zeros(0, dtype=np.int32)
+        # Frames that have arrived but not been transferred yet
+        self._fifo = deque()
+        self._next_arrival = None
+        self._exhausted = False
+        self._buf = None
+        # Time spent in the source, which doesn't count as link time
+        self._paused = 0.0
+        self.frames = 0
+        self.overruns = 0
+        self.injected = 0
+
+    def _clock(self):
+        """
+        Link time: wall time less the time spent generating words
+        """
+        return time.perf_counter() - self._paused
+
+    def _next_frame(self):
+        """
+        The next frame's words from the source
+        """
+        while len(self._words) < csi_decode.NUM_SUBCARRIERS:
+            start = time.perf_counter()
+            try:
+                words = np.asarray(next(self.source), dtype=np.int32)
+            finally:
+                self._paused += time.perf_counter() - start
+            self._words = np.concatenate((self._words, words))
+        frame = self._words[: csi_decode.NUM_SUBCARRIERS]
+        self._words = self._words[csi_decode.NUM_SUBCARRIERS :]
+        return frame
+
+    def _arrive(self, until):
+        """
+        Queue every packet that has arrived by `until`, dropping the ones
+        that don't fit in the FIFO
+        """
+        if self._next_arrival is None:
+            self._next_arrival = until
+        while self._next_arrival <= until and not self._exhausted:
+            try:
+                frame = self._next_frame()
+            except StopIteration:
+                self._exhausted = True
+                break
+            if len(self._fifo) < self.fifo_frames:
+                self._fifo.append(frame)
+            else:
+                self.overruns += 1
+            self._next_arrival += self.period * max(
+                1 + self.jitter * self.rng.standard_normal(), 0
+            )
+
+    def transfer(self, buf):
+        self._buf = buf
+        if self.overrun_rate and self.rng.uniform() < self.overrun_rate:
+            burst = int(self.rng.integers(1, self.max_burst + 1))
+            try:
+                for _ in range(burst):
+                    self._next_frame()
+                    self.injected += 1
+            except StopIteration:
+                self._exhausted = True
+        self._arrive(self._clock())
+
+    def wait(self):
+        """
+        Block until the buffer is full. Raises StopIteration once the source
+        runs out.
+        """
+        buf = self._buf.reshape(-1, csi_decode.NUM_SUBCARRIERS)
+        for n in range(len(buf)):
+            while not self._fifo:
+                if self._exhausted:
+                    raise StopIteration
+                delay = self._next_arrival - self._clock()
+                if delay > 0:
+                    time.sleep(delay)
+                self._arrive(max(self._clock(), self._next_arrival))
+            buf[n] = self._fifo.popleft()
+        self.frames += len(buf)
+        self._buf = None
+
+    @property
+    def idle(self):
+        return self._buf is None
+
+
+class MockDMA:
+    def __init__(self, source, **kwargs):
+        self.recvchannel = MockRecvChannel(source, **kwargs)
+
+
+class MockADCBlock:
+    def __init__(self):
+        self.Dither = 0
+        self.MixerSettings = {"Freq": 0.0}
+        self.events = []
+
+    def UpdateEvent(self, event):
+        self.events.append(event)
+
+
+class MockADCTile:
+    def __init__(self, num_blocks=4):
+        self.blocks = [MockADCBlock() for _ in range(num_blocks)]
+
+
+class MockRFDC:
+    def __init__(self, num_tiles=4):
+        self.adc_tiles = [MockADCTile() for _ in range(num_tiles)]
+
+
+class MockOverlay:
+    """
+    The overlay, with the DMA replaying `source` (emulated gestures if None);
+    the other keyword arguments go to MockRecvChannel
+    """
+
+    def __init__(self, bitfile=None, source=None, **kwargs):
+        self.bitfile = bitfile
+        if source is None:
+            source = emulator_source(
+                seed=kwargs.get("seed"), packet_rate=kwargs.get("packet_rate", 1000.0)
+            )
+        self.axi_dma_0 = MockDMA(source, **kwargs)
+        self.usp_rf_data_converter_0 = MockRFDC()
+
+
+def install(**kwargs):
+    """
+    Register fake `pynq` and `xrfdc` modules whose Overlay() is a MockOverlay
+    built with these keyword arguments
+    """
+    pynq = types.ModuleType("pynq")
+    pynq.Overlay = lambda bitfile, **_: MockOverlay(bitfile, **kwargs)
+    pynq.PL = types.SimpleNamespace(reset=lambda: None)
+    pynq.allocate = lambda shape, dtype=np.int32: np.zeros(shape, dtype=dtype)
+    xrfdc = types.ModuleType("xrfdc")
+    xrfdc.EVENT_MIXER = EVENT_MIXER
+    sys.modules["pynq"] = pynq
+    sys.modules["xrfdc"] = xrfdc
+
+
+if __name__ == "__main__":
+    from channel_emulator import ChannelEmulator
+    from dma_receiver import DMAReceiver, PynqBackend
+
+    install(packet_rate=20_000, jitter=0.2, seed=0)
+    from pynq import Overlay, allocate
+
+    # Everything that goes in comes out, in order, when the host keeps up. The
+    # FIFO holds a second of packets so a loaded machine still has headroom.
+    emulator = ChannelEmulator(packet_rate=2000, seed=1)
+    csi, _ = emulator.session(emulator.random_schedule(4))
+    ol = MockOverlay(
+        source=[csi_decode.encode(csi)], packet_rate=2000, fifo_frames=2000
+    )
+    received = []
+    with DMAReceiver(PynqBackend(ol.axi_dma_0), lossless=True) as receiver:
+        start = time.perf_counter()
+        received = list(receiver)
+        elapsed = time.perf_counter() - start
+    received = np.concatenate(received)
+    channel = ol.axi_dma_0.recvchannel
+    assert channel.overruns == 0, channel.overruns
+    assert (received == csi[: len(received)]).all()
+    print(
+        f"DMAReceiver: {len(received)} frames at {len(received) / elapsed:.0f} "
+        f"frames/s (packet rate 2000), {channel.overruns} overruns"
+    )
+
+    # Time spent generating the emulated gestures doesn't count against a
+    # host that keeps up
+    ol = MockOverlay(packet_rate=2000, fifo_frames=2000, seed=0)
+    channel = ol.axi_dma_0.recvchannel
+    buf = np.zeros(8 * csi_decode.NUM_SUBCARRIERS, dtype=np.int32)
+    while channel.frames < 4000:
+        channel.transfer(buf)
+        channel.wait()
+    assert channel.overruns == 0, channel.overruns
+
+    # A host that stalls between transfers loses packets
+    ol = Overlay("./20241208_final.bit")
+    dma = ol.axi_dma_0
+    buf = allocate(8 * csi_decode.NUM_SUBCARRIERS, dtype=np.int32)
+    for _ in range(100):
+        dma.recvchannel.transfer(buf)
+        dma.recvchannel.wait()
+        time.sleep(0.005)
+    print(
+        f"Stalling host: {dma.recvchannel.frames} frames received, "
+        f"{dma.recvchannel.overruns} lost to FIFO overruns"
+    )
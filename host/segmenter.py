@@ -0,0 +1,165 @@
+"""
+Online gesture segmentation of a CSI stream.
+
+Motion near the link makes the CSI amplitude on every subcarrier fluctuate
+far more than noise does. Each frame updates an exponentially weighted
+variance of the amplitude on each subcarrier (over roughly `window` frames),
+their mean is compared to the idle noise floor, and a pair of CUSUM detectors
+on the log of that ratio decide when a gesture starts and ends. Everything
+per frame is O(subcarriers), so it keeps up with the packet rate instead of
+refitting a model over the whole recording.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+# A gesture starting or ending at `frame`, reported once frame `detected` arrived
+Event = namedtuple("Event", ["kind", "frame", "detected"])
+
+
+class GestureSegmenter:
+    """
+    Emits "start" and "end" Events as CSI frames are pushed through update().
+
+    threshold is how many times the idle noise floor the amplitude variance
+    has to be to count as motion, and h how much evidence (in nats) the CUSUM
+    needs before deciding, which bounds the detection latency to roughly
+    h / log(variance / (threshold * floor)) frames once the variance has built
+    up. Start events are moved back `lookback` frames to include the onset
+    that was below threshold. Gestures longer than max_frames are ended there.
+    """
+
+    def __init__(
+        self,
+        window=32,
+        threshold=2.0,
+        h=4.0,
+        lookback=5,
+        warmup=200,
+        floor_alpha=0.01,
+        max_frames=None,
+    ):
+        self.alpha = 1 / window
+        self.drift = np.log(threshold)
+        self.h = h
+        self.lookback = lookback
+        self.warmup = warmup
+        self.floor_alpha = floor_alpha
+        self.max_frames = max_frames
+        self.floor = None
+        self.frame = 0
+        self.active = False
+        self.start = None
+        self._mean = None
+        self._var = None
+        self._warmup_energy = []
+        # CUSUM statistics and the frame after each was last zero
+        self._up = 0.0
+        self._up_from = 0
+        self._down = 0.0
+        self._down_from = 0
+
+    def variance(self, amp):
+        """
+        Update the amplitude statistics with one frame's (52,) amplitudes,
+        returning the mean variance across the subcarriers
+        """
+        if self._mean is None:
+            self._mean = amp.copy()
+            self._var = np.zeros_like(amp)
+        diff = amp - self._mean
+        self._mean += self.alpha * diff
+        self._var = (1 - self.alpha) * (self._var + self.alpha * diff**2)
+        return self._var.mean()
+
+    def update(self, frames):
+        """
+        Push a (n, 52) batch of CSI, returning the Events it completes
+        """
+        events = []
+        for amp in np.abs(frames).astype(np.float64):
+            events.extend(self._step(self.variance(amp)))
+            self.frame += 1
+        return events
+
+    def _step(self, e):
+        if self.floor is None:
+            # Learn the noise floor from the first frames, assumed idle, once
+            # the variance has settled
+            self._warmup_energy.append(e)
+            if len(self._warmup_energy) == self.warmup:
+                settled = self._warmup_energy[self.warmup // 2 :]
+                self.floor = max(np.median(settled), 1e-12)
+            return []
+        x = np.log(max(e, 1e-12) / self.floor)
+        if not self.active:
+            self._up = max(0.0, self._up + x - self.drift)
+            if self._up == 0.0:
+                self._up_from = self.frame + 1
+                # Only quiet frames move the floor
+                self.floor += self.floor_alpha * (e - self.floor)
+            elif self._up > self.h:
+                self.active = True
+                self.start = max(self._up_from - self.lookback, 0)
+                self._down = 0.0
+                self._down_from = self.frame + 1
+                return [Event("start", self.start, self.frame)]
+            return []
+        self._down = max(0.0, self._down + self.drift - x)
+        if self._down == 0.0:
+            self._down_from = self.frame + 1
+        timed_out = self.max_frames and self.frame + 1 - self.start >= self.max_frames
+        if self._down > self.h or timed_out:
+            self.active = False
+            self._up = 0.0
+            self._up_from = self.frame + 1
+            end = self.frame + 1 if timed_out else self._down_from
+            return [Event("end", end, self.frame)]
+        return []
+
+
+def segments(events):
+    """
+    (start, end) frame pairs from a list of Events
+    """
+    starts = [e.frame for e in events if e.kind == "start"]
+    ends = [e.frame for e in events if e.kind == "end"]
+    return list(zip(starts, ends))
+
+
+if __name__ == "__main__":
+    import time
+
+    from channel_emulator import ChannelEmulator
+
+    emulator = ChannelEmulator(packet_rate=500, seed=0)
+    schedule = [("idle", 1.0, 1.0)] + emulator.random_schedule(60)
+    csi, labels = emulator.session(schedule)
+    moving = labels != 0
+    bounds = np.flatnonzero(np.diff(moving.astype(int))) + 1
+    truth = list(zip(bounds[::2], bounds[1::2]))
+
+    segmenter = GestureSegmenter()
+    start = time.perf_counter()
+    events = []
+    for batch in np.array_split(csi, len(csi) // 8):
+        events += segmenter.update(batch)
+    elapsed = time.perf_counter() - start
+
+    found = segments(events)
+    # Match every true gesture to the detected segment overlapping it most
+    matched = []
+    for a, b in truth:
+        overlap = [min(b, d) - max(a, c) for c, d in found]
+        if overlap and max(overlap) > 0:
+            c, d = found[int(np.argmax(overlap))]
+            matched.append((c - a, d - b))
+    errors = np.abs(np.array(matched))
+    latency = [e.detected - e.frame for e in events]
+    print(
+        f"{len(matched)}/{len(truth)} gestures found, {len(found)} segments, "
+        f"median start/end error {np.median(errors[:, 0]):.0f}/"
+        f"{np.median(errors[:, 1]):.0f} frames, max latency {max(latency)} frames, "
+        f"{len(csi) / elapsed:.0f} frames/s"
+    )
@@ -0,0 +1,429 @@
+"""
+Acquisition, feature extraction and inference in separate processes.
+
+The stages are connected by ShmRings: single-producer single-consumer rings
+of fixed-size records in multiprocessing.shared_memory, with a write and a
+read sequence counter in the same block. The producer copies records in and
+then advances the write counter, the consumer copies them out and then
+advances the read counter. The counters are only read and advanced under a
+lock per ring, whose acquire and release are the memory barriers that keep
+the records and counters in order on ARM as well as x86; the records are
+copied outside it, and nothing is pickled once the stages are running.
+
+    acquisition --csi--> features --windows--> inference --labels--> parent
+
+Acquisition never waits: if the CSI ring is full the frames are dropped and
+counted. The other stages wait for space downstream. Every stage keeps its
+counters in a shared stats block, so the parent can report throughput and
+ring occupancy while it runs.
+"""
+
+import os
+import time
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+
+import csi_decode
+
+# Header of a ShmRing: write sequence, read sequence, max occupancy, padding
+# up to a cache line so the data is aligned
+_HEADER = 64
+
+STAGES = ["acquisition", "features", "inference"]
+# Columns of the stats block
+STATS = ["items_in", "items_out", "dropped", "busy_ns", "done"]
+
+
+class ShmRing:
+    """
+    Single-producer single-consumer ring of `capacity` records of `dtype`
+    and `shape` in shared memory.
+
+    Create it in the parent and pass spec() to the process that attaches to
+    it as a Process argument, since it holds the ring's lock. Every read or
+    update of the counters takes the lock, once per batch of records.
+    """
+
+    def __init__(self, capacity, dtype, shape=(), name=None, lock=None):
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        size = _HEADER + capacity * self.dtype.itemsize * int(np.prod(shape, dtype=int))
+        self._owner = name is None
+        self._lock = get_context().Lock() if lock is None else lock
+        # Only attach from processes started by multiprocessing, which share
+        # the creator's resource tracker
+        self.shm = shared_memory.SharedMemory(name=name, create=self._owner, size=size)
+        self._counters = np.ndarray(3, np.int64, self.shm.buf[:24])
+        if self._owner:
+            self._counters[:] = 0
+        self._data = np.ndarray(
+            (capacity,) + self.shape, self.dtype, self.shm.buf[_HEADER:size]
+        )
+
+    def spec(self):
+        """
+        What attach() needs
+        """
+        return self.shm.name, self.capacity, self.dtype, self.shape, self._lock
+
+    @classmethod
+    def attach(cls, spec):
+        name, capacity, dtype, shape, lock = spec
+        return cls(capacity, dtype, shape, name=name, lock=lock)
+
+    def _positions(self):
+        with self._lock:
+            return int(self._counters[0]), int(self._counters[1])
+
+    def __len__(self):
+        head, tail = self._positions()
+        return head - tail
+
+    @property
+    def max_occupancy(self):
+        with self._lock:
+            return int(self._counters[2])
+
+    def write(self, records):
+        """
+        Copy in as many of the records as fit, returning how many did
+        """
+        head, tail = self._positions()
+        n = min(len(records), self.capacity - (head - tail))
+        pos = head % self.capacity
+        first = min(n, self.capacity - pos)
+        self._data[pos : pos + first] = records[:first]
+        self._data[: n - first] = records[first:n]
+        # Publish only once the records are in place
+        with self._lock:
+            self._counters[0] = head + n
+            self._counters[2] = max(self._counters[2], head + n - tail)
+        return n
+
+    def read(self, max_records=None):
+        """
+        Copy out up to max_records records (all that are available if None)
+        """
+        head, tail = self._positions()
+        n = head - tail if max_records is None else min(head - tail, max_records)
+        pos = tail % self.capacity
+        first = min(n, self.capacity - pos)
+        out = np.concatenate((self._data[pos : pos + first], self._data[: n - first]))
+        # Free the slots only once the records are copied out
+        with self._lock:
+            self._counters[1] = tail + n
+        return out
+
+    def close(self):
+        # Drop our views before the buffer goes away
+        del self._counters, self._data
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+
+def _set_affinity(cpus):
+    if cpus is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+
+def _wait_for_space(ring, records, stop):
+    """
+    Write all of records, waiting for the consumer as needed
+    """
+    done = 0
+    while done < len(records) and not stop.is_set():
+        done += ring.write(records[done:])
+        if done < len(records):
+            time.sleep(0.0005)
+
+
+def acquisition_stage(backend_factory, csi_spec, stats_spec, stop, cpus, frames):
+    """
+    Receive DMA transfers from backend_factory() (see dma_receiver) and
+    decode them straight into the CSI ring
+    """
+    _set_affinity(cpus)
+    csi_ring = ShmRing.attach(csi_spec)
+    stats_ring = ShmRing.attach(stats_spec)
+    stats = stats_ring._data[0, 0]
+    backend = backend_factory()
+    num_words = frames * csi_decode.NUM_SUBCARRIERS
+    buffers = [backend.allocate(num_words) for _ in range(2)]
+    decoded = np.empty((frames, csi_decode.NUM_SUBCARRIERS), np.complex64)
+    backend.start(buffers[0])
+    idx = 0
+    try:
+        while not stop.is_set():
+            try:
+                backend.wait()
+            except StopIteration:
+                break
+            # Next transfer in flight before anything else
+            backend.start(buffers[1 - idx])
+            start = time.perf_counter_ns()
+            csi_decode.decode(buffers[idx], out=decoded)
+            written = csi_ring.write(decoded)
+            stats[0] += frames
+            stats[1] += written
+            stats[2] += frames - written
+            stats[3] += time.perf_counter_ns() - start
+            idx = 1 - idx
+    finally:
+        stats[4] = 1
+
+
+def feature_stage(feature_kwargs, csi_spec, window_spec, stats_spec, stop, cpus):
+    """
+    Turn CSI frames into classifier windows
+    """
+    from csi_features import CSIFeatures
+    from gesture_classifier import window_features
+
+    _set_affinity(cpus)
+    csi_ring = ShmRing.attach(csi_spec)
+    window_ring = ShmRing.attach(window_spec)
+    stats_ring = ShmRing.attach(stats_spec)
+    stats_block = stats_ring._data[0]
+    stats = stats_block[1]
+    features = CSIFeatures(**feature_kwargs)
+    # Upstream can write its last records just before raising its done flag,
+    # so only stop on an empty read made after seeing the flag
+    upstream_done = False
+    try:
+        while not stop.is_set():
+            frames = csi_ring.read(1024)
+            if not len(frames):
+                if upstream_done:
+                    break
+                upstream_done = bool(stats_block[0, 4])
+                if not upstream_done:
+                    time.sleep(0.0005)
+                continue
+            start = time.perf_counter_ns()
+            out = features.update(frames)
+            records = np.zeros(len(out.doppler_frames), window_ring.dtype)
+            records["frame"] = out.doppler_frames
+            records["features"] = window_features(out.doppler)
+            stats[0] += len(frames)
+            stats[3] += time.perf_counter_ns() - start
+            _wait_for_space(window_ring, records, stop)
+            stats[1] += len(records)
+    finally:
+        stats[4] = 1
+
+
+def inference_stage(model_path, window_spec, label_spec, stats_spec, stop, cpus):
+    """
+    Classify windows in whatever batches have built up
+    """
+    from gesture_classifier import MLPClassifier
+
+    _set_affinity(cpus)
+    model = MLPClassifier.load(model_path)
+    window_ring = ShmRing.attach(window_spec)
+    label_ring = ShmRing.attach(label_spec)
+    stats_ring = ShmRing.attach(stats_spec)
+    stats_block = stats_ring._data[0]
+    stats = stats_block[2]
+    # Upstream can write its last records just before raising its done flag,
+    # so only stop on an empty read made after seeing the flag
+    upstream_done = False
+    try:
+        while not stop.is_set():
+            windows = window_ring.read(256)
+            if not len(windows):
+                if upstream_done:
+                    break
+                upstream_done = bool(stats_block[1, 4])
+                if not upstream_done:
+                    time.sleep(0.0005)
+                continue
+            start = time.perf_counter_ns()
+            labels = np.zeros(len(windows), label_ring.dtype)
+            labels["frame"] = windows["frame"]
+            labels["label"] = model.predict(windows["features"])
+            stats[0] += len(windows)
+            stats[3] += time.perf_counter_ns() - start
+            _wait_for_space(label_ring, labels, stop)
+            stats[1] += len(labels)
+    finally:
+        stats[4] = 1
+
+
+class Pipeline:
+    """
+    Runs the three stages in their own processes.
+
+    backend_factory is a picklable callable returning a DMA backend
+    (dma_receiver.PynqBackend, GeneratorBackend, ...) and is called in the
+    acquisition process. affinity optionally maps stage names to the CPUs
+    to pin them to. Labels come out of results() as (frame, label) records.
+    """
+
+    def __init__(
+        self,
+        backend_factory,
+        model_path,
+        feature_kwargs=None,
+        affinity=None,
+        csi_capacity=1 << 14,
+        window_capacity=1024,
+        frames_per_transfer=8,
+    ):
+        self.feature_kwargs = dict(window=128, hop=16, **(feature_kwargs or {}))
+        self.affinity = affinity or {}
+        window = self.feature_kwargs["window"]
+        self.csi = ShmRing(csi_capacity, np.complex64, (csi_decode.NUM_SUBCARRIERS,))
+        self.windows = ShmRing(
+            window_capacity, [("frame", "i8"), ("features", "f4", (window,))]
+        )
+        self.labels = ShmRing(window_capacity, [("frame", "i8"), ("label", "i4")])
+        self.stats_block = ShmRing(1, np.int64, (len(STAGES), len(STATS)))
+        ctx = get_context()
+        self.stop_event = ctx.Event()
+        args = {
+            "acquisition": (
+                backend_factory,
+                self.csi.spec(),
+                self.stats_block.spec(),
+                self.stop_event,
+                self.affinity.get("acquisition"),
+                frames_per_transfer,
+            ),
+            "features": (
+                self.feature_kwargs,
+                self.csi.spec(),
+                self.windows.spec(),
+                self.stats_block.spec(),
+                self.stop_event,
+                self.affinity.get("features"),
+            ),
+            "inference": (
+                str(model_path),
+                self.windows.spec(),
+                self.labels.spec(),
+                self.stats_block.spec(),
+                self.stop_event,
+                self.affinity.get("inference"),
+            ),
+        }
+        targets = {
+            "acquisition": acquisition_stage,
+            "features": feature_stage,
+            "inference": inference_stage,
+        }
+        self.processes = {
+            name: ctx.Process(target=targets[name], args=args[name], daemon=True)
+            for name in STAGES
+        }
+        self._start_time = None
+
+    def start(self):
+        self._start_time = time.perf_counter()
+        for process in self.processes.values():
+            process.start()
+        return self
+
+    def results(self):
+        """
+        The (frame, label) records classified since the last call
+        """
+        return self.labels.read()
+
+    @property
+    def done(self):
+        return bool(self.stats_block._data[0, -1, 4])
+
+    def stats(self):
+        """
+        Throughput, busy fraction and ring occupancy for each stage
+        """
+        elapsed = time.perf_counter() - self._start_time
+        counts = self.stats_block._data[0]
+        out = {}
+        for n, (name, ring) in enumerate(
+            zip(STAGES, (self.csi, self.windows, self.labels))
+        ):
+            out[name] = {
+                "in_per_s": counts[n, 0] / elapsed,
+                "out_per_s": counts[n, 1] / elapsed,
+                "dropped": int(counts[n, 2]),
+                "busy": counts[n, 3] * 1e-9 / elapsed,
+                "out_ring": len(ring) / ring.capacity,
+                "out_ring_max": ring.max_occupancy / ring.capacity,
+            }
+        return out
+
+    def stop(self):
+        self.stop_event.set()
+        for process in self.processes.values():
+            process.join()
+
+    def close(self):
+        for ring in (self.csi, self.windows, self.labels, self.stats_block):
+            ring.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        self.close()
+
+
+def emulated_backend(packet_rate=2000, duration=30, seed=0):
+    """
+    A GeneratorBackend replaying emulated gestures at packet_rate
+    """
+    from channel_emulator import ChannelEmulator, FRAMES_PER_TRANSFER
+    from dma_receiver import GeneratorBackend
+
+    emulator = ChannelEmulator(packet_rate=packet_rate, seed=seed)
+    return GeneratorBackend(
+        emulator.transfers(emulator.random_schedule(duration)),
+        rate=packet_rate / FRAMES_PER_TRANSFER,
+    )
+
+
+if __name__ == "__main__":
+    import functools
+    import tempfile
+    from pathlib import Path
+
+    from channel_emulator import ChannelEmulator, GESTURE_NAMES
+    from csi_features import CSIFeatures
+    from gesture_classifier import MLPClassifier, window_features
+
+    # Any model will do to measure throughput
+    emulator = ChannelEmulator(packet_rate=2000, seed=1)
+    csi, labels = emulator.session(emulator.random_schedule(20))
+    features = CSIFeatures(window=128, hop=16).update(csi)
+    y = labels[features.doppler_frames - 1]
+    model = MLPClassifier.from_templates(
+        window_features(features.doppler), y, GESTURE_NAMES
+    )
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    affinity = (
+        {name: [cpus[n % len(cpus)]] for n, name in enumerate(STAGES)} if cpus else {}
+    )
+    with tempfile.TemporaryDirectory() as path:
+        model_path = Path(path) / "model.npz"
+        model.save(model_path)
+        backend = functools.partial(emulated_backend, packet_rate=8000, duration=5)
+        labelled = 0
+        with Pipeline(backend, model_path, affinity=affinity) as pipeline:
+            while not pipeline.done:
+                time.sleep(0.5)
+                labelled += len(pipeline.results())
+            labelled += len(pipeline.results())
+            stats = pipeline.stats()
+    for name, s in stats.items():
+        print(
+            f"{name:>11}: {s['in_per_s']:8.0f} in/s {s['out_per_s']:8.0f} out/s, "
+            f"{s['dropped']} dropped, busy {100 * s['busy']:.0f}%, output ring "
+            f"max {100 * s['out_ring_max']:.0f}% full"
+        )
+    print(f"{labelled} windows classified, stages pinned to {affinity}")
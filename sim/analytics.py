@@ -0,0 +1,235 @@
+"""
+Vectorized signal quality metrics for the testbenches and tools.
+
+Everything takes (N, L) arrays, N blocks of L samples along the last axis (a
+1-D array is a single block), and returns one value per block, so metrics
+over thousands of blocks take milliseconds:
+
+    to_signed(x)                  raw two's complement words to signed ints
+    to_complex(pairs)             (re, im) pairs to complex
+    unpack(words)                 {re, im} words to complex
+    magnitude_spectra(x)          |FFT| of every block, optionally windowed
+    sqnr(fixed, reference)        fixed point against a floating point reference
+    evm(lts_fft, csi)             EVM of LTS FFTs equalized with their CSI
+                                  against the known LTS in lts.txt
+    sfdr(x)                       spurious-free dynamic range of a tone
+    chain_sfdr(freqs)             the same for tones through the FIR/downsample
+                                  front end model
+
+Usage: python analytics.py [--blocks N] prints the front end's SFDR across the
+band and times the metrics.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+# FFT bins the equalizer keeps, in the order of its 52 CSI values
+USED_BINS = np.r_[1:27, 38:64]
+
+# 4-term Blackman-Harris, with -92 dB sidelobes to see spurs below a 16 bit tone
+BLACKMAN_HARRIS = (0.35875, 0.48829, 0.14128, 0.01168)
+
+
+def to_signed(x, width=16):
+    """
+    Reinterpret the low width bits of x as two's complement. Values that are
+    already signed come back unchanged.
+    """
+    x = np.asarray(x, dtype=np.int64) & ((1 << width) - 1)
+    return x - ((x >> (width - 1)) << width)
+
+
+def to_complex(pairs, width=16):
+    """
+    Complex samples from (..., 2) arrays of (re, im) pairs
+    """
+    pairs = np.asarray(pairs)
+    return to_signed(pairs[..., 0], width) + 1j * to_signed(pairs[..., 1], width)
+
+
+def unpack(words, width=16):
+    """
+    Complex samples from words packed as {re, im}, width bits each
+    """
+    words = np.asarray(words, dtype=np.int64)
+    return to_signed(words >> width, width) + 1j * to_signed(words, width)
+
+
+def window(length, kind="blackman_harris"):
+    """
+    A window of the given length, normalized to unit coherent gain so a
+    windowed tone's peak bin keeps the tone's amplitude
+    """
+    if kind is None:
+        return np.ones(length)
+    if kind != "blackman_harris":
+        raise ValueError(f"Unknown window {kind}")
+    phase = 2 * np.pi * np.arange(length) / length
+    w = sum((-1) ** k * a * np.cos(k * phase) for k, a in enumerate(BLACKMAN_HARRIS))
+    return w / w.mean()
+
+
+def magnitude_spectra(x, kind=None, db=False):
+    """
+    |FFT| of every block along the last axis, in dB if db
+    """
+    x = np.asarray(x)
+    mag = np.abs(np.fft.fft(x * window(x.shape[-1], kind), axis=-1))
+    if db:
+        with np.errstate(divide="ignore"):
+            return 20 * np.log10(mag)
+    return mag
+
+
+def error_ratio(x, reference, fit_gain=False):
+    """
+    Error power over reference power for every block. With fit_gain the
+    reference is first scaled by the complex gain that fits x best, for
+    chains that scale their output differently.
+    """
+    x = np.asarray(x)
+    reference = np.asarray(reference)
+    if fit_gain:
+        alpha = np.sum(np.conj(reference) * x, axis=-1, keepdims=True) / np.sum(
+            np.abs(reference) ** 2, axis=-1, keepdims=True
+        )
+        reference = alpha * reference
+    err = np.sum(np.abs(x - reference) ** 2, axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return err / np.sum(np.abs(reference) ** 2, axis=-1)
+
+
+def sqnr(fixed, reference, fit_gain=False):
+    """
+    Signal to quantization noise ratio in dB of every block of fixed, which
+    should be on the same scale as reference unless fit_gain
+    """
+    with np.errstate(divide="ignore"):
+        return -10 * np.log10(error_ratio(fixed, reference, fit_gain))
+
+
+def expand_csi(csi):
+    """
+    Place (N, 52) CSI on the 64 FFT bins, with NaN on the unused ones
+    """
+    csi = np.asarray(csi)
+    out = np.full(csi.shape[:-1] + (64,), np.nan, dtype=complex)
+    out[..., USED_BINS] = csi
+    return out
+
+
+def evm(lts_fft, csi, lts=None):
+    """
+    RMS EVM (as a fraction) of (N, 64) LTS FFTs divided by their (N, 52) CSI
+    against the FFT of the 64 sample LTS, lts.txt by default. The gain of
+    each block is fitted, since the FFT and equalizer scale differently.
+    """
+    if lts is None:
+        from golden_cache import lts_ref
+
+        lts = lts_ref()
+    reference = np.fft.fft(lts)[USED_BINS]
+    equalized = np.asarray(lts_fft)[..., USED_BINS] / np.asarray(csi)
+    reference = np.broadcast_to(reference, equalized.shape)
+    return np.sqrt(error_ratio(equalized, reference, fit_gain=True))
+
+
+def sfdr(x, guard=4, dc=True, kind="blackman_harris"):
+    """
+    Spurious-free dynamic range in dB of every block: the largest bin over the
+    largest bin more than guard bins away from it (and from DC unless dc).
+    Complex blocks use the whole spectrum, real ones the positive half.
+    """
+    x = np.asarray(x)
+    power = magnitude_spectra(x, kind) ** 2
+    if not np.iscomplexobj(x):
+        power = power[..., : x.shape[-1] // 2 + 1]
+    bins = np.arange(x.shape[-1])[: power.shape[-1]]
+    n = x.shape[-1]
+    peak = np.argmax(power, axis=-1)[..., None]
+    # Circular distance, so guard bands wrap around the ends of the spectrum
+    dist = np.abs((bins - peak + n // 2) % n - n // 2)
+    spurs = dist > guard
+    if not dc:
+        spurs &= np.minimum(bins, n - bins) > guard
+    carrier = np.take_along_axis(power, peak, axis=-1)[..., 0]
+    spur = np.max(np.where(spurs, power, 0), axis=-1)
+    with np.errstate(divide="ignore"):
+        return 10 * np.log10(carrier / spur)
+
+
+def chain_sfdr(freqs, level_db=-6, length=4096, fs=122.88e6, **front_end_args):
+    """
+    SFDR of the FIR/downsample front end model for a complex tone at each
+    frequency (in Hz, within the 20 MSPS output band) at level_db dBFS,
+    measured over length output samples
+    """
+    from golden_cache import SIM_PATH  # noqa: F401, puts the model on sys.path
+    from csi_model import front_end
+
+    # Enough input for length outputs after the FIR's pipeline fills
+    n = int(np.ceil(length * fs / 20e6)) + 64
+    t = np.arange(n) / fs
+    amplitude = (2**15 - 1) * 10 ** (level_db / 20)
+    out = []
+    for f in np.atleast_1d(freqs):
+        tone = amplitude * np.exp(2j * np.pi * f * t)
+        i, q, _ = front_end(
+            np.round(tone.real).astype(np.int64),
+            np.round(tone.imag).astype(np.int64),
+            **front_end_args,
+        )
+        out.append(i[-length:] + 1j * q[-length:])
+    return sfdr(np.array(out), dc=False)
+
+
+def _timed(name, fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    print(f"{name:20s} {1e3 * (time.perf_counter() - start):8.2f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--blocks", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    freqs = np.linspace(-9e6, 9e6, 7)
+    print("Front end SFDR at -6 dBFS:")
+    for f, s in zip(freqs, chain_sfdr(freqs)):
+        print(f"  {f / 1e6:5.1f} MHz {s:6.1f} dBc")
+
+    print(f"Metrics over {args.blocks} blocks of 64:")
+    x = rng.normal(size=(args.blocks, 64)) + 1j * rng.normal(size=(args.blocks, 64))
+    x *= 2**11
+    ref = np.fft.fft(x, axis=-1) / 32
+    fixed = np.round(ref.real) + 1j * np.round(ref.imag)
+    words = (to_signed(fixed.real).astype(np.uint32) << 16) | (
+        to_signed(fixed.imag).astype(np.uint32) & 0xFFFF
+    )
+    _timed("unpack", unpack, words)
+    _timed("magnitude_spectra", magnitude_spectra, x)
+    s = _timed("sqnr", sqnr, fixed, ref)
+    print(f"  median SQNR of rounding {np.median(s):.1f} dB")
+    lts = np.exp(2j * np.pi * rng.random(64))
+    channel = rng.normal(size=(args.blocks, 52)) + 1j * rng.normal(
+        size=(args.blocks, 52)
+    )
+    lts_fft = np.fft.fft(lts) * expand_csi(channel)
+    e = _timed("evm", evm, lts_fft, channel, lts)
+    print(f"  median EVM of an exact CSI {np.median(e):.2e}")
+    tones = np.exp(
+        2j * np.pi * rng.uniform(-0.4, 0.4, (args.blocks, 1)) * np.arange(64)
+    )
+    _timed(
+        "sfdr", sfdr, np.round(2**14 * tones.real) + 1j * np.round(2**14 * tones.imag)
+    )
+
+
+if __name__ == "__main__":
+    main()
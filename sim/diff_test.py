@@ -0,0 +1,507 @@
+"""
+Differential tests of the csi_extractor blocks against their bit-accurate
+models in model/csi_model.py.
+
+Every seed picks random stimulus for a block (random IQ, a random number of
+invalid cycles between input samples and a random tready duty cycle on the
+output), runs it through the RTL and compares every output bit-exactly with
+the model. Seeds are split into batches that run as separate simulations in
+a process pool (one build per block); each simulation resets the block
+between seeds. Failing seeds are written to diff_failures/<block>_<seed>.json
+so they can be replayed with waves on.
+
+Usage: python diff_test.py [--blocks fir_17,equalizer] [--seeds 1000]
+                           [--first-seed 0] [--batch 50] [--workers N]
+       python diff_test.py --replay diff_failures/fir_17_123.json
+"""
+
+import argparse
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+import cocotb
+from cocotb.clock import Clock
+from cocotb.triggers import ClockCycles, FallingEdge, ReadOnly
+
+import golden_cache  # noqa: F401 (puts model/ on the path)
+import csi_model
+
+SIM_PATH = Path(__file__).resolve().parent
+HDL_PATH = SIM_PATH.parent / "WaveSense/ip_repo/csi_extractor_1_0/hdl"
+BUILD_PATH = SIM_PATH / "sim_build" / "diff"
+FAILURE_PATH = SIM_PATH / "diff_failures"
+
+# An input or output stream: its valid/ready/last signals (ready and last may
+# be None) and data signals as (name, signed)
+Stream = namedtuple("Stream", ["valid", "ready", "last", "data"])
+
+# Output tready duty cycles a seed picks from
+READY_DUTIES = (1.0, 0.9, 0.5, 0.1)
+
+# A block under test. stimulus(rng) returns the input beats (n, len(data))
+# and model(beats) the expected output beats (m, len(data)). ready_duties
+# narrows the output duty cycles for blocks that only ever see some of them.
+Block = namedtuple(
+    "Block",
+    [
+        "sources",
+        "parameters",
+        "clocks",
+        "reset",
+        "reset_active",
+        "inputs",
+        "outputs",
+        "stimulus",
+        "model",
+        "ready_duties",
+    ],
+    defaults=[READY_DUTIES],
+)
+
+
+def _iq(rng, n, width=16):
+    return rng.integers(-(1 << (width - 1)), 1 << (width - 1), (n, 2))
+
+
+def _length(rng, low=32, high=512):
+    return int(rng.integers(low, high))
+
+
+def _equalizer_stimulus(rng):
+    pairs = int(rng.integers(1, 5))
+    beats = _iq(rng, 128 * pairs)
+    last = (np.arange(len(beats)) % 64 == 63).astype(np.int64)
+    return np.column_stack((last, beats))
+
+
+def _block_fft_stimulus(rng):
+    blocks = int(rng.integers(1, 5))
+    beats = _iq(rng, 64 * blocks)
+    last = (np.arange(len(beats)) % 64 == 63).astype(np.int64)
+    return np.column_stack((last, beats))
+
+
+def _block_fft_model(beats):
+    fft = csi_model.fftmain((beats[:, 1] + 1j * beats[:, 2]).reshape(-1, 64)).ravel()
+    last = (np.arange(len(fft)) % 64 == 63).astype(np.int64)
+    return np.column_stack((last, fft.real, fft.imag)).astype(np.int64)
+
+
+def _equalizer_model(beats):
+    fft = (beats[:, 1] + 1j * beats[:, 2]).reshape(-1, 64)
+    csi = csi_model.equalizer(fft[0::2], fft[1::2]).ravel()
+    last = np.zeros(len(csi), dtype=np.int64)
+    last[51::52] = 1
+    return np.column_stack((last, csi.real, csi.imag)).astype(np.int64)
+
+
+BLOCKS = {
+    "complex_to_mag_sq": Block(
+        ["complex_to_mag_sq.sv", "complex_multiply.sv"],
+        {},
+        ["clk_in"],
+        "rst_in",
+        1,
+        Stream("iq_valid_in", None, None, [("i_in", True), ("q_in", True)]),
+        Stream("mag_sq_valid_out", None, None, [("mag_sq_out", False)]),
+        lambda rng: _iq(rng, _length(rng)),
+        lambda x: csi_model.complex_to_mag_sq(x[:, 0], x[:, 1])[:, None],
+    ),
+    "moving_avg": Block(
+        ["moving_avg.sv"],
+        {},
+        ["clk_in"],
+        "rst_in",
+        1,
+        Stream("data_in_valid", None, None, [("data_in", True)]),
+        Stream("data_out_valid", None, None, [("data_out", True)]),
+        lambda rng: rng.integers(-(1 << 31), 1 << 31, (_length(rng), 1)),
+        lambda x: csi_model.moving_avg(x[:, 0])[:, None],
+    ),
+    "delay_sample": Block(
+        ["delay_sample.sv"],
+        {},
+        ["clk_in"],
+        "rst_in",
+        1,
+        Stream("data_in_valid", None, None, [("data_in", False)]),
+        Stream("data_out_valid", None, None, [("data_out", False)]),
+        lambda rng: rng.integers(0, 1 << 32, (_length(rng), 1)),
+        lambda x: csi_model.delay_sample(x[:, 0])[:, None],
+    ),
+    "fir_17": Block(
+        ["fir_17.sv"],
+        {"C_S_AXIS_TDATA_WIDTH": 16, "C_M_AXIS_TDATA_WIDTH": 27},
+        ["aclk"],
+        "aresetn",
+        0,
+        Stream(
+            "s_axis_data_tvalid",
+            "s_axis_data_tready",
+            None,
+            [("s_axis_data_tdata", True)],
+        ),
+        Stream(
+            "m_axis_data_tvalid",
+            "m_axis_data_tready",
+            None,
+            [("m_axis_data_tdata", True)],
+        ),
+        lambda rng: rng.integers(-(1 << 15), 1 << 15, (_length(rng), 1)),
+        lambda x: csi_model.fir_17(x[:, 0])[:, None],
+    ),
+    "downsample": Block(
+        ["downsample.sv"],
+        {"SAMPLE_RATE_IN": 122880, "SAMPLE_RATE_OUT": 20000},
+        ["s00_axis_aclk", "m00_axis_aclk"],
+        "s00_axis_aresetn",
+        0,
+        Stream("s00_axis_tvalid", "s00_axis_tready", None, [("s00_axis_tdata", False)]),
+        Stream("m00_axis_tvalid", "m00_axis_tready", None, [("m00_axis_tdata", False)]),
+        lambda rng: rng.integers(0, 1 << 32, (_length(rng, 64, 2048), 1)),
+        lambda x: csi_model.downsample(x[:, 0])[:, None],
+    ),
+    "lts_xcorr": Block(
+        ["lts_xcorr.sv", "complex_multiply.sv"],
+        {},
+        ["clk_in"],
+        "rst_in",
+        1,
+        Stream(
+            "signal_axis_tvalid",
+            "signal_axis_tready",
+            None,
+            [("signal_i_axis_tdata", True), ("signal_q_axis_tdata", True)],
+        ),
+        Stream(
+            "xcorr_axis_tvalid",
+            "xcorr_axis_tready",
+            None,
+            [("xcorr_i_axis_tdata", True), ("xcorr_q_axis_tdata", True)],
+        ),
+        lambda rng: _iq(rng, _length(rng)),
+        lambda x: np.column_stack(csi_model.lts_xcorr(x[:, 0], x[:, 1])),
+        # complex_multiply isn't gated by xcorr_axis_tready, so backpressure
+        # loses samples, but sync_long ties it high
+        ready_duties=(1.0,),
+    ),
+    "equalizer": Block(
+        [
+            "equalizer.sv",
+            "pipeline.sv",
+            "xilinx_true_dual_port_read_first_2_clock_ram.v",
+            "bram_fifo.sv",
+        ],
+        {},
+        ["clk_in"],
+        "rst_in",
+        1,
+        Stream(
+            "fft_axis_tvalid",
+            "fft_axis_tready",
+            "fft_axis_tlast",
+            [("fft_re_axis_tdata", True), ("fft_im_axis_tdata", True)],
+        ),
+        Stream(
+            "csi_axis_tvalid",
+            "csi_axis_tready",
+            "csi_axis_tlast",
+            [("csi_re_axis_tdata", True), ("csi_im_axis_tdata", True)],
+        ),
+        _equalizer_stimulus,
+        _equalizer_model,
+    ),
+    "block_fft": Block(
+        [
+            "block_fft.sv",
+            "axis_fft.sv",
+            "bram_fifo.sv",
+            "../src/fft-core/fftmain.v",
+            "../src/fft-core/bimpy.v",
+            "../src/fft-core/bitreverse.v",
+            "../src/fft-core/butterfly.v",
+            "../src/fft-core/convround.v",
+            "../src/fft-core/fftstage.v",
+            "../src/fft-core/hwbfly.v",
+            "../src/fft-core/laststage.v",
+            "../src/fft-core/longbimpy.v",
+            "../src/fft-core/qtrstage.v",
+        ],
+        {},
+        ["clk_in"],
+        "rst_in",
+        1,
+        Stream(
+            "sample_axis_tvalid",
+            "sample_axis_tready",
+            "sample_axis_tlast",
+            [("sample_re_axis_tdata", True), ("sample_im_axis_tdata", True)],
+        ),
+        Stream(
+            "fft_axis_tvalid",
+            "fft_axis_tready",
+            "fft_axis_tlast",
+            [("fft_re_axis_tdata", True), ("fft_im_axis_tdata", True)],
+        ),
+        _block_fft_stimulus,
+        _block_fft_model,
+    ),
+}
+
+
+def case(seed, block=None):
+    """
+    The random parts of a seed other than the stimulus: the most invalid
+    cycles between input beats and the output tready duty cycle
+    """
+    rng = np.random.default_rng([seed, 1])
+    duties = READY_DUTIES if block is None else block.ready_duties
+    return {
+        "max_gap": int(rng.choice([0, 0, 1, 3, 8])),
+        "ready_duty": float(rng.choice(duties)),
+    }
+
+
+async def _drive(dut, clk, stream, beats, max_gap, rng):
+    valid = getattr(dut, stream.valid)
+    for beat in beats:
+        for _ in range(int(rng.integers(0, max_gap + 1))):
+            await FallingEdge(clk)
+            valid.value = 0
+        await FallingEdge(clk)
+        values = iter(beat)
+        if stream.last is not None:
+            getattr(dut, stream.last).value = int(next(values))
+        for (name, _), value in zip(stream.data, values):
+            getattr(dut, name).value = int(value)
+        valid.value = 1
+        if stream.ready is not None:
+            await ReadOnly()
+            while not getattr(dut, stream.ready).value:
+                await FallingEdge(clk)
+                await ReadOnly()
+    await FallingEdge(clk)
+    valid.value = 0
+
+
+async def _backpressure(dut, clk, stream, duty, rng):
+    while True:
+        await FallingEdge(clk)
+        getattr(dut, stream.ready).value = int(rng.uniform() < duty)
+
+
+async def _capture(dut, clk, stream, out):
+    signals = [(getattr(dut, name), signed) for name, signed in stream.data]
+    valid = getattr(dut, stream.valid)
+    ready = getattr(dut, stream.ready) if stream.ready else None
+    last = getattr(dut, stream.last) if stream.last else None
+    while True:
+        await FallingEdge(clk)
+        await ReadOnly()
+        if valid.value and (ready is None or ready.value):
+            beat = [int(last.value)] if last is not None else []
+            beat += [
+                s.value.signed_integer if signed else s.value.integer
+                for s, signed in signals
+            ]
+            out.append(beat)
+
+
+async def run_seed(dut, clk, block, seed):
+    """
+    Reset the block, run one seed through it and compare with the model
+    """
+    rng = np.random.default_rng(seed)
+    beats = np.asarray(block.stimulus(rng), dtype=np.int64)
+    expected = np.asarray(block.model(beats), dtype=np.int64)
+    params = case(seed, block)
+    getattr(dut, block.inputs.valid).value = 0
+    if block.outputs.ready is not None:
+        getattr(dut, block.outputs.ready).value = 1
+    getattr(dut, block.reset).value = block.reset_active
+    await ClockCycles(clk, 2)
+    getattr(dut, block.reset).value = 1 - block.reset_active
+    received = []
+    tasks = [cocotb.start_soon(_capture(dut, clk, block.outputs, received))]
+    if block.outputs.ready is not None:
+        tasks.append(
+            cocotb.start_soon(
+                _backpressure(dut, clk, block.outputs, params["ready_duty"], rng)
+            )
+        )
+    await _drive(dut, clk, block.inputs, beats, params["max_gap"], rng)
+    # Give the outputs time to drain at the output duty cycle
+    limit = 200 + int(4 * len(expected) / params["ready_duty"])
+    for _ in range(limit):
+        if len(received) >= len(expected):
+            break
+        await FallingEdge(clk)
+    await ClockCycles(clk, 20)
+    for task in tasks:
+        task.kill()
+    return compare(seed, params, beats, expected, received)
+
+
+def compare(seed, params, beats, expected, received):
+    """
+    The result of a seed: whether the received beats match the model's
+    """
+    received = np.array(received, dtype=np.int64).reshape(-1, expected.shape[1])
+    n = min(len(received), len(expected))
+    diff = np.flatnonzero((received[:n] != expected[:n]).any(axis=1))
+    mismatch = int(diff[0]) if len(diff) else None
+    return {
+        "seed": seed,
+        **params,
+        "inputs": len(beats),
+        "expected": len(expected),
+        "received": len(received),
+        "passed": mismatch is None and len(received) == len(expected),
+        "mismatch": mismatch,
+        "got": received[mismatch].tolist() if mismatch is not None else None,
+        "want": expected[mismatch].tolist() if mismatch is not None else None,
+    }
+
+
+@cocotb.test(skip=os.getenv("DIFF_BLOCK") is None)
+async def differential_test(dut):
+    """
+    Runs the seeds in DIFF_SEEDS (comma separated) through DIFF_BLOCK and
+    writes the results to DIFF_OUT
+    """
+    block = BLOCKS[os.environ["DIFF_BLOCK"]]
+    clocks = [getattr(dut, name) for name in block.clocks]
+    for clk in clocks:
+        cocotb.start_soon(Clock(clk, 10, units="ns").start())
+    results = []
+    for seed in map(int, os.environ["DIFF_SEEDS"].split(",")):
+        results.append(await run_seed(dut, clocks[0], block, seed))
+    Path(os.environ.get("DIFF_OUT", "diff.json")).write_text(json.dumps(results))
+    failed = [r["seed"] for r in results if not r["passed"]]
+    assert not failed, f"Seeds {failed} differ from the model"
+
+
+def build(name, sim="icarus", waves=False):
+    from cocotb.runner import get_runner
+
+    block = BLOCKS[name]
+    get_runner(sim).build(
+        sources=[HDL_PATH / source for source in block.sources],
+        hdl_toplevel=name,
+        build_args=["-Wall"],
+        parameters=block.parameters,
+        build_dir=BUILD_PATH / name,
+        timescale=("1ns", "1ps"),
+        waves=waves,
+    )
+
+
+def run_batch(name, seeds, sim="icarus", waves=False):
+    """
+    Simulate one batch of seeds, returning their results
+    """
+    from test_utils import run_in_project
+
+    results = run_in_project(
+        sim,
+        "DIFF_OUT",
+        {"DIFF_BLOCK": name, "DIFF_SEEDS": ",".join(map(str, seeds))},
+        test_dir=SIM_PATH if waves else None,
+        hdl_toplevel=name,
+        test_module="diff_test",
+        testcase="differential_test",
+        build_dir=BUILD_PATH / name,
+        parameters=BLOCKS[name].parameters,
+        waves=waves,
+    )
+    if results is None:
+        # The simulation died before writing anything
+        return [{"seed": s, "passed": False, "crashed": True} for s in seeds]
+    return results
+
+
+def run(
+    names,
+    seeds,
+    batch=50,
+    workers=None,
+    sim="icarus",
+    builder=build,
+    runner=run_batch,
+    suffix="",
+):
+    """
+    Run every seed through every block over a process pool, saving the
+    failures, and return {block: results}. builder(name, sim) builds a block
+    and runner(name, seeds, sim) simulates a batch, so lanes.py can run its
+    wrappers the same way; suffix keeps its failure files apart.
+    """
+    for name in names:
+        builder(name, sim)
+    jobs = [
+        (name, seeds[i : i + batch])
+        for name in names
+        for i in range(0, len(seeds), batch)
+    ]
+    results = {name: [] for name in names}
+    FAILURE_PATH.mkdir(exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(runner, n, s, sim) for n, s in jobs]
+        for (name, _), future in zip(jobs, futures):
+            for result in future.result():
+                results[name].append(result)
+                if not result["passed"]:
+                    path = FAILURE_PATH / f"{name}_{result['seed']}{suffix}.json"
+                    path.write_text(json.dumps({"block": name, **result}, indent=2))
+    return results
+
+
+def arguments(description, blocks=",".join(BLOCKS), batch=50):
+    """
+    The command line options shared with lanes.py
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--blocks", default=blocks)
+    parser.add_argument("--seeds", type=int, default=1000)
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--batch", type=int, default=batch)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--sim", default=os.getenv("SIM", "icarus"))
+    return parser
+
+
+def report(results, elapsed, setup):
+    """
+    Print how many seeds of each block passed
+    """
+    cases = sum(len(rows) for rows in results.values())
+    print(f"{cases} cases in {elapsed:.0f}s with {setup}")
+    for name, rows in results.items():
+        failed = [r["seed"] for r in rows if not r["passed"]]
+        print(
+            f"{name:>18}: {len(rows) - len(failed)}/{len(rows)} passed"
+            + (f", failing seeds saved to {FAILURE_PATH}" if failed else "")
+        )
+
+
+if __name__ == "__main__":
+    parser = arguments(__doc__.splitlines()[1])
+    parser.add_argument("--replay", help="A saved failure to run again with waves")
+    args = parser.parse_args()
+    if args.replay:
+        failure = json.loads(Path(args.replay).read_text())
+        build(failure["block"], args.sim, waves=True)
+        result = run_batch(failure["block"], [failure["seed"]], args.sim, waves=True)
+        print(json.dumps(result[0], indent=2))
+    else:
+        names = args.blocks.split(",")
+        seeds = list(range(args.first_seed, args.first_seed + args.seeds))
+        start = time.perf_counter()
+        results = run(names, seeds, args.batch, args.workers, args.sim)
+        report(results, time.perf_counter() - start, f"{args.workers} workers")
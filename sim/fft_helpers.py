@@ -1,6 +1,8 @@
 import numpy as np
 import matplotlib.pyplot as plt
 
+from analytics import magnitude_spectra, to_complex, unpack
+
 
 def generate_sample_data(fs: int, f0: int, f1: int, num_samples: int):
     """
@@ -25,22 +27,10 @@ def generate_sample_data(fs: int, f0: int, f1: int, num_samples: int):
 
 
 def get_results_fft(values):
-    magnitudes = []
-
-    # Extract real and imaginary parts
-    for real_part, imag_part in values:
-
-        if real_part > 2**15:
-            real_part -= 2**16
-        if imag_part > 2**15:
-            imag_part -= 2**16
-
-        real_part = np.int32(real_part)
-        imag_part = np.int32(imag_part)
-
-        magnitudes.append(np.sqrt(real_part**2 + imag_part**2))
-
-    return magnitudes
+    """
+    Magnitudes of (real, imag) output pairs, raw 16 bit or already signed
+    """
+    return np.abs(to_complex(values))
 
 
 def plot_results(values, num_samples, fs):
@@ -66,9 +56,7 @@ def plot_results(values, num_samples, fs):
 
 
 def plot_waveform(complex_samples, num_samples, fs):
-    # Extract real part
-    real_part = (complex_samples >> 16) & 0xFFFF  # Shift and mask to get the real part
-    real_part = np.int16(real_part)
+    real_part = unpack(complex_samples).real
 
     # Plot the real part (time domain)
     plt.figure(figsize=(10, 6))
@@ -80,15 +68,15 @@ def plot_waveform(complex_samples, num_samples, fs):
     plt.legend()
     plt.grid(True)
 
-    # Compute the FFT of the real part (frequency domain)
-    fft_result = np.fft.fft(real_part)
+    # Frequency domain
+    magnitudes = magnitude_spectra(real_part)
     fft_freq = np.fft.fftfreq(num_samples, 1 / fs)
 
     # Plot the magnitude of the FFT (frequency domain)
     plt.subplot(2, 1, 2)
     plt.plot(
         fft_freq[: num_samples // 2],
-        np.abs(fft_result)[: num_samples // 2],
+        magnitudes[: num_samples // 2],
         label="FFT",
         color="r",
     )
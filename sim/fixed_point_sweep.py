@@ -0,0 +1,221 @@
+"""
+Sweeps the bit widths and shifts of the csi_extractor datapath using the
+bit-accurate models in model/csi_model.py, one parameter point per worker.
+
+For every point it reports the CSI SNR/EVM against a floating point version of
+the same chain, the number of values that wrapped, how many packets were found
+and a rough DSP count for the FFT, and writes everything to a CSV table.
+
+Usage: python fixed_point_sweep.py [--workers N] [--out table.csv]
+                                   [--param fir_lsb=9,10,11 ...]
+"""
+
+import argparse
+import csv
+import itertools
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from golden_cache import SAMPLES_PATH, load_samples
+from analytics import error_ratio
+from csi_model import csi_extractor, downsample_mask
+from hdl_params import equalizer_masks, fir_17_coeffs
+from test_utils import upsample_data, DESIRED_SAMPLE_RATE, DATA_SAMPLE_RATE
+
+# The values in the RTL
+DEFAULT_PARAMS = {
+    "input_gain": 1.0,
+    "fir_width": 27,
+    "fir_lsb": 11,
+    "window_shift": 4,
+    "delay_shift": 4,
+    "fft_xbits": 2,
+    "fft_owidth": 16,
+    "fft_cbits": 4,
+    "eq_shift": 1,
+}
+
+# Values tried for each parameter; the grid is every combination of them
+SWEEP = {
+    "input_gain": [0.25, 1.0],
+    "fir_lsb": [9, 10, 11],
+    "window_shift": [3, 4],
+    "fft_xbits": [0, 1, 2],
+    "fft_cbits": [0, 2, 4],
+    "eq_shift": [0, 1],
+}
+
+# A packet counts as found if its LTS is within this many samples of the
+# one found with the default parameters
+MATCH_TOLERANCE = 8
+
+# Set up once per worker by init_worker()
+_stimulus = None
+
+
+def init_worker(samples_path=SAMPLES_PATH):
+    """
+    Load and upsample the stimulus, and find the packets in it with the
+    default parameters
+    """
+    global _stimulus
+    i, q = load_samples(samples_path)
+    i = upsample_data(i, DATA_SAMPLE_RATE, DESIRED_SAMPLE_RATE)
+    q = upsample_data(q, DATA_SAMPLE_RATE, DESIRED_SAMPLE_RATE)
+    rtl_params = {k: v for k, v in DEFAULT_PARAMS.items() if k != "input_gain"}
+    _, expected_starts = csi_extractor(
+        i.astype(np.int32), q.astype(np.int32), **rtl_params
+    )
+    _stimulus = (i, q, expected_starts)
+
+
+def reference_csi(i, q, starts):
+    """
+    Floating point CSI at the given LTS positions (no rounding or wrapping)
+    """
+    coeffs = fir_17_coeffs()
+    i_filt = np.convolve(i, coeffs)[len(coeffs) - 1 : len(i)]
+    q_filt = np.convolve(q, coeffs)[len(coeffs) - 1 : len(q)]
+    keep = downsample_mask(len(i_filt))
+    x = i_filt[keep] + 1j * q_filt[keep]
+    idx = starts[:, None] + np.arange(128)
+    fft = np.fft.fft(x[idx].reshape(-1, 2, 64), axis=2)
+    pos, neg = equalizer_masks()
+    sign = np.where(neg, -1, 1)[pos | neg]
+    return sign * (fft[:, 0, pos | neg] + fft[:, 1, pos | neg]) / 2
+
+
+def fft_dsp_count(iwidth=16, xbits=2, cbits=4):
+    """
+    Rough DSP48E2 (27x18 multiplier) count for the four hwbfly stages of the FFT
+    """
+
+    def dsps(a, b):
+        return min(
+            math.ceil(a / 27) * math.ceil(b / 18), math.ceil(a / 18) * math.ceil(b / 27)
+        )
+
+    total = 0
+    width = iwidth
+    for _ in range(4):
+        cwidth = width + cbits
+        total += 2 * dsps(cwidth, width + 1) + dsps(cwidth + 1, width + 2)
+        width = iwidth + xbits
+    return total
+
+
+def run_point(params):
+    """
+    Run the model for one parameter point and return its row of the table
+    """
+    i, q, expected_starts = _stimulus
+    params = {**DEFAULT_PARAMS, **params}
+    gain = params.pop("input_gain")
+    # The ADC can only give 16 bit samples
+    i = np.clip(i * gain, -(2**15), 2**15 - 1)
+    q = np.clip(q * gain, -(2**15), 2**15 - 1)
+    overflow = {}
+    start = time.perf_counter()
+    csi, starts = csi_extractor(
+        i.astype(np.int32), q.astype(np.int32), overflow=overflow, **params
+    )
+    runtime = time.perf_counter() - start
+    # Match the packets found against the expected ones
+    dist = np.abs(starts[:, None] - expected_starts[None, :])
+    matched = (dist <= MATCH_TOLERANCE).any(axis=1)
+    found = int(np.count_nonzero((dist <= MATCH_TOLERANCE).any(axis=0)))
+    # EVM after fitting the overall (complex) gain, since the candidates scale
+    # the CSI differently
+    evm = float("nan")
+    if len(starts):
+        ref = reference_csi(i.astype(np.int32), q.astype(np.int32), starts)
+        evm = float(np.sqrt(error_ratio(csi.ravel(), ref.ravel(), fit_gain=True)))
+    return {
+        "input_gain": gain,
+        **params,
+        "evm_pct": 100 * evm,
+        # NaN when no packet was found
+        "snr_db": float("inf") if evm == 0 else -20 * np.log10(evm),
+        "detection_rate": found / len(expected_starts),
+        "false_detections": int(np.count_nonzero(~matched)),
+        "overflows": sum(overflow.values()),
+        **{f"overflow_{name}": count for name, count in overflow.items()},
+        "fft_dsps": fft_dsp_count(16, params["fft_xbits"], params["fft_cbits"]),
+        "runtime_s": runtime,
+    }
+
+
+def grid(sweep=SWEEP):
+    """
+    Every combination of the values in `sweep`
+    """
+    names = list(sweep)
+    return [dict(zip(names, values)) for values in itertools.product(*sweep.values())]
+
+
+def sweep(points, workers=None, samples_path=SAMPLES_PATH):
+    """
+    Run every parameter point over a process pool
+    """
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(samples_path,)
+    ) as executor:
+        return list(executor.map(run_point, points))
+
+
+def write_table(rows, path):
+    """
+    Write the results to a CSV file
+    """
+    fields = list(dict.fromkeys(key for row in rows for key in row))
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(
+                {k: f"{v:.4g}" if isinstance(v, float) else v for k, v in row.items()}
+            )
+
+
+def parse_param(arg):
+    """
+    Parse a --param name=v1,v2,... argument
+    """
+    name, values = arg.split("=")
+    if name not in DEFAULT_PARAMS:
+        raise argparse.ArgumentTypeError(f"Unknown parameter {name}")
+    kind = type(DEFAULT_PARAMS[name])
+    return name, [kind(v) for v in values.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--out",
+        default=str(Path(__file__).resolve().parent / "fixed_point_sweep.csv"),
+    )
+    parser.add_argument("--param", type=parse_param, action="append", default=[])
+    args = parser.parse_args()
+    points = grid({**SWEEP, **dict(args.param)})
+    start = time.perf_counter()
+    rows = sweep(points, args.workers)
+    write_table(rows, args.out)
+    print(
+        f"{len(rows)} points in {time.perf_counter() - start:.1f}s "
+        f"with {args.workers} workers -> {args.out}"
+    )
+    # The most accurate candidate for each DSP budget
+    best = {}
+    for row in rows:
+        if row["detection_rate"] == 1 and row["false_detections"] == 0:
+            if row["snr_db"] > best.get(row["fft_dsps"], {}).get("snr_db", -np.inf):
+                best[row["fft_dsps"]] = row
+    for dsps, row in sorted(best.items()):
+        params = ", ".join(f"{k}={row[k]}" for k in SWEEP)
+        print(f"{dsps:3d} DSPs: {row['snr_db']:5.1f} dB SNR ({params})")
@@ -0,0 +1,135 @@
+"""
+Content-addressed cache of the golden vectors the testbenches compare against.
+
+Each golden array is stored as golden/<name>-<key>.npy, where the key hashes
+everything the array depends on: the stimulus files, the model version, the
+coefficient tables in the HDL and the parameters. A changed input gives a new
+key, so the array is regenerated and the stale file for that name is removed.
+"""
+
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+SIM_PATH = Path(__file__).resolve().parent
+GOLDEN_PATH = SIM_PATH / "golden"
+sys.path.append(str(SIM_PATH / "model"))
+
+from csi_model import MODEL_VERSION, csi_extractor_lts, lts_extractor
+from hdl_params import fir_17_coeffs, lts_xcorr_coeffs
+from test_utils import upsample_data, DESIRED_SAMPLE_RATE, DATA_SAMPLE_RATE
+
+SAMPLES_PATH = SIM_PATH / "samples.dat"
+LTS_REF_PATH = SIM_PATH / "lts.txt"
+
+
+def file_digest(path):
+    """
+    sha256 of a file's contents
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(files=(), params=None, model=True):
+    """
+    Hash the inputs of a golden array into a hex key.
+
+    If `model` is set the key also covers MODEL_VERSION and the coefficient
+    tables in fir_17.sv and lts_xcorr.sv.
+    """
+    digest = hashlib.sha256()
+    for path in files:
+        digest.update(file_digest(path).encode())
+    if model:
+        digest.update(str(MODEL_VERSION).encode())
+        digest.update(fir_17_coeffs().tobytes())
+        digest.update(lts_xcorr_coeffs().tobytes())
+    digest.update(json.dumps(params or {}, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+
+def golden(name, compute, files=(), params=None, model=True):
+    """
+    Load the golden array `name`, calling compute() to regenerate it if any of
+    its inputs changed. The array is memory-mapped read-only.
+    """
+    key = cache_key(files, params, model)
+    path = GOLDEN_PATH / f"{name}-{key}.npy"
+    if not path.exists():
+        GOLDEN_PATH.mkdir(exist_ok=True)
+        arr = np.asarray(compute())
+        # Write to a temporary file first so parallel runs never see half an array
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, arr)
+        os.replace(tmp_path, path)
+        # Remove the outdated versions of this array
+        for stale in GOLDEN_PATH.glob(f"{name}-*.npy"):
+            if stale != path:
+                stale.unlink(missing_ok=True)
+    return np.load(path, mmap_mode="r")
+
+
+def load_samples(path=SAMPLES_PATH):
+    """
+    Read the interleaved 16 bit I/Q samples in a .dat file
+    """
+    signal = np.fromfile(path, dtype=np.int16)
+    return signal[::2], signal[1::2]
+
+
+def lts_ref():
+    """
+    The 64 sample long training symbol in lts.txt
+    """
+    return golden(
+        "lts_ref",
+        lambda: np.loadtxt(LTS_REF_PATH).view(complex),
+        files=[LTS_REF_PATH],
+        model=False,
+    )
+
+
+def lts_arr(sw=4, samples_path=SAMPLES_PATH):
+    """
+    LTS symbols `lts_extractor` finds in samples_path when fed directly
+    """
+
+    def compute():
+        i, q = load_samples(samples_path)
+        return lts_extractor(i, q, sw)
+
+    return golden("lts_arr", compute, files=[samples_path], params={"sw": sw})
+
+
+def lts_arr_from_csi_extractor(sw=4, samples_path=SAMPLES_PATH):
+    """
+    LTS symbols `csi_extractor` finds in samples_path after upsampling it to
+    122.88 MSPS the same way the testbench does
+    """
+
+    def compute():
+        i, q = load_samples(samples_path)
+        i = upsample_data(i, DATA_SAMPLE_RATE, DESIRED_SAMPLE_RATE)
+        q = upsample_data(q, DATA_SAMPLE_RATE, DESIRED_SAMPLE_RATE)
+        # The AXIS driver truncates the samples with np.int32
+        return csi_extractor_lts(i.astype(np.int32), q.astype(np.int32), sw)
+
+    return golden(
+        "lts_arr_from_csi_extractor",
+        compute,
+        files=[samples_path],
+        params={
+            "sw": sw,
+            "rate_in": DATA_SAMPLE_RATE,
+            "rate_out": DESIRED_SAMPLE_RATE,
+        },
+    )
@@ -0,0 +1,484 @@
+"""
+Runs many differential test seeds through one simulation by putting N
+independent copies of a block side by side.
+
+cocotb's cost is in the awaits and signal accesses per cycle, not the size
+of the design, so wrapper() generates a `<block>_lanes` module holding
+LANES instances of a block, with the clocks and resets shared and every
+other port packed into one LANES times wider vector (lane k in bits
+[k*W +: W]). LaneBench then drives the input stream and captures the output
+stream of every lane with one write or read per port per cycle, keeping the
+handshakes of all the lanes in NumPy arrays, so a seed per lane costs about
+as much simulator time as one seed on its own.
+
+The blocks and their models are diff_test.BLOCKS and the results are the
+same as diff_test's. Failures are saved as
+diff_failures/<block>_<seed>_lanes.json, apart from diff_test's, and replay
+with diff_test.py --replay. Each lane has its own stimulus, gap and tready
+duty cycle from its seed, but the random gaps and backpressure come from one
+generator shared by the lanes, so the replay gets the same stimulus with a
+different random pattern.
+
+Usage: python lanes.py [--blocks lts_xcorr,equalizer,block_fft] [--lanes 16]
+                       [--seeds 1000] [--first-seed 0] [--batch 128]
+                       [--workers N]
+       python lanes.py --emit sync_short [--lanes 16] [--param NAME=VALUE]
+"""
+
+import ast
+import json
+import operator
+import os
+import re
+import time
+from collections import namedtuple
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+
+import cocotb
+from cocotb.clock import Clock
+from cocotb.triggers import ClockCycles, FallingEdge, ReadOnly
+
+import diff_test
+from diff_test import BLOCKS, HDL_PATH, SIM_PATH, case, compare
+from test_utils import run_in_project
+
+BUILD_PATH = SIM_PATH / "sim_build" / "lanes"
+
+# A port of the block: its direction, bits and whether it is shared by the
+# lanes
+Port = namedtuple("Port", ["name", "direction", "width", "shared"])
+
+_HEADER = re.compile(
+    r"module\s+(\w+)\s*(?:#\s*\((?P<params>.*?)\))?\s*\((?P<ports>.*?)\)\s*;",
+    re.S,
+)
+
+
+# Operators allowed in parameter and width expressions
+_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.floordiv,
+    ast.USub: operator.neg,
+}
+
+
+def _strip_comments(text):
+    return re.sub(r"//.*?$|/\*.*?\*/", "", text, flags=re.S | re.M)
+
+
+def _evaluate(expression, values):
+    """
+    The value of an integer expression of numbers, parameters and + - * /
+    """
+
+    def value(node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, int):
+            return node.value
+        if isinstance(node, ast.Name):
+            if node.id not in values:
+                raise ValueError(f"Parameter {node.id} has no default, give it a value")
+            return values[node.id]
+        if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+            return _OPERATORS[type(node.op)](value(node.left), value(node.right))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _OPERATORS:
+            return _OPERATORS[type(node.op)](value(node.operand))
+        raise ValueError(f"Can't work out {expression.strip()!r}")
+
+    try:
+        # Drop the digit separators in numbers like 122_880
+        tree = ast.parse(re.sub(r"(?<=\d)_(?=\d)", "", expression.strip()), mode="eval")
+    except SyntaxError:
+        raise ValueError(f"Can't work out {expression.strip()!r}") from None
+    return value(tree.body)
+
+
+def find_module(module, hdl_path=HDL_PATH):
+    """
+    The file in hdl_path that defines module
+    """
+    for path in sorted(Path(hdl_path).glob("*.sv")):
+        text = _strip_comments(path.read_text())
+        if any(m.group(1) == module for m in _HEADER.finditer(text)):
+            return path
+    raise ValueError(f"No module {module} in {hdl_path}")
+
+
+def module_ports(path, module, parameters=None, shared=("clk_in", "rst_in")):
+    """
+    The ports of an ANSI-style module, with their widths worked out for the
+    given parameters
+    """
+    text = _strip_comments(Path(path).read_text())
+    headers = [m for m in _HEADER.finditer(text) if m.group(1) == module]
+    if not headers:
+        raise ValueError(f"No module {module} in {path}")
+    header = headers[0]
+    values = {}
+    for name, value in re.findall(
+        r"parameter\s+(?:\w+\s+)?(\w+)\s*=\s*([^,]+)", header["params"] or ""
+    ):
+        values[name] = _evaluate(value, values)
+    values.update(parameters or {})
+    ports = []
+    direction = width = None
+    for item in header["ports"].split(","):
+        words = item.split()
+        if not words:
+            continue
+        if words[0] in ("input", "output"):
+            direction = words[0]
+            packed = re.search(r"\[(.*?):(.*?)\]", item)
+            width = (
+                _evaluate(packed[1], values) - _evaluate(packed[2], values) + 1
+                if packed
+                else 1
+            )
+        name = words[-1]
+        ports.append(Port(name, direction, width, name in shared))
+    return ports
+
+
+def wrapper(module, path, parameters=None, shared=("clk_in", "rst_in"), lanes=8):
+    """
+    SystemVerilog for `<module>_lanes`: LANES copies of module with the shared
+    ports in common and the rest packed lane by lane
+    """
+    parameters = parameters or {}
+    ports = module_ports(path, module, parameters, shared)
+    lines = [
+        f"// Generated by lanes.py: LANES independent copies of {module}",
+        f"module {module}_lanes #(",
+        f"    parameter integer LANES = {lanes}",
+        ") (",
+    ]
+    declarations = []
+    for port in ports:
+        if port.shared:
+            bits = f"[{port.width - 1}:0] " if port.width > 1 else ""
+        elif port.width > 1:
+            bits = f"[LANES*{port.width}-1:0] "
+        else:
+            bits = "[LANES-1:0] "
+        declarations.append(f"    {port.direction} wire {bits}{port.name}")
+    lines.append(",\n".join(declarations))
+    lines.append(");")
+    overrides = ", ".join(f".{k}({v})" for k, v in parameters.items())
+    instance = f"{module} #({overrides}) dut (" if overrides else f"{module} dut ("
+    connections = []
+    for port in ports:
+        if port.shared:
+            lane = ""
+        elif port.width > 1:
+            lane = f"[k*{port.width} +: {port.width}]"
+        else:
+            lane = "[k]"
+        connections.append(f"                .{port.name}({port.name}{lane})")
+    lines += [
+        "    genvar k;",
+        "    generate",
+        "        for (k = 0; k < LANES; k = k + 1) begin : lane",
+        f"            {instance}",
+        ",\n".join(connections),
+        "            );",
+        "        end",
+        "    endgenerate",
+        "endmodule",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def block_wrapper(name, lanes=8):
+    """
+    The lanes wrapper of a diff_test block, with its parameters and clocks
+    """
+    block = BLOCKS[name]
+    return wrapper(
+        name,
+        HDL_PATH / block.sources[0],
+        block.parameters,
+        shared=tuple(block.clocks) + (block.reset,),
+        lanes=lanes,
+    )
+
+
+def write_wrapper(name, build_dir):
+    """
+    Write the lanes wrapper of a diff_test block into build_dir
+    """
+    build_dir = Path(build_dir)
+    build_dir.mkdir(parents=True, exist_ok=True)
+    path = build_dir / f"{name}_lanes.sv"
+    path.write_text(block_wrapper(name))
+    return path
+
+
+class Packed:
+    """
+    One port packing a `width` bit value for each lane
+    """
+
+    def __init__(self, handle, lanes, signed=False):
+        self.handle = handle
+        self.lanes = lanes
+        self.width = len(handle) // lanes
+        self.signed = signed
+        self._shifts = np.arange(self.width, dtype=np.int64)
+        self._weights = np.left_shift(1, self._shifts)
+        self._bytes = (lanes * self.width + 7) // 8
+
+    def write(self, values):
+        bits = (np.asarray(values, dtype=np.int64)[:, None] >> self._shifts) & 1
+        packed = np.packbits(bits.astype(np.uint8).ravel(), bitorder="little")
+        self.handle.value = int.from_bytes(packed.tobytes(), "little")
+
+    def read(self):
+        try:
+            value = int(self.handle.value)
+        except ValueError:
+            # X/Z before reset
+            return np.zeros(self.lanes, dtype=np.int64)
+        raw = np.frombuffer(value.to_bytes(self._bytes, "little"), dtype=np.uint8)
+        bits = np.unpackbits(raw, bitorder="little")[: self.lanes * self.width]
+        values = bits.reshape(self.lanes, self.width).astype(np.int64) @ self._weights
+        if self.signed:
+            values -= (values >> (self.width - 1)) << self.width
+        return values
+
+
+class LaneBench:
+    """
+    Drives a block's input stream and captures its output stream in every
+    lane of its `<block>_lanes` wrapper
+    """
+
+    def __init__(self, dut, clk, block):
+        self.dut = dut
+        self.clock = clk
+        self.block = block
+        self.lanes = len(getattr(dut, block.inputs.valid))
+        self.inputs = self._stream(block.inputs)
+        self.outputs = self._stream(block.outputs)
+
+    def _stream(self, stream):
+        def packed(name, signed=False):
+            if name is None:
+                return None
+            return Packed(getattr(self.dut, name), self.lanes, signed)
+
+        return {
+            "valid": packed(stream.valid),
+            "ready": packed(stream.ready),
+            "last": packed(stream.last),
+            "data": [packed(name, signed) for name, signed in stream.data],
+        }
+
+    async def run_seeds(self, seeds):
+        """
+        Reset the lanes and run a seed through each of them, leaving the
+        lanes without a seed idle. Returns diff_test results.
+        """
+        block = self.block
+        n = self.lanes
+        beats = [np.zeros((0, 0), dtype=np.int64)] * n
+        expected = [None] * n
+        params = [{"max_gap": 0, "ready_duty": 1.0}] * n
+        for k, seed in enumerate(seeds):
+            rng = np.random.default_rng(seed)
+            beats[k] = np.asarray(block.stimulus(rng), dtype=np.int64)
+            expected[k] = np.asarray(block.model(beats[k]), dtype=np.int64)
+            params[k] = case(seed, block)
+        lengths = np.array([len(b) for b in beats])
+        fields = max(b.shape[1] for b in beats)
+        stimulus = np.zeros((n, lengths.max() + 1, fields), dtype=np.int64)
+        for k, b in enumerate(beats[: len(seeds)]):
+            stimulus[k, : len(b)] = b
+        max_gap = np.array([p["max_gap"] for p in params])
+        duty = np.array([p["ready_duty"] for p in params])
+        wanted = np.array([len(e) if e is not None else 0 for e in expected])
+        rng = np.random.default_rng(seeds)
+        # Reset every lane at once
+        self.inputs["valid"].write(np.zeros(n))
+        if self.outputs["ready"] is not None:
+            self.outputs["ready"].write(np.ones(n))
+        reset = getattr(self.dut, block.reset)
+        reset.value = block.reset_active
+        await ClockCycles(self.clock, 2)
+        reset.value = 1 - block.reset_active
+        received = await self._run(stimulus, lengths, max_gap, duty, wanted, rng)
+        return [
+            compare(seed, params[k], beats[k], expected[k], received[k])
+            for k, seed in enumerate(seeds)
+        ]
+
+    async def _run(self, stimulus, lengths, max_gap, duty, wanted, rng):
+        n = self.lanes
+        inputs, outputs = self.inputs, self.outputs
+        has_last = outputs["last"] is not None
+        width = int(has_last) + len(outputs["data"])
+        capture = np.zeros((n, max(int(wanted.max()), 1) + 1, width), dtype=np.int64)
+        count = np.zeros(n, dtype=np.int64)
+        lane = np.arange(n)
+        pos = np.zeros(n, dtype=np.int64)
+        valid = np.zeros(n, dtype=bool)
+        wait = rng.integers(0, max_gap + 1)
+        always = np.ones(n, dtype=bool)
+        first_field = int(inputs["last"] is not None)
+        # Cycles without a beat in or out before giving up, enough for the
+        # outputs to drain at each lane's duty cycle
+        limit = 200 + int((4 * wanted / duty).max())
+        idle = 0
+        falling_edge = FallingEdge(self.clock)
+        read_only = ReadOnly()
+        while idle < limit:
+            await falling_edge
+            pending = ~valid & (pos < lengths)
+            valid |= pending & (wait == 0)
+            wait -= pending & (wait > 0)
+            beat = stimulus[lane, pos]
+            inputs["valid"].write(valid)
+            if inputs["last"] is not None:
+                inputs["last"].write(beat[:, 0] * valid)
+            for j, port in enumerate(inputs["data"]):
+                port.write(beat[:, first_field + j])
+            ready = always
+            if outputs["ready"] is not None:
+                ready = rng.uniform(size=n) < duty
+                outputs["ready"].write(ready)
+            await read_only
+            in_ready = always
+            if inputs["ready"] is not None:
+                in_ready = inputs["ready"].read() != 0
+            accepted = valid & in_ready
+            pos += accepted
+            valid &= ~accepted
+            wait[accepted] = rng.integers(0, max_gap[accepted] + 1)
+            got = np.flatnonzero((outputs["valid"].read() != 0) & ready)
+            if len(got):
+                if count[got].max() == capture.shape[1]:
+                    capture = np.concatenate((capture, np.zeros_like(capture)), axis=1)
+                values = [outputs["last"].read()] if has_last else []
+                values += [port.read() for port in outputs["data"]]
+                capture[got, count[got]] = np.stack(values, axis=1)[got]
+                count[got] += 1
+            if (pos >= lengths).all() and (count >= wanted).all():
+                break
+            idle = 0 if accepted.any() or len(got) else idle + 1
+        await ClockCycles(self.clock, 20)
+        return [capture[k, : count[k]] for k in range(n)]
+
+
+@cocotb.test(skip=os.getenv("LANES_BLOCK") is None)
+async def lanes_test(dut):
+    """
+    Runs the seeds in LANES_SEEDS (comma separated) through the lanes of
+    LANES_BLOCK, a lane per seed, and writes the results to LANES_OUT
+    """
+    block = BLOCKS[os.environ["LANES_BLOCK"]]
+    clocks = [getattr(dut, name) for name in block.clocks]
+    for clk in clocks:
+        cocotb.start_soon(Clock(clk, 10, units="ns").start())
+    bench = LaneBench(dut, clocks[0], block)
+    seeds = list(map(int, os.environ["LANES_SEEDS"].split(",")))
+    results = []
+    for i in range(0, len(seeds), bench.lanes):
+        results += await bench.run_seeds(seeds[i : i + bench.lanes])
+    Path(os.environ.get("LANES_OUT", "lanes.json")).write_text(json.dumps(results))
+    failed = [r["seed"] for r in results if not r["passed"]]
+    assert not failed, f"Seeds {failed} differ from the model"
+
+
+def build(name, sim="icarus", lanes=16):
+    from cocotb.runner import get_runner
+
+    block = BLOCKS[name]
+    build_dir = BUILD_PATH / name
+    get_runner(sim).build(
+        sources=[HDL_PATH / source for source in block.sources]
+        + [write_wrapper(name, build_dir)],
+        hdl_toplevel=f"{name}_lanes",
+        build_args=["-Wall"],
+        parameters={"LANES": lanes},
+        build_dir=build_dir,
+        timescale=("1ns", "1ps"),
+    )
+
+
+def run_batch(name, seeds, sim="icarus", lanes=16):
+    """
+    Simulate one batch of seeds, returning their results
+    """
+    results = run_in_project(
+        sim,
+        "LANES_OUT",
+        {"LANES_BLOCK": name, "LANES_SEEDS": ",".join(map(str, seeds))},
+        hdl_toplevel=f"{name}_lanes",
+        test_module="lanes",
+        testcase="lanes_test",
+        build_dir=BUILD_PATH / name,
+        parameters={"LANES": lanes},
+    )
+    if results is None:
+        return [{"seed": s, "passed": False, "crashed": True} for s in seeds]
+    return results
+
+
+def run(names, seeds, lanes=16, batch=128, workers=None, sim="icarus"):
+    """
+    Run every seed through every block's lanes over a process pool, saving
+    the failures, and return {block: results}
+    """
+    return diff_test.run(
+        names,
+        seeds,
+        batch,
+        workers,
+        sim,
+        builder=partial(build, lanes=lanes),
+        runner=partial(run_batch, lanes=lanes),
+        suffix="_lanes",
+    )
+
+
+if __name__ == "__main__":
+    parser = diff_test.arguments(
+        __doc__.splitlines()[1], "lts_xcorr,equalizer,block_fft", batch=128
+    )
+    parser.add_argument("--lanes", type=int, default=16)
+    parser.add_argument("--emit", help="Print the wrapper of any module in hdl/")
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="A parameter of the --emit module",
+    )
+    args = parser.parse_args()
+    if args.emit in BLOCKS:
+        print(block_wrapper(args.emit, args.lanes), end="")
+    elif args.emit:
+        parameters = {}
+        for param in args.param:
+            name, _, value = param.partition("=")
+            parameters[name] = int(value, 0)
+        try:
+            text = wrapper(
+                args.emit, find_module(args.emit), parameters, lanes=args.lanes
+            )
+        except ValueError as exc:
+            parser.error(str(exc))
+        print(text, end="")
+    else:
+        names = args.blocks.split(",")
+        seeds = list(range(args.first_seed, args.first_seed + args.seeds))
+        start = time.perf_counter()
+        results = run(names, seeds, args.lanes, args.batch, args.workers, args.sim)
+        diff_test.report(
+            results,
+            time.perf_counter() - start,
+            f"{args.lanes} lanes and {args.workers} workers",
+        )
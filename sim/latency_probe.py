@@ -0,0 +1,204 @@
+"""
+Per-packet latency probe for `csi_extractor_sv` simulations.
+
+The probe records the cycle of every handshake (or pulse) at these points in
+the DUT hierarchy:
+
+    input       signal_axis       122.88 MSPS samples into the FIRs
+    front_end   downsample_axis   20 MSPS samples out of fir_17 + downsample
+    sync_short  lts_extractor_inst.short_preamble_detected
+    sync_long   lts_axis          first LTS sample out of sync_long
+    lts_end     lts_axis_tlast
+    fft         fft_axis          first bin out of block_fft
+    fft_end     fft_axis_tlast
+    csi         csi_axis          first subcarrier out of the equalizer
+    csi_end     csi_axis_tlast
+
+Given where each packet starts in the input (from the synthetic packet ground
+truth, or detected offsets), breakdown() follows each packet through those
+points and returns the cycles spent between each pair, so the end-to-end
+latency can be split by stage, histogrammed and checked against budgets.
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from cocotb.triggers import FallingEdge, ReadOnly
+
+sys.path.append(str(Path(__file__).resolve().parent / "model"))
+from polyphase_decimator import kept_outputs
+
+# Probe point: (valid, ready, last) signal paths below the DUT, None if unused
+PROBES = {
+    "input": ("signal_axis_tvalid", "signal_axis_tready", None),
+    "front_end": ("downsample_axis_tvalid", "downsample_axis_tready", None),
+    "sync_short": ("lts_extractor_inst.short_preamble_detected", None, None),
+    "sync_long": ("lts_axis_tvalid", "lts_axis_tready", "lts_axis_tlast"),
+    "fft": ("fft_axis_tvalid", "fft_axis_tready", "fft_axis_tlast"),
+    "csi": ("csi_axis_tvalid", "csi_axis_tready", "csi_axis_tlast"),
+}
+# Points a packet passes through, in order
+STAGES = [
+    "input",
+    "front_end",
+    "sync_short",
+    "sync_long",
+    "lts_end",
+    "fft",
+    "fft_end",
+    "csi",
+    "csi_end",
+]
+# Filter taps, the last input sample a filter output depends on is 16 later
+FIR_TAPS = 17
+
+
+def upsampled_index(starts, length, length_up):
+    """
+    Where samples `starts` of a `length` sample 20 MSPS signal first show up
+    after test_utils.upsample_data stretches it to `length_up` samples
+    """
+    return -(-np.asarray(starts, dtype=np.int64) * length_up // length)
+
+
+def _signal(dut, path):
+    handle = dut
+    for name in path.split("."):
+        handle = getattr(handle, name)
+    return handle
+
+
+class LatencyProbe:
+    """
+    Records handshake cycles at the PROBES in the DUT while it runs
+    """
+
+    def __init__(self, dut, clk):
+        self.clock = clk
+        self.cycle = 0
+        self.signals = {
+            name: tuple(_signal(dut, p) if p else None for p in paths)
+            for name, paths in PROBES.items()
+        }
+        # Cycles of every beat, and of the first and last beat of every frame
+        self.beats = {name: [] for name in PROBES}
+        self.firsts = {name: [] for name in PROBES}
+        self.lasts = {name: [] for name in PROBES}
+        self._in_frame = {name: False for name in PROBES}
+
+    async def run(self):
+        falling_edge = FallingEdge(self.clock)
+        read_only = ReadOnly()
+        while True:
+            await falling_edge
+            await read_only
+            self.cycle += 1
+            for name, (valid, ready, last) in self.signals.items():
+                if not valid.value or (ready is not None and not ready.value):
+                    continue
+                if name in ("input", "front_end"):
+                    self.beats[name].append(self.cycle)
+                    continue
+                if not self._in_frame[name]:
+                    self.firsts[name].append(self.cycle)
+                    self._in_frame[name] = last is not None
+                if last is not None and last.value:
+                    self.lasts[name].append(self.cycle)
+                    self._in_frame[name] = False
+
+    def _events(self):
+        """
+        Cycles of each STAGES point after `input` and `front_end`
+        """
+        return {
+            "sync_short": self.firsts["sync_short"],
+            "sync_long": self.firsts["sync_long"],
+            "lts_end": self.lasts["sync_long"],
+            "fft": self.firsts["fft"],
+            "fft_end": self.lasts["fft"],
+            "csi": self.firsts["csi"],
+            "csi_end": self.lasts["csi"],
+        }
+
+    def breakdown(self, packet_starts):
+        """
+        Cycle at which each packet reached each of STAGES, (packets, stages),
+        given the input sample index at which each packet starts. Packets
+        the DUT missed (or that are still in flight) have NaNs from the first
+        point they didn't reach.
+        """
+        packet_starts = np.asarray(packet_starts)
+        inputs = np.array(self.beats["input"])
+        front_end = np.array(self.beats["front_end"])
+        # The last input sample each downsample output depends on
+        depends_on = kept_outputs(len(inputs))[: len(front_end)] + FIR_TAPS - 1
+        events = {k: np.array(v) for k, v in self._events().items()}
+        times = np.full((len(packet_starts), len(STAGES)), np.nan)
+        for n, start in enumerate(packet_starts):
+            if start >= len(inputs):
+                continue
+            times[n, 0] = inputs[start]
+            out = np.searchsorted(depends_on, start)
+            if out >= len(front_end):
+                continue
+            times[n, 1] = front_end[out]
+            # Detection has to happen before the next packet starts
+            end = (
+                inputs[packet_starts[n + 1]]
+                if n + 1 < len(packet_starts) and packet_starts[n + 1] < len(inputs)
+                else np.inf
+            )
+            prev = times[n, 1]
+            for k, stage in enumerate(STAGES[2:], 2):
+                later = events[stage][events[stage] > prev]
+                if not len(later) or (stage == "sync_short" and later[0] >= end):
+                    break
+                times[n, k] = prev = later[0]
+        return times
+
+    @staticmethod
+    def latencies(times):
+        """
+        Cycles spent getting to each point from the one before, and in total,
+        for the packets that made it all the way through
+        """
+        done = times[~np.isnan(times).any(axis=1)]
+        steps = np.diff(done, axis=1)
+        out = {stage: steps[:, k - 1] for k, stage in enumerate(STAGES) if k}
+        out["total"] = done[:, -1] - done[:, 0]
+        return out
+
+    @staticmethod
+    def histograms(latencies, bins=20):
+        return {
+            stage: np.histogram(v, bins) for stage, v in latencies.items() if len(v)
+        }
+
+    @staticmethod
+    def report(latencies, clock_ns=None):
+        lines = [f"{'stage':>10} {'min':>8} {'median':>8} {'max':>8}"]
+        for stage, v in latencies.items():
+            if len(v):
+                lines.append(
+                    f"{stage:>10} {v.min():8.0f} {np.median(v):8.0f} {v.max():8.0f}"
+                )
+        if clock_ns is not None and len(latencies["total"]):
+            lines.append(
+                f"End to end: {np.median(latencies['total']) * clock_ns / 1e3:.1f} us "
+                "median"
+            )
+        return "\n".join(lines)
+
+    @staticmethod
+    def check_budgets(latencies, budgets):
+        """
+        Assert that no packet spent more than budgets[stage] cycles in each
+        stage given a budget (a stage name from STAGES or "total")
+        """
+        for stage, budget in budgets.items():
+            worst = latencies[stage].max() if len(latencies[stage]) else 0
+            assert (
+                worst <= budget
+            ), f"{stage} took {worst:.0f} cycles, over its budget of {budget}"
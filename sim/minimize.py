@@ -0,0 +1,377 @@
+"""
+Shrinks a failing `lts_extractor` / `csi_extractor_sv` run to a tiny
+replayable stimulus by delta debugging.
+
+A stimulus is an .npz file holding the 20 MSPS samples (i, q), the
+threshold `sw`, the toplevel, and the [start, stop) cycles the output tready
+(lts_axis_tready / csi_axis_tready) is held low, counted from the first
+sample going in. The *_stimulus_test in each testbench replays one (given by
+STIMULUS) and checks the outputs against the bit-accurate model, writing
+what went wrong to STIMULUS_OUT.
+
+Starting from a failing stimulus, or a corpus shard with random
+backpressure, this keeps the smallest input that still fails the same way,
+trying in turn to
+
+    trim the sample range   cut samples off the start and then the end
+    drop packets            cut out the spans with packets in them, and trim
+                            again
+    drop backpressure       raise tready over its low runs
+
+Candidates are simulated in parallel against a single build. Cutting samples
+out also cuts the cycles they span out of the backpressure, so the two stay
+lined up.
+
+Usage: python minimize.py --toplevel csi_extractor_sv
+                          (--stimulus failing.npz | --shard corpus/shard.dat
+                           [--ready-duty 0.5] [--seed 0])
+                          [--out minimized.npz] [--workers N] [--any-failure]
+       python minimize.py --replay minimized.npz
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from cocotb.runner import get_runner
+from cocotb.triggers import ClockCycles
+
+from test_utils import DATA_SAMPLE_RATE, DESIRED_SAMPLE_RATE, run_in_project
+
+SIM_PATH = Path(__file__).resolve().parent
+BUILD_DIR = SIM_PATH / "sim_build" / "minimize"
+HDL_PATH = SIM_PATH.parent / "WaveSense/ip_repo/csi_extractor_1_0/hdl"
+
+# Test module, replay test and cycles per 20 MSPS sample for each toplevel
+TOPLEVELS = {
+    "lts_extractor": ("test_lts_extractor", "lts_extractor_stimulus_test", 1.0),
+    "csi_extractor_sv": (
+        "test_csi_extractor",
+        "csi_extractor_stimulus_test",
+        DESIRED_SAMPLE_RATE / DATA_SAMPLE_RATE,
+    ),
+}
+
+# Samples cut at a time when trimming, and margin kept around packets
+GRANULE = 16
+PACKET_MARGIN = 32
+
+
+def load_stimulus(path):
+    with np.load(path) as f:
+        return {
+            "i": f["i"].astype(np.int16),
+            "q": f["q"].astype(np.int16),
+            "low_runs": f["low_runs"].astype(np.int64).reshape(-1, 2),
+            "sw": int(f["sw"]),
+            "toplevel": str(f["toplevel"]),
+        }
+
+
+def save_stimulus(path, stimulus):
+    np.savez_compressed(
+        path,
+        i=stimulus["i"],
+        q=stimulus["q"],
+        low_runs=stimulus["low_runs"],
+        sw=stimulus["sw"],
+        toplevel=stimulus["toplevel"],
+    )
+    return path
+
+
+async def replay_ready(clk, tready, low_runs):
+    """
+    Drive tready low over each [start, stop) run of falling edges, counted
+    from the call, and high otherwise
+    """
+    tready.value = 1
+    cycle = 0
+    for start, stop in low_runs:
+        if start > cycle:
+            await ClockCycles(clk, int(start - cycle), rising=False)
+        tready.value = 0
+        await ClockCycles(clk, int(stop - start), rising=False)
+        tready.value = 1
+        cycle = stop
+
+
+def random_low_runs(cycles, duty, seed=None):
+    """
+    Low runs for tready high on ~duty of `cycles` random cycles
+    """
+    rng = np.random.default_rng(seed)
+    low = np.concatenate(([False], rng.uniform(size=cycles) >= duty, [False]))
+    edges = np.flatnonzero(np.diff(low.astype(np.int8)))
+    return edges.reshape(-1, 2)
+
+
+def from_shard(path, toplevel, ready_duty=1.0, seed=None):
+    """
+    A stimulus from a packet_corpus shard, with random backpressure
+    """
+    path = Path(path)
+    signal = np.fromfile(path, dtype=np.int16)
+    with np.load(path.with_suffix(".npz")) as sidecar:
+        sw = int(sidecar["sw"])
+    ratio = TOPLEVELS[toplevel][2]
+    cycles = int(len(signal) // 2 * ratio * 3 // 2)
+    return {
+        "i": signal[::2],
+        "q": signal[1::2],
+        "low_runs": random_low_runs(cycles, ready_duty, seed),
+        "sw": sw,
+        "toplevel": toplevel,
+    }
+
+
+def cut(stimulus, start, stop):
+    """
+    The stimulus with samples [start, stop) and the cycles they span removed
+    """
+    ratio = TOPLEVELS[stimulus["toplevel"]][2]
+    c0, c1 = int(round(start * ratio)), int(round(stop * ratio))
+    # Cycles before the cut stay, cycles after it move back, cycles in it go
+    runs = stimulus["low_runs"]
+    runs = np.where(runs <= c0, runs, np.where(runs >= c1, runs - (c1 - c0), c0))
+    return {
+        **stimulus,
+        "i": np.concatenate((stimulus["i"][:start], stimulus["i"][stop:])),
+        "q": np.concatenate((stimulus["q"][:start], stimulus["q"][stop:])),
+        "low_runs": runs[runs[:, 1] > runs[:, 0]].reshape(-1, 2),
+    }
+
+
+def packets(i, q, window=32, threshold_db=10, min_gap=64):
+    """
+    [start, stop) spans of the samples above the noise floor, merged when
+    they're less than min_gap apart and padded by PACKET_MARGIN
+    """
+    power = i.astype(np.float64) ** 2 + q.astype(np.float64) ** 2
+    power = np.convolve(power, np.ones(window) / window, "same")
+    floor = max(np.percentile(power, 10), 1.0)
+    active = np.concatenate(
+        ([False], power > floor * 10 ** (threshold_db / 10), [False])
+    )
+    edges = np.flatnonzero(np.diff(active.astype(np.int8))).reshape(-1, 2)
+    spans = []
+    for start, stop in edges:
+        if spans and start - spans[-1][1] < min_gap:
+            spans[-1][1] = stop
+        else:
+            spans.append([start, stop])
+    return [
+        (max(start - PACKET_MARGIN, 0), min(stop + PACKET_MARGIN, len(i)))
+        for start, stop in spans
+    ]
+
+
+def build(toplevel, sim="icarus", waves=False):
+    """
+    Compile the toplevel once for every candidate
+    """
+    if toplevel == "lts_extractor":
+        from test_lts_extractor import hdl_sources
+
+        sources = hdl_sources(HDL_PATH)
+    else:
+        from test_csi_extractor import hdl_sources
+
+        sources = hdl_sources(SIM_PATH.parent)
+    get_runner(sim).build(
+        sources=sources,
+        hdl_toplevel=toplevel,
+        build_args=["-Wall"],
+        build_dir=BUILD_DIR / toplevel,
+        timescale=("1ns", "1ps"),
+        waves=waves,
+    )
+
+
+def failure(stimulus, sim="icarus", waves=False, test_dir=None):
+    """
+    Replay a stimulus, returning the failure message (None if it passed)
+    """
+    toplevel = stimulus["toplevel"]
+    test_module, testcase, _ = TOPLEVELS[toplevel]
+
+    def inputs(run_dir):
+        path = save_stimulus(run_dir / "stimulus.npz", stimulus)
+        return {"STIMULUS": str(path)}
+
+    result = run_in_project(
+        sim,
+        "STIMULUS_OUT",
+        inputs,
+        test_dir=test_dir,
+        hdl_toplevel=toplevel,
+        test_module=test_module,
+        testcase=testcase,
+        build_dir=BUILD_DIR / toplevel,
+        waves=waves,
+    )
+    if result is None:
+        return "The simulation didn't finish"
+    return result["failure"]
+
+
+class Minimizer:
+    """
+    Delta debugging over one failing stimulus. A candidate is "failing" if it
+    fails with the same message as the original (any message with
+    any_failure).
+    """
+
+    def __init__(self, executor, workers, sim="icarus", any_failure=False):
+        self.executor = executor
+        self.workers = workers
+        self.sim = sim
+        self.any_failure = any_failure
+        self.message = None
+        self.simulations = 0
+
+    def fails(self, candidates):
+        """
+        Simulate candidates in parallel, whether each still fails
+        """
+        self.simulations += len(candidates)
+        messages = self.executor.map(failure, candidates, [self.sim] * len(candidates))
+        return [
+            m is not None and (self.any_failure or m == self.message) for m in messages
+        ]
+
+    def trim(self, stimulus, front):
+        """
+        Cut as much as possible off the start (front) or end of the samples,
+        trying as many cut points at once as there are workers
+        """
+        ways = max(self.workers, 1)
+        # Cutting lo samples fails, cutting hi samples passes
+        lo, hi = 0, len(stimulus["i"])
+
+        def trimmed(n):
+            length = len(stimulus["i"])
+            return cut(stimulus, 0, n) if front else cut(stimulus, length - n, length)
+
+        while hi - lo > GRANULE:
+            step = max((hi - lo) // (ways + 1), GRANULE)
+            points = list(range(lo + step, hi, step))[:ways]
+            results = self.fails([trimmed(n) for n in points])
+            for n, failed in zip(points, results):
+                if failed:
+                    lo = n
+                else:
+                    hi = n
+                    break
+        return trimmed(lo)
+
+    def ddmin(self, items, candidate):
+        """
+        The smallest sublist of items for which candidate(sublist) still
+        fails, by ddmin: test subsets and their complements n at a time
+        """
+        n = 2
+        while len(items) >= 2:
+            chunks = np.array_split(np.arange(len(items)), n)
+            subsets = [[items[k] for k in c] for c in chunks]
+            complements = [
+                [items[k] for k in range(len(items)) if not c[0] <= k <= c[-1]]
+                for c in chunks
+            ]
+            tries = subsets + (complements if n > 2 else [])
+            results = self.fails([candidate(t) for t in tries])
+            if any(results):
+                first = results.index(True)
+                items = tries[first]
+                n = 2 if first < len(subsets) else max(n - 1, 2)
+            elif n < len(items):
+                n = min(2 * n, len(items))
+            else:
+                break
+        if len(items) == 1 and self.fails([candidate([])])[0]:
+            items = []
+        return items
+
+    def minimize(self, stimulus, log=print):
+        self.message = failure(stimulus, self.sim)
+        self.simulations += 1
+        if self.message is None:
+            raise ValueError("The stimulus passes, so there's nothing to minimize")
+        log(f"Failing with: {self.message}")
+        stimulus = self.trim(stimulus, front=True)
+        stimulus = self.trim(stimulus, front=False)
+        log(f"Trimmed to {len(stimulus['i'])} samples")
+
+        spans = packets(stimulus["i"], stimulus["q"])
+
+        def without(kept):
+            # Cut the packets not kept, last first so the indices hold
+            out = stimulus
+            for span in reversed(spans):
+                if span not in kept:
+                    out = cut(out, *span)
+            return out
+
+        stimulus = without(self.ddmin(spans, without))
+        # The gaps the dropped packets left at either end can go too
+        stimulus = self.trim(stimulus, front=True)
+        stimulus = self.trim(stimulus, front=False)
+        log(
+            f"{len(packets(stimulus['i'], stimulus['q']))} of {len(spans)} packets left"
+        )
+
+        runs = [tuple(r) for r in stimulus["low_runs"]]
+
+        def with_runs(kept):
+            return {
+                **stimulus,
+                "low_runs": np.array(kept, dtype=np.int64).reshape(-1, 2),
+            }
+
+        stimulus = with_runs(self.ddmin(runs, with_runs))
+        log(f"{len(stimulus['low_runs'])} of {len(runs)} tready low runs left")
+        return stimulus
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--toplevel", choices=TOPLEVELS, default="csi_extractor_sv")
+    parser.add_argument("--stimulus", help="A failing stimulus file")
+    parser.add_argument("--shard", help="A packet_corpus shard to start from")
+    parser.add_argument("--ready-duty", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=str(SIM_PATH / "minimized.npz"))
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--sim", default=os.getenv("SIM", "icarus"))
+    parser.add_argument("--any-failure", action="store_true")
+    parser.add_argument("--replay", help="A stimulus to run again with waves")
+    args = parser.parse_args()
+    if args.replay:
+        stimulus = load_stimulus(args.replay)
+        build(stimulus["toplevel"], args.sim, waves=True)
+        message = failure(stimulus, args.sim, waves=True, test_dir=SIM_PATH)
+        print(f"Failed with: {message}" if message else "Passed")
+    else:
+        if args.stimulus:
+            stimulus = load_stimulus(args.stimulus)
+        elif args.shard:
+            stimulus = from_shard(args.shard, args.toplevel, args.ready_duty, args.seed)
+        else:
+            parser.error("One of --stimulus, --shard or --replay is needed")
+        build(stimulus["toplevel"], args.sim)
+        start = time.perf_counter()
+        size = (len(stimulus["i"]), len(stimulus["low_runs"]))
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            minimizer = Minimizer(executor, args.workers, args.sim, args.any_failure)
+            stimulus = minimizer.minimize(stimulus)
+        save_stimulus(args.out, stimulus)
+        print(
+            f"{size[0]} samples / {size[1]} low runs -> {len(stimulus['i'])} / "
+            f"{len(stimulus['low_runs'])} in {minimizer.simulations} simulations "
+            f"({time.perf_counter() - start:.0f}s) -> {args.out}"
+        )
+        print(f"Replay with: python minimize.py --replay {args.out}")
@@ -0,0 +1,531 @@
+"""
+Bit-accurate, sample-level Python models of the csi_extractor blocks.
+
+Every model takes the samples a block accepts (one entry per valid/handshake)
+and returns the samples it emits, with the same integer widths and wrapping as
+the RTL. Clock-cycle timing is not modelled, except where it decides which
+samples a block gets to see (e.g. the resets in `lts_extractor`).
+"""
+
+import numpy as np
+
+from hdl_params import equalizer_masks, fft_coeffs, fir_17_coeffs, lts_xcorr_coeffs
+
+# Bump whenever a change to this file changes any model output, so that cached
+# golden vectors get regenerated.
+MODEL_VERSION = 1
+
+LTS_LEN = 64
+NUM_STS_TAIL = 32
+XCORR_LEN = 32
+
+
+def wrap(x, width, overflow=None, name=None):
+    """
+    Wrap integers to a signed `width`-bit two's complement value.
+
+    If an `overflow` dict is passed, the number of wrapped values is added to
+    overflow[name].
+    """
+    x = np.asarray(x, dtype=np.int64)
+    half = 1 << (width - 1)
+    wrapped = ((x + half) & ((1 << width) - 1)) - half
+    if overflow is not None:
+        overflow[name] = overflow.get(name, 0) + int(np.count_nonzero(wrapped != x))
+    return wrapped
+
+
+def unsigned(x, width):
+    """
+    Reinterpret integers as `width`-bit unsigned values
+    """
+    return np.asarray(x, dtype=np.int64) & ((1 << width) - 1)
+
+
+def running_sum(x, window):
+    """
+    Sum of the last `window` entries of x at every index (fewer at the start)
+    """
+    acc = np.cumsum(np.asarray(x, dtype=np.int64))
+    acc[window:] = acc[window:] - acc[:-window]
+    return acc
+
+
+def fir_17(x, coeffs=None, width=27, overflow=None):
+    """
+    Model of `fir_17` with C_M_AXIS_TDATA_WIDTH = width.
+
+    The first output is emitted once the 17-deep pipeline is full, so N inputs
+    give N - 16 outputs.
+    """
+    if coeffs is None:
+        coeffs = fir_17_coeffs()
+    x = np.asarray(x, dtype=np.int64)
+    y = np.convolve(x, coeffs)[len(coeffs) - 1 : len(x)]
+    return wrap(y, width, overflow, "fir_17")
+
+
+def downsample_mask(n, rate_in=122_880, rate_out=20_000):
+    """
+    Which of n consecutive inputs `downsample` forwards (counter starts at 0)
+    """
+    k = np.arange(n, dtype=np.int64)
+    return (k + 1) * rate_out // rate_in > k * rate_out // rate_in
+
+
+def downsample(x, rate_in=122_880, rate_out=20_000):
+    """
+    Model of `downsample`: zero-order hold decimation by rate_in / rate_out
+    """
+    x = np.asarray(x)
+    return x[downsample_mask(len(x), rate_in, rate_out)]
+
+
+def complex_multiply(i0, q0, i1, q1, width=16):
+    """
+    Model of `complex_multiply` with DATA_WIDTH = width
+    """
+    i0, q0, i1, q1 = (wrap(v, width) for v in (i0, q0, i1, q1))
+    i_out = wrap(i0 * i1 - q0 * q1, 2 * width)
+    q_out = wrap(i0 * q1 + q0 * i1, 2 * width)
+    return i_out, q_out
+
+
+def complex_to_mag_sq(i, q):
+    """
+    Model of `complex_to_mag_sq`, returning the unsigned 32-bit mag_sq_out.
+
+    Q is negated in 16 bits, so -32768 does not square correctly (as in RTL).
+    """
+    i_out, _ = complex_multiply(i, q, i, wrap(-np.asarray(q), 16))
+    return unsigned(i_out, 32)
+
+
+def complex_to_mag(i, q, width=32):
+    """
+    Model of `complex_to_mag`: max(|i|, |q|) + min(|i|, |q|) / 4
+    """
+    abs_i = unsigned(np.abs(wrap(i, width)), width)
+    abs_q = unsigned(np.abs(wrap(q, width)), width)
+    hi = np.maximum(abs_i, abs_q)
+    lo = np.minimum(abs_i, abs_q)
+    return unsigned(hi + (lo >> 2), width)
+
+
+def moving_avg(x, window_shift=4, width=32, overflow=None):
+    """
+    Model of `moving_avg`.
+
+    Output n is the mean of inputs n-2**window_shift+1..n; outputs start once
+    the window is full, so N inputs give N - 2**window_shift + 1 outputs.
+    """
+    window = 1 << window_shift
+    acc = running_sum(wrap(x, width), window)[window - 1 :]
+    return wrap(acc >> window_shift, width, overflow, "moving_avg")
+
+
+def delay_sample(x, delay_shift=4):
+    """
+    Model of `delay_sample`.
+
+    Once full, each input pushes out the sample 2**delay_shift - 1 inputs
+    older than itself, so N inputs give N - 2**delay_shift + 1 outputs.
+    """
+    x = np.asarray(x)
+    return x[: len(x) - (1 << delay_shift) + 1]
+
+
+def lts_xcorr(i, q, coeffs=None, overflow=None):
+    """
+    Model of `lts_xcorr`.
+
+    Output m correlates inputs m..m+31 with the coefficients, so N inputs
+    give N - 31 outputs. Returns the (I, Q) 32-bit sums.
+    """
+    if coeffs is None:
+        coeffs = lts_xcorr_coeffs()
+    i = wrap(i, 16)
+    q = wrap(q, 16)
+    n_out = len(i) - len(coeffs) + 1
+    sum_i = np.zeros(max(n_out, 0), dtype=np.int64)
+    sum_q = np.zeros(max(n_out, 0), dtype=np.int64)
+    for j, (ci, cq) in enumerate(coeffs):
+        prod_i, prod_q = complex_multiply(i[j : j + n_out], q[j : j + n_out], ci, cq)
+        sum_i = wrap(sum_i + prod_i, 32, overflow, "lts_xcorr")
+        sum_q = wrap(sum_q + prod_q, 32, overflow, "lts_xcorr")
+    return sum_i, sum_q
+
+
+def power_trigger(i, thresh, win_len=80, skip=0):
+    """
+    Model of `power_trigger`.
+
+    Returns trigger_out after each input sample: high from the first sample
+    with |I| >= thresh until win_len + 1 consecutive samples fall below it.
+    """
+    abs_i = unsigned(np.abs(wrap(i, 16)), 16)
+    idx = np.arange(len(abs_i))
+    above = (abs_i >= thresh) & (idx > skip)
+    last_above = np.maximum.accumulate(np.where(above, idx, -1))
+    return (last_above >= 0) & (idx - last_above <= win_len)
+
+
+def sync_short(i, q, window_shift=4, delay_shift=4, min_plateau=100):
+    """
+    Model of `sync_short` on the samples it sees after a reset.
+
+    Returns the index of the sample that raises short_preamble_detected, or
+    None. The plateau counters are evaluated per sample, as they are when
+    sample_in_valid is not asserted on back-to-back cycles.
+    """
+    i = wrap(i, 16)
+    q = wrap(q, 16)
+    n = len(i)
+    if n == 0:
+        return None
+    window = 1 << window_shift
+    delay = 1 << delay_shift
+    # Power: average of |S[n]|^2
+    mag_sq = wrap(complex_to_mag_sq(i, q), 32)
+    mag_sq_avg = unsigned(running_sum(mag_sq, window) >> window_shift, 32)
+    prod_thres = (mag_sq_avg >> 1) + (mag_sq_avg >> 2)
+    # Autocorrelation: average of S[n] * conj(S[n-16])
+    i_delayed = np.concatenate((np.zeros(delay, dtype=np.int64), i))[:n]
+    q_delayed = np.concatenate((np.zeros(delay, dtype=np.int64), q))[:n]
+    prod_i, prod_q = complex_multiply(i, q, i_delayed, wrap(-q_delayed, 16))
+    prod_avg_i = wrap(running_sum(prod_i, window) >> window_shift, 32)
+    prod_avg_q = wrap(running_sum(prod_q, window) >> window_shift, 32)
+    prod_mag = complex_to_mag(prod_avg_i, prod_avg_q)
+    # Plateau detection: every (min_plateau + 2)th consecutive sample above the
+    # threshold ends a block, which fires if it saw both signs of I
+    above = (prod_mag > prod_thres) & (np.arange(n) >= window - 1)
+    run = np.zeros(n, dtype=np.int64)
+    run_start = np.flatnonzero(np.diff(np.concatenate(([0], above.astype(int)))) == 1)
+    run_id = np.cumsum(np.isin(np.arange(n), run_start))
+    starts = np.concatenate(([0], run_start))[run_id]
+    run[above] = (np.arange(n) - starts + 1)[above]
+    block = min_plateau + 2
+    fire = np.flatnonzero(above & (run % block == 0))
+    if len(fire) == 0:
+        return None
+    # Counters as seen one sample before the block ends
+    pos = np.concatenate(([0], np.cumsum(above & (i >= 0))))
+    neg = np.concatenate(([0], np.cumsum(above & (i < 0))))
+    min_count = min_plateau >> 2
+    has_pos = pos[fire] - pos[fire - block + 1] > min_count
+    has_neg = neg[fire] - neg[fire - block + 1] > min_count
+    detected = fire[has_pos & has_neg]
+    return int(detected[0]) if len(detected) else None
+
+
+def sync_long(i, q, coeffs=None):
+    """
+    Model of `sync_long` on the samples it sees after a reset.
+
+    Returns the index of the first LTS sample (the first of the 128 samples
+    sent downstream), or None if there are too few samples or the two
+    cross-correlation peaks are not 64±1 samples apart.
+    """
+    if coeffs is None:
+        coeffs = lts_xcorr_coeffs()
+    n_xcorr = 2 * LTS_LEN
+    if len(i) < n_xcorr + len(coeffs) - 1:
+        return None
+    xcorr_i, xcorr_q = lts_xcorr(
+        i[: n_xcorr + len(coeffs) - 1], q[: n_xcorr + len(coeffs) - 1], coeffs
+    )
+    xcorr_mag = complex_to_mag(xcorr_i, xcorr_q)
+    peak1 = int(np.argmax(xcorr_mag[:LTS_LEN]))
+    peak2 = LTS_LEN + int(np.argmax(xcorr_mag[LTS_LEN:]))
+    gap = (peak2 - peak1) & 0xFF
+    if not 62 < gap < 66:
+        return None
+    return peak1 - XCORR_LEN + NUM_STS_TAIL
+
+
+def find_lts(i, q, sw=4, cycles=None, window_shift=4, delay_shift=4):
+    """
+    Index of the first LTS sample of every packet `lts_extractor` sends on.
+
+    `cycles` gives the clock cycle each sample is accepted on (default: one
+    sample per cycle) and decides which samples are lost while sync_short and
+    sync_long sit in reset.
+    """
+    i = wrap(i, 16)
+    q = wrap(q, 16)
+    n = len(i)
+    if cycles is None:
+        cycles = np.arange(n)
+    cycles = np.asarray(cycles, dtype=np.int64)
+    trigger = power_trigger(i, 50 + (sw << 5))
+    starts = []
+    # Cycle on which the state machine last went back to WAIT_POWER_TRIGGER
+    wait_cycle = -1
+    while True:
+        # WAIT_POWER_TRIGGER -> SYNC_SHORT once trigger_out is high
+        first = int(np.searchsorted(cycles, wait_cycle, side="right"))
+        if first > 0 and trigger[first - 1]:
+            enter = wait_cycle + 1
+        else:
+            rise = np.flatnonzero(trigger[first:])
+            if len(rise) == 0:
+                break
+            enter = int(cycles[first + rise[0]]) + 1
+        # sync_short is reset on the cycle after entering SYNC_SHORT and then
+        # runs until it detects the STS or the trigger drops
+        start = int(np.searchsorted(cycles, enter + 1, side="right"))
+        fall = np.flatnonzero(~trigger[start:])
+        stop = start + int(fall[0]) + 1 if len(fall) else n
+        detected = sync_short(i[start:stop], q[start:stop], window_shift, delay_shift)
+        if detected is None:
+            if stop >= n:
+                break
+            wait_cycle = int(cycles[stop - 1]) + 1
+            continue
+        det_cycle = int(cycles[start + detected]) + 3
+        # sync_long is reset on the cycle after entering SYNC_LONG
+        lts_start = int(np.searchsorted(cycles, det_cycle + 2, side="right"))
+        fall = np.flatnonzero(~trigger[lts_start:])
+        lts_stop = lts_start + int(fall[0]) + 1 if len(fall) else n
+        offset = sync_long(i[lts_start:lts_stop], q[lts_start:lts_stop])
+        if offset is not None:
+            starts.append(lts_start + offset)
+            # Back to WAIT_POWER_TRIGGER on the first tlast
+            last = lts_start + 2 * LTS_LEN + XCORR_LEN - 2
+            wait_cycle = int(cycles[min(last, n - 1)]) + 70
+        else:
+            # Stay in SYNC_LONG until the sample counter runs out
+            last = min(lts_start + 320, lts_stop - 1, n - 1)
+            wait_cycle = int(cycles[last]) + 1
+        if wait_cycle > cycles[-1]:
+            break
+    return np.array(starts, dtype=np.int64)
+
+
+def lts_frames(i, q, starts):
+    """
+    The two LTS symbols starting at each index in `starts`, as a
+    (2 * packets, 64) complex array in the order they leave lts_axis
+    """
+    idx = (np.asarray(starts)[:, None] + np.arange(2 * LTS_LEN)).reshape(-1, LTS_LEN)
+    return wrap(i, 16)[idx] + 1j * wrap(q, 16)[idx]
+
+
+def lts_extractor(i, q, sw=4, cycles=None, window_shift=4, delay_shift=4):
+    """
+    Model of `lts_extractor`. Returns a (2 * packets, 64) complex array of
+    the LTS symbols, in the order they leave lts_axis.
+    """
+    starts = find_lts(i, q, sw, cycles, window_shift, delay_shift)
+    return lts_frames(i, q, starts)
+
+
+def front_end(i, q, coeffs=None, i_width=27, q_width=32, lsb=11, overflow=None):
+    """
+    Model of the filter + downsample stage at the top of `csi_extractor_sv`.
+
+    Returns the 20 MSPS (I, Q) samples and the index of the 122.88 MSPS input
+    each one was taken from.
+    """
+    i_filt = fir_17(i, coeffs, i_width, overflow)
+    q_filt = fir_17(q, coeffs, q_width, overflow)
+    # {Q[lsb+15:lsb], I[lsb+15:lsb]}
+    i_out = wrap(i_filt >> lsb, 16, overflow, "filter_slice")
+    q_out = wrap(q_filt >> lsb, 16, overflow, "filter_slice")
+    keep = np.flatnonzero(downsample_mask(len(i_filt)))
+    return i_out[keep], q_out[keep], keep + len(i) - len(i_filt)
+
+
+def csi_extractor_lts(i, q, sw=4):
+    """
+    LTS symbols found by `csi_extractor_sv` for 122.88 MSPS input samples
+    """
+    i_ds, q_ds, cycles = front_end(i, q)
+    return lts_extractor(i_ds, q_ds, sw, cycles)
+
+
+def convround(x, iwidth, owidth, shift=0, overflow=None, name="fft"):
+    """
+    Model of the FFT core's `convround`: drop the top `shift` bits and round
+    the rest to `owidth` bits, with ties going to even
+    """
+    x = np.asarray(x, dtype=np.int64)
+    lost = iwidth - shift - owidth
+    if lost <= 0:
+        return wrap(x, min(iwidth - shift, owidth) if lost < 0 else owidth)
+    trunc = x >> lost
+    rest = x & ((1 << lost) - 1)
+    half = 1 << (lost - 1)
+    up = (rest > half) | ((rest == half) & (trunc & 1 == 1))
+    return wrap(trunc + up, owidth, overflow, name)
+
+
+def _fft_butterflies(re, im, coeffs, iwidth, cwidth, owidth, overflow=None):
+    """
+    One `fftstage` (hwbfly with SHIFT=0) over every block of 2 * span samples
+    """
+    span = len(coeffs)
+    shape = re.shape
+    re = re.reshape(shape[0], -1, 2, span)
+    im = im.reshape(shape[0], -1, 2, span)
+    sum_r = re[:, :, 0] + re[:, :, 1]
+    sum_i = im[:, :, 0] + im[:, :, 1]
+    dif_r = re[:, :, 0] - re[:, :, 1]
+    dif_i = im[:, :, 0] - im[:, :, 1]
+    c_r, c_i = coeffs[:, 0], coeffs[:, 1]
+    left_width = cwidth + iwidth + 1
+    right_width = cwidth + iwidth + 3
+    out_r = np.stack(
+        (
+            convround(sum_r << (cwidth - 2), left_width, owidth, 2, overflow),
+            convround(dif_r * c_r - dif_i * c_i, right_width, owidth, 4, overflow),
+        ),
+        axis=2,
+    )
+    out_i = np.stack(
+        (
+            convround(sum_i << (cwidth - 2), left_width, owidth, 2, overflow),
+            convround(dif_r * c_i + dif_i * c_r, right_width, owidth, 4, overflow),
+        ),
+        axis=2,
+    )
+    return out_r.reshape(shape), out_i.reshape(shape)
+
+
+def bit_reverse(n):
+    """
+    Bit reversed indices for an n point FFT
+    """
+    bits = n.bit_length() - 1
+    idx = np.arange(n)
+    rev = np.zeros(n, dtype=np.int64)
+    for b in range(bits):
+        rev |= ((idx >> b) & 1) << (bits - 1 - b)
+    return rev
+
+
+def fftmain(x, iwidth=16, xbits=2, owidth=16, cbits=4, overflow=None):
+    """
+    Model of the generated 64 point `fftmain` (fftgen -f 64 -n 16 -m 16 -x 2).
+
+    x is a (frames, 64) complex array. The butterfly stages are iwidth + xbits
+    bits wide and use coefficients cbits wider than their input. The output is
+    in natural order and scaled by about 1/32.
+    """
+    x = np.atleast_2d(x)
+    if len(x) == 0:
+        return np.zeros((0, x.shape[1]), dtype=complex)
+    re = wrap(x.real.astype(np.int64), iwidth)
+    im = wrap(x.imag.astype(np.int64), iwidth)
+    width = iwidth
+    for n in (64, 32, 16, 8):
+        stage_width = iwidth + xbits
+        cwidth = width + cbits
+        re, im = _fft_butterflies(
+            re, im, fft_coeffs(n, cwidth), width, cwidth, stage_width, overflow
+        )
+        width = stage_width
+    # qtrstage: radix-2 butterflies on pairs 2 apart, the second times -j
+    re = re.reshape(len(re), -1, 2, 2)
+    im = im.reshape(len(im), -1, 2, 2)
+    sum_r = convround(re[:, :, 0] + re[:, :, 1], width + 1, width, 0, overflow)
+    sum_i = convround(im[:, :, 0] + im[:, :, 1], width + 1, width, 0, overflow)
+    dif_r = convround(re[:, :, 0] - re[:, :, 1], width + 1, width, 0, overflow)
+    dif_i = convround(im[:, :, 0] - im[:, :, 1], width + 1, width, 0, overflow)
+    dif_r[:, :, 1], dif_i[:, :, 1] = dif_i[:, :, 1], wrap(-dif_r[:, :, 1], width)
+    re = np.stack((sum_r, dif_r), axis=2).reshape(len(re), -1)
+    im = np.stack((sum_i, dif_i), axis=2).reshape(len(im), -1)
+    # laststage (SHIFT=1)
+    re = re.reshape(len(re), -1, 2)
+    im = im.reshape(len(im), -1, 2)
+    re = np.stack(
+        (
+            convround(re[:, :, 0] + re[:, :, 1], width + 1, owidth, 1, overflow),
+            convround(re[:, :, 0] - re[:, :, 1], width + 1, owidth, 1, overflow),
+        ),
+        axis=2,
+    ).reshape(len(re), -1)
+    im = np.stack(
+        (
+            convround(im[:, :, 0] + im[:, :, 1], width + 1, owidth, 1, overflow),
+            convround(im[:, :, 0] - im[:, :, 1], width + 1, owidth, 1, overflow),
+        ),
+        axis=2,
+    ).reshape(len(im), -1)
+    # bitreverse
+    rev = bit_reverse(re.shape[1])
+    return re[:, rev] + 1j * im[:, rev]
+
+
+def equalizer(fft1, fft2, shift=1, width=16, overflow=None):
+    """
+    Model of `equalizer`: removes the sign of the known LTS from the average of
+    the two LTS FFTs. Returns the 52 occupied subcarriers (FFT bins 1-26 and
+    38-63) as complex 16 bit values.
+    """
+    pos, neg = equalizer_masks()
+    keep = pos | neg
+    if len(fft1) == 0:
+        return np.zeros((0, np.count_nonzero(keep)), dtype=complex)
+    fft1 = np.atleast_2d(fft1)[:, keep]
+    fft2 = np.atleast_2d(fft2)[:, keep]
+    out = []
+    for part in (np.real, np.imag):
+        a = wrap(part(fft1).astype(np.int64), width)
+        b = wrap(part(fft2).astype(np.int64), width)
+        # Negation happens at the FFT's width
+        a = np.where(neg[keep], wrap(-a, width), a)
+        b = np.where(neg[keep], wrap(-b, width), b)
+        out.append(wrap((a >> shift) + (b >> shift), 16, overflow, "equalizer"))
+    return out[0] + 1j * out[1]
+
+
+def csi_extractor(
+    i,
+    q,
+    sw=4,
+    fir_width=27,
+    fir_lsb=11,
+    window_shift=4,
+    delay_shift=4,
+    fft_xbits=2,
+    fft_owidth=16,
+    fft_cbits=4,
+    eq_shift=1,
+    overflow=None,
+    cycles=None,
+):
+    """
+    Model of `csi_extractor_sv` for 122.88 MSPS input samples.
+
+    Returns the (packets, 52) CSI and the index of each packet's first LTS
+    sample in the 20 MSPS stream. The defaults match the RTL; the other
+    values are there to explore alternatives. `cycles` gives the clock cycle
+    each input sample is accepted on (default: one sample per cycle).
+    """
+    i_ds, q_ds, taken = front_end(i, q, None, fir_width, fir_width, fir_lsb, overflow)
+    cycles = taken if cycles is None else np.asarray(cycles, dtype=np.int64)[taken]
+    starts = find_lts(i_ds, q_ds, sw, cycles, window_shift, delay_shift)
+    if len(starts) == 0:
+        return np.zeros((0, 52), dtype=complex), starts
+    frames = lts_frames(i_ds, q_ds, starts)
+    fft = fftmain(frames, 16, fft_xbits, fft_owidth, fft_cbits, overflow)
+    csi = equalizer(fft[0::2], fft[1::2], eq_shift, fft_owidth, overflow)
+    return csi, starts
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    # fftmain is np.fft.fft / 32 to within rounding for inputs with headroom
+    x = rng.integers(-(2**12), 2**12, (100, 64)) + 1j * rng.integers(
+        -(2**12), 2**12, (100, 64)
+    )
+    err = np.abs(fftmain(x) - np.fft.fft(x, axis=1) / 32)
+    assert err.max() < 4, err.max()
+    # No packets: empty batches all the way through instead of a crash
+    assert fftmain(np.zeros((0, 64), dtype=complex)).shape == (0, 64)
+    assert equalizer(np.zeros((0, 64)), np.zeros((0, 64))).shape == (0, 52)
+    quiet = rng.integers(-4, 4, (2, 20_000))
+    csi, starts = csi_extractor(quiet[0], quiet[1])
+    assert csi.shape == (0, 52) and len(starts) == 0
+    print("csi_model self-check passed")
@@ -0,0 +1,88 @@
+import re
+from pathlib import Path
+
+import numpy as np
+
+HDL_PATH = (
+    Path(__file__).resolve().parent.parent.parent
+    / "WaveSense/ip_repo/csi_extractor_1_0/hdl"
+)
+FFT_CORE_PATH = HDL_PATH.parent / "src/fft-core"
+
+
+def read_hdl(name):
+    """
+    Read the source of one of the modules in the IP's hdl folder
+    """
+    return (HDL_PATH / name).read_text()
+
+
+def fir_17_coeffs():
+    """
+    Extract the coefficient table from the `initial` block of fir_17.sv
+    """
+    src = read_hdl("fir_17.sv")
+    taps = {
+        int(idx): int(val)
+        for idx, val in re.findall(r"coeffs\[(\d+)\]\s*=\s*(-?\d+)\s*;", src)
+    }
+    return np.array([taps[i] for i in range(len(taps))], dtype=np.int64)
+
+
+def lts_xcorr_coeffs():
+    """
+    Extract the (conjugated) LTS coefficients from lts_xcorr.sv.
+
+    Returns a (NUM_COEFFS, 2) array of (I, Q) pairs.
+    """
+    src = read_hdl("lts_xcorr.sv")
+    pattern = (
+        r"\{coeffs_i\[(\d+)\],\s*coeffs_q\[\d+\]\}\s*<=\s*"
+        r"\{\s*(-?)16'd(\d+)\s*,\s*(-?)16'd(\d+)\s*\}"
+    )
+    taps = {}
+    for idx, i_sign, i_val, q_sign, q_val in re.findall(pattern, src):
+        taps[int(idx)] = (
+            -int(i_val) if i_sign else int(i_val),
+            -int(q_val) if q_sign else int(q_val),
+        )
+    return np.array([taps[i] for i in range(len(taps))], dtype=np.int64)
+
+
+def fft_coeffs(n, cwidth):
+    """
+    Twiddle factors of a size `n` fftstage, as a (n // 2, 2) array of (re, im).
+
+    Read from the generated cmem_<n>.hex when it has the requested width, and
+    otherwise computed the same way fftgen does.
+    """
+    path = FFT_CORE_PATH / f"cmem_{n}.hex"
+    lines = []
+    if path.exists():
+        lines = [
+            line.strip()
+            for line in path.read_text().splitlines()
+            if line.strip() and not line.startswith("//")
+        ]
+    if lines and len(lines[0]) * 4 == 2 * cwidth:
+        words = np.array([int(line, 16) for line in lines], dtype=np.int64)
+        mask = (1 << cwidth) - 1
+        half = 1 << (cwidth - 1)
+        re = (((words >> cwidth) & mask) ^ half) - half
+        im = ((words & mask) ^ half) - half
+        return np.stack((re, im), axis=1)
+    w = np.exp(-2j * np.pi * np.arange(n // 2) / n) * 2 ** (cwidth - 2)
+    return np.stack((np.round(w.real), np.round(w.imag)), axis=1).astype(np.int64)
+
+
+def equalizer_masks():
+    """
+    POS_MASK and NEG_MASK from equalizer.sv as boolean arrays indexed by FFT bin
+    """
+    src = read_hdl("equalizer.sv")
+    masks = []
+    for name in ("POS_MASK", "NEG_MASK"):
+        bits = re.search(name + r"\s*=\s*64'b([01_]+)", src).group(1).replace("_", "")
+        # Bin k is bit FFT_LEN - k - 1, i.e. the MSB is bin 0
+        masks.append(np.array([b == "1" for b in bits]))
+    return masks[0], masks[1]
@@ -0,0 +1,269 @@
+"""
+Packet-level timing model of `csi_extractor_sv`.
+
+Each stage is a server that holds a packet for a fixed number of cycles (or
+20 MSPS samples, for the stages that run at the sample rate) and can only
+take the next packet when it is free again:
+
+    front end    fir_17 + downsample, a fixed pipeline delay
+    sync_short   from the packet reaching lts_extractor to STS detection
+    sync_long    from detection until the LTS is in the input buffer and
+                 its peaks are found; it then needs block_fft to be
+                 RECEIVING to output the 128 LTS samples, and lts_extractor
+                 only re-arms `rearm` cycles after the first lts_axis_tlast
+    block_fft    busy from the first LTS sample in until both FFTs have
+                 drained (EXTENDING), plus RESETTING
+    equalizer    the first (cached) FFT passes at full rate, the 52 used
+                 bins of the second only as fast as csi_axis_tready allows
+
+A packet whose STS has mostly gone by before lts_extractor re-arms is missed,
+which is how the RTL loses packets: the input side never backpressures.
+
+The cycle counts in TIMING are estimates from the RTL; calibrate() replaces
+them with the medians measured by latency_probe.LatencyProbe, which
+csi_extractor_latency_test writes to LATENCY_OUT. Run this file for the time
+per packet and some what-if tables, or as
+
+    python perf_model.py latencies.json
+
+to also check the model calibrated from that file against its measurement.
+"""
+
+import json
+import sys
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+from csi_model import LTS_LEN
+
+# 122.88 MSPS input samples per 20 MSPS sample
+RATIO = 122.88 / 20
+
+TIMING = {
+    # Cycles from a sample going in to the downsampled sample coming out
+    "front_end": 20,
+    # 20 MSPS samples from the packet start to short_preamble_detected
+    "sync_short": 132,
+    # 20 MSPS samples from detection until sync_long can output the LTS
+    "sync_long": 200,
+    # Cycles from sync_long starting its output to the first LTS beat
+    "lts_pipeline": 5,
+    # Cycles from the first LTS beat to the first FFT beat
+    "fft": 150,
+    # Cycles from the first FFT beat to the first CSI beat
+    "csi": 68,
+    # Cycles from the first to the last CSI beat with csi_axis_tready high
+    "csi_end": 60,
+    # Cycles block_fft spends in RESETTING and re-registering ready
+    "fft_reset": 2,
+    # Cycles after the first lts_axis_tlast before lts_extractor can trigger
+    "rearm": 70,
+    # 20 MSPS samples into the STS by which lts_extractor has to be armed
+    "sts_slack": 28,
+}
+
+# Per packet: whether it was found, and the cycles its first STF sample went
+# in and its first and last CSI beats came out (NaN if missed)
+Result = namedtuple("Result", ["detected", "start", "csi_first", "csi_last"])
+
+
+def load_latencies(path):
+    """
+    The latencies csi_extractor_latency_test wrote to LATENCY_OUT, and the
+    input samples per cycle they were measured at
+    """
+    with open(path) as f:
+        data = json.load(f)
+    latencies = {k: np.array(v, dtype=np.float64) for k, v in data["latencies"].items()}
+    return latencies, data["samples_per_cycle"]
+
+
+def calibrate(latencies, samples_per_cycle=1.0, timing=TIMING):
+    """
+    TIMING with the stage latencies replaced by the medians of a
+    LatencyProbe.latencies() measurement taken at `samples_per_cycle`, or of
+    the LATENCY_OUT file at path `latencies`
+    """
+    if isinstance(latencies, (str, Path)):
+        latencies, samples_per_cycle = load_latencies(latencies)
+    period = RATIO / samples_per_cycle
+    median = {k: float(np.median(v)) for k, v in latencies.items() if len(v)}
+    timing = dict(timing)
+    if "front_end" in median:
+        timing["front_end"] = median["front_end"]
+    if "sync_short" in median:
+        timing["sync_short"] = median["sync_short"] / period
+    if "sync_long" in median:
+        timing["sync_long"] = (median["sync_long"] - timing["lts_pipeline"]) / period
+    if "fft" in median and "lts_end" in median:
+        timing["fft"] = median["lts_end"] + median["fft"]
+    if "csi" in median and "fft_end" in median:
+        timing["csi"] = median["csi"] + median["fft_end"]
+    if "csi_end" in median:
+        timing["csi_end"] = median["csi_end"]
+    return timing
+
+
+class PerfModel:
+    """
+    Timing of csi_extractor_sv for a stream of packets.
+
+    num_ffts block_ffts take packets in turn, and lts_buffer LTS pairs can
+    wait between sync_long and block_fft (none today), so lts_extractor
+    re-arms without waiting for an FFT.
+    """
+
+    def __init__(self, timing=TIMING, num_ffts=1, lts_buffer=0):
+        self.timing = dict(timing)
+        self.num_ffts = num_ffts
+        self.lts_buffer = lts_buffer
+
+    def run(self, starts, samples_per_cycle=1.0, ready_duty=1.0):
+        """
+        Follow packets starting at 20 MSPS sample indices `starts` through
+        the stages, with one input sample every 1 / samples_per_cycle cycles
+        and csi_axis_tready high on ready_duty of the cycles
+        """
+        t = self.timing
+        period = RATIO / samples_per_cycle
+        # The second FFT's used bins drain at the output rate
+        csi_span = t["csi_end"] + (LTS_LEN - 12) * (1 / ready_duty - 1)
+        fft_free = np.zeros(self.num_ffts)
+        # When the LTS pairs waiting in the buffer get an FFT
+        waiting = []
+        armed = -np.inf
+        n = len(starts)
+        detected = np.zeros(n, dtype=bool)
+        start = np.asarray(starts, dtype=np.float64) * period
+        csi_first = np.full(n, np.nan)
+        csi_last = np.full(n, np.nan)
+        for p in range(n):
+            front_end = start[p] + t["front_end"]
+            if armed > front_end + t["sts_slack"] * period:
+                continue
+            detected[p] = True
+            lts_ready = front_end + (t["sync_short"] + t["sync_long"]) * period
+            k = int(np.argmin(fft_free))
+            fft_start = max(lts_ready, fft_free[k]) + t["lts_pipeline"]
+            waiting = [w for w in waiting if w > lts_ready]
+            if len(waiting) < self.lts_buffer:
+                # sync_long empties into the buffer straight away
+                first_tlast = lts_ready + t["lts_pipeline"] + LTS_LEN
+                waiting.append(fft_start)
+            else:
+                first_tlast = fft_start + LTS_LEN
+            armed = first_tlast + t["rearm"]
+            csi_first[p] = fft_start + t["fft"] + t["csi"]
+            csi_last[p] = csi_first[p] + csi_span
+            fft_free[k] = csi_last[p] + t["fft_reset"]
+        return Result(detected, start, csi_first, csi_last)
+
+    def lone_latency(self, samples_per_cycle=1.0):
+        """
+        Cycles from the first STF sample to the last CSI beat of a packet
+        with nothing else in flight
+        """
+        result = self.run([0], samples_per_cycle)
+        return float(result.csi_last[0] - result.start[0])
+
+    @staticmethod
+    def summary(result):
+        """
+        Fraction of packets found, latency percentiles (cycles from the first
+        STF sample to the last CSI beat) and CSI beats out per cycle
+        """
+        found = result.detected
+        latency = (result.csi_last - result.start)[found]
+        span = np.nanmax(result.csi_last) - result.start[0] if found.any() else 0
+        return {
+            "packets": len(found),
+            "detected": float(found.mean()) if len(found) else 0.0,
+            "latency_p50": float(np.median(latency)) if len(latency) else np.nan,
+            "latency_max": float(latency.max()) if len(latency) else np.nan,
+            "beats_per_cycle": 52 * int(found.sum()) / span if span else 0.0,
+        }
+
+
+def check_calibration(path, tolerance=0.05):
+    """
+    Calibrate from the LATENCY_OUT file at path and check that a lone
+    packet's modelled latency is within tolerance of the measured median
+    """
+    latencies, samples_per_cycle = load_latencies(path)
+    model = PerfModel(calibrate(latencies, samples_per_cycle))
+    modelled = model.lone_latency(samples_per_cycle)
+    measured = float(np.median(latencies["total"]))
+    assert (
+        abs(modelled - measured) <= tolerance * measured
+    ), f"Modelled latency {modelled:.0f} cycles, measured {measured:.0f}"
+    return model
+
+
+def packet_stream(rate, duration, length=720, seed=None):
+    """
+    Start samples (20 MSPS) of packets arriving as a Poisson process at
+    `rate` packets per second for `duration` seconds, `length` samples long
+    and never overlapping
+    """
+    rng = np.random.default_rng(seed)
+    gaps = rng.exponential(20e6 / rate, int(rate * duration * 1.2) + 1)
+    starts = np.cumsum(np.maximum(gaps, 0) + length).astype(np.int64)
+    return starts[starts < duration * 20e6]
+
+
+if __name__ == "__main__":
+    import time
+
+    starts = packet_stream(5000, 20.0, seed=0)
+    model = PerfModel()
+    begin = time.perf_counter()
+    result = model.run(starts)
+    elapsed = time.perf_counter() - begin
+    # A packet on its own goes straight through
+    lone = model.run([0])
+    expected = (
+        TIMING["front_end"]
+        + (TIMING["sync_short"] + TIMING["sync_long"]) * RATIO
+        + TIMING["lts_pipeline"]
+        + TIMING["fft"]
+        + TIMING["csi"]
+        + TIMING["csi_end"]
+    )
+    assert lone.detected[0] and np.isclose(lone.csi_last[0], expected)
+    assert np.isclose(model.lone_latency(), expected)
+    timing = TIMING
+    if len(sys.argv) > 1:
+        calibrated = check_calibration(sys.argv[1])
+        print(
+            f"Calibrated from {sys.argv[1]}: "
+            f"{calibrated.lone_latency():.0f} cycles for a lone packet"
+        )
+        timing = calibrated.timing
+    print(
+        f"{len(starts)} packets in {1e3 * elapsed:.0f} ms "
+        f"({1e6 * elapsed / len(starts):.1f} us per packet)"
+    )
+
+    # Short (ACK sized) packets, with the host draining the CSI slowly
+    print("Packets found (%) by packet rate (/s) and csi_axis_tready duty cycle")
+    variants = {
+        "today": PerfModel(timing),
+        "2 FFTs": PerfModel(timing, num_ffts=2),
+        "LTS buffer": PerfModel(timing, lts_buffer=1),
+    }
+    rates = [5000, 20000, 40000]
+    print(f"{'':>23}" + "".join(f"{r:>8}" for r in rates))
+    for duty in (1.0, 0.01, 0.003):
+        for name, variant in variants.items():
+            found = [
+                variant.run(packet_stream(r, 1.0, length=400, seed=1), 1.0, duty)
+                for r in rates
+            ]
+            print(
+                f"{name:>10}, tready {duty:5.3f}"
+                + "".join(
+                    f"{100 * PerfModel.summary(f)['detected']:8.1f}" for f in found
+                )
+            )
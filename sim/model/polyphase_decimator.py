@@ -0,0 +1,154 @@
+"""
+Bit-exact fast path for `fir_17` followed by `downsample`.
+
+Only the filter outputs that `downsample` forwards are computed, so it costs
+17 multiply-accumulates per 20 MSPS output instead of per 122.88 MSPS input.
+The sums are integers, so they are done in float32 with BLAS whenever no
+partial sum can reach 2^24 (16 bit samples with the fir_17 taps), where every
+float32 sum is exact, and in float64 or int64 otherwise. Run this file to
+check it against the separate fir_17 and downsample models.
+"""
+
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from csi_model import downsample_mask, front_end, wrap
+from hdl_params import fir_17_coeffs
+
+RATE_IN = 122_880
+RATE_OUT = 20_000
+
+
+def kept_outputs(n, start=0, rate_in=RATE_IN, rate_out=RATE_OUT):
+    """
+    Which of n filter outputs `downsample` forwards, when `start` outputs
+    have already gone through it. Output k is kept when output sample m
+    falls due during it, k * rate_out < m * rate_in <= (k + 1) * rate_out,
+    so only the kept indices are ever computed.
+    """
+    m = np.arange(
+        start * rate_out // rate_in + 1,
+        (start + n) * rate_out // rate_in + 1,
+        dtype=np.int64,
+    )
+    return -(-m * rate_in // rate_out) - 1 - start
+
+
+def fir_downsample(
+    x,
+    coeffs=None,
+    width=27,
+    lsb=11,
+    start=0,
+    rate_in=RATE_IN,
+    rate_out=RATE_OUT,
+    overflow=None,
+):
+    """
+    The 16 bit [lsb+15:lsb] slice of the fir_17 outputs that downsample keeps.
+
+    Returns the samples and the index of the filter output each one is (the
+    first filter output needs 17 inputs, so output n ends at input n + 16).
+    """
+    if coeffs is None:
+        coeffs = fir_17_coeffs()
+    x = np.asarray(x, dtype=np.int64)
+    if len(x) < len(coeffs):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    keep = kept_outputs(len(x) - len(coeffs) + 1, start, rate_in, rate_out)
+    # The largest any partial sum of products can get
+    bound = int(np.abs(coeffs).sum()) * max(-int(x.min()), int(x.max()))
+    dtype = np.float32 if bound < 2**24 else np.float64 if bound < 2**53 else np.int64
+    # Every window of the input is a view, only the kept ones are multiplied
+    windows = sliding_window_view(x.astype(dtype), len(coeffs))
+    y = (windows[keep] @ np.asarray(coeffs[::-1], dtype=dtype)).astype(np.int64)
+    y = wrap(y, width, overflow, "fir_17")
+    return wrap(y >> lsb, 16, overflow, "filter_slice"), keep
+
+
+class PolyphaseDecimator:
+    """
+    Streaming version of fir_downsample for I/Q data that arrives in chunks,
+    keeping the filter history and the downsample counter between them
+    """
+
+    def __init__(self, coeffs=None, width=27, lsb=11):
+        self.coeffs = fir_17_coeffs() if coeffs is None else coeffs
+        self.width = width
+        self.lsb = lsb
+        self.history_i = np.zeros(0, dtype=np.int64)
+        self.history_q = np.zeros(0, dtype=np.int64)
+        # Filter outputs produced so far
+        self.count = 0
+
+    def process(self, i, q):
+        """
+        Filter and downsample the next chunk, returning the new (I, Q) samples
+        """
+        i = np.concatenate((self.history_i, i))
+        q = np.concatenate((self.history_q, q))
+        i_out, _ = fir_downsample(i, self.coeffs, self.width, self.lsb, self.count)
+        q_out, _ = fir_downsample(q, self.coeffs, self.width, self.lsb, self.count)
+        self.count += max(len(i) - len(self.coeffs) + 1, 0)
+        self.history_i = i[-(len(self.coeffs) - 1) :]
+        self.history_q = q[-(len(self.coeffs) - 1) :]
+        return i_out, q_out
+
+
+def decimate_dump(path, chunk_samples=1 << 20, **kwargs):
+    """
+    Yield the 20 MSPS (I, Q) samples of a raw ADC dump of interleaved 16 bit
+    I/Q samples (like samples.dat), chunk_samples input samples at a time
+    """
+    dump = np.memmap(path, dtype=np.int16, mode="r")
+    decimator = PolyphaseDecimator(**kwargs)
+    for start in range(0, len(dump) // 2, chunk_samples):
+        chunk = dump[2 * start : 2 * (start + chunk_samples)]
+        yield decimator.process(chunk[::2], chunk[1::2])
+
+
+if __name__ == "__main__":
+    import sys
+    from pathlib import Path
+
+    sys.path.append(str(Path(__file__).resolve().parent.parent))
+    from test_utils import upsample_data, DESIRED_SAMPLE_RATE, DATA_SAMPLE_RATE
+
+    rng = np.random.default_rng(0)
+    samples = np.fromfile(
+        Path(__file__).resolve().parent.parent / "samples.dat", dtype=np.int16
+    )
+    stimuli = {
+        "samples.dat": [
+            upsample_data(s, DATA_SAMPLE_RATE, DESIRED_SAMPLE_RATE).astype(np.int32)
+            for s in (samples[::2], samples[1::2])
+        ],
+        "full scale noise": list(rng.integers(-(2**15), 2**15, (2, 1_000_000))),
+    }
+    for name, (i, q) in stimuli.items():
+        # Reference: every fir_17 output, then downsample
+        start = time.perf_counter()
+        ref_i, ref_q, _ = front_end(i, q, i_width=27, q_width=27)
+        ref_time = time.perf_counter() - start
+        start = time.perf_counter()
+        out_i, keep = fir_downsample(i)
+        out_q, _ = fir_downsample(q)
+        fast_time = time.perf_counter() - start
+        assert (out_i == ref_i).all() and (out_q == ref_q).all(), name
+        assert (keep == np.flatnonzero(downsample_mask(len(i) - 16))).all(), name
+        # Same again in randomly sized chunks
+        decimator = PolyphaseDecimator()
+        bounds = np.sort(rng.integers(0, len(i), 20))
+        chunks = [
+            decimator.process(i[a:b], q[a:b])
+            for a, b in zip(np.concatenate(([0], bounds)), np.append(bounds, len(i)))
+        ]
+        assert (np.concatenate([c[0] for c in chunks]) == ref_i).all(), name
+        assert (np.concatenate([c[1] for c in chunks]) == ref_q).all(), name
+        full_macs = 17 * (len(i) - 16)
+        print(
+            f"{name}: {len(out_i)} outputs match, {full_macs // (17 * len(out_i))}x "
+            f"fewer MACs, {ref_time / fast_time:.1f}x faster"
+        )
@@ -0,0 +1,219 @@
+"""
+Buffer occupancy probes for cocotb simulations.
+
+BufferProbes samples the few signals each buffer's occupancy depends on once
+per cycle (one trigger for all buffers) into preallocated NumPy traces, and
+works out the occupancy, high-watermark, time at full and overflows from the
+traces afterwards, so probing costs one int() per signal per cycle.
+
+Buffers are added with:
+
+    bram_fifo(inst)        a bram_fifo instance (find_bram_fifos() finds all
+                           of them below a handle)
+    pointers(w, r, depth)  a circular RAM with write and read pointers
+    sync_long(inst)        sync_long's input buffer, whose write address
+                           counts up from reset and sticks at the end
+    equalizer_cache(inst)  the equalizer's 64 entry cache of the first LTS FFT
+
+    probes = BufferProbes(dut.clk_in)
+    for inst in find_bram_fifos(dut):
+        probes.add(bram_fifo(inst))
+    cocotb.start_soon(probes.run())
+    ...
+    dut._log.info(probes.report())
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from cocotb.handle import HierarchyObject
+from cocotb.triggers import FallingEdge, ReadOnly
+
+# A buffer to probe: the signals to sample, and functions of their traces
+# (a dict of arrays) giving the occupancy and the cycles that lost data
+Buffer = namedtuple("Buffer", ["name", "capacity", "signals", "occupancy", "overflow"])
+
+
+def _path(handle):
+    return handle._path.split(".", 1)[-1]
+
+
+def bram_fifo(inst):
+    """
+    A bram_fifo: the occupancy is the number of valid registers, and an
+    input beat is lost when the FIFO is full and the output isn't ready
+    """
+    depth = len(inst.valid_buf)
+    return Buffer(
+        _path(inst),
+        depth,
+        {
+            "valid_buf": inst.valid_buf,
+            "s_axis_tvalid": inst.s_axis_tvalid,
+            "m_axis_tready": inst.m_axis_tready,
+        },
+        lambda t: ((t["valid_buf"][:, None] >> np.arange(depth)) & 1).sum(axis=1),
+        lambda t: (t["s_axis_tvalid"] != 0)
+        & (t["m_axis_tready"] == 0)
+        & ((t["valid_buf"] >> (depth - 1)) & 1 != 0),
+    )
+
+
+def pointers(name, write_ptr, read_ptr, depth, write_en=None):
+    """
+    A circular buffer of `depth` entries between two pointers, full one
+    entry before the write pointer catches up with the read pointer
+    """
+    signals = {"write": write_ptr, "read": read_ptr}
+    if write_en is not None:
+        signals["write_en"] = write_en
+
+    def occupancy(t):
+        return (t["write"] - t["read"]) % depth
+
+    def overflow(t):
+        full = occupancy(t) == depth - 1
+        return full & (t["write_en"] != 0) if write_en is not None else full
+
+    return Buffer(name, depth - 1, signals, occupancy, overflow)
+
+
+def sync_long(inst):
+    """
+    sync_long's input buffer: every sample after reset is written at the
+    next address until the last one, after which samples are dropped
+    """
+    depth = 1 << len(inst.signal_waddr)
+    return Buffer(
+        _path(inst) + ".input_buf",
+        depth - 1,
+        {"waddr": inst.signal_waddr, "tvalid": inst.signal_axis_tvalid},
+        lambda t: t["waddr"],
+        lambda t: (t["tvalid"] != 0) & (t["waddr"] == depth - 1),
+    )
+
+
+def equalizer_cache(inst):
+    """
+    The equalizer's fft_cache: filled with the first LTS FFT, then drained as
+    the second one comes in and is combined with it. Both sides are addressed
+    by the input handshake counter, so it can't overflow; time at full is time
+    spent waiting for the second FFT.
+    """
+    depth = 1 << len(inst.k_cnt)
+    return Buffer(
+        _path(inst) + ".fft_cache",
+        depth,
+        {"k_cnt": inst.k_cnt, "lts_idx": inst.lts_idx},
+        lambda t: np.where(t["lts_idx"] != 0, depth - t["k_cnt"], t["k_cnt"]),
+        lambda t: np.zeros(len(t["k_cnt"]), dtype=bool),
+    )
+
+
+def find_bram_fifos(handle):
+    """
+    Every bram_fifo instance below handle
+    """
+    found = []
+    for child in handle:
+        if not isinstance(child, HierarchyObject):
+            continue
+        names = {c._name for c in child}
+        if {"valid_buf", "data_buf", "s_axis_tvalid"} <= names:
+            found.append(child)
+        else:
+            found.extend(find_bram_fifos(child))
+    return found
+
+
+class BufferProbes:
+    """
+    Samples every added Buffer each cycle while run() is going
+    """
+
+    def __init__(self, clk, chunk=1 << 16):
+        self.clock = clk
+        self.chunk = chunk
+        self.buffers = []
+        self.cycles = 0
+        self._handles = []
+        self._trace = np.zeros((0, chunk), dtype=np.int64)
+
+    def add(self, buffer):
+        self.buffers.append(buffer)
+        self._handles.extend(buffer.signals.values())
+        self._trace = np.zeros((len(self._handles), self.chunk), dtype=np.int64)
+        return buffer
+
+    async def run(self):
+        falling_edge = FallingEdge(self.clock)
+        read_only = ReadOnly()
+        handles = self._handles
+        while True:
+            await falling_edge
+            await read_only
+            if self.cycles == self._trace.shape[1]:
+                self._trace = np.concatenate(
+                    (self._trace, np.zeros_like(self._trace)), axis=1
+                )
+            column = self._trace[:, self.cycles]
+            for n, handle in enumerate(handles):
+                try:
+                    column[n] = int(handle.value)
+                except ValueError:
+                    # X/Z before reset
+                    column[n] = 0
+            self.cycles += 1
+
+    def traces(self):
+        """
+        The sampled signals of each buffer, {name: {signal: (cycles,) array}}
+        """
+        out = {}
+        row = 0
+        for buffer in self.buffers:
+            out[buffer.name] = {
+                signal: self._trace[row + n, : self.cycles]
+                for n, signal in enumerate(buffer.signals)
+            }
+            row += len(buffer.signals)
+        return out
+
+    def summary(self):
+        """
+        Occupancy statistics of each buffer over the cycles sampled so far
+        """
+        stats = {}
+        traces = self.traces()
+        for buffer in self.buffers:
+            trace = traces[buffer.name]
+            occupancy = np.asarray(buffer.occupancy(trace))
+            overflow = np.asarray(buffer.overflow(trace), dtype=bool)
+            stats[buffer.name] = {
+                "capacity": buffer.capacity,
+                "high_watermark": int(occupancy.max(initial=0)),
+                "mean": float(occupancy.mean()) if len(occupancy) else 0.0,
+                "time_at_full": (
+                    float(np.mean(occupancy >= buffer.capacity))
+                    if len(occupancy)
+                    else 0.0
+                ),
+                "overflows": int(np.count_nonzero(overflow)),
+                "overflow_cycles": np.flatnonzero(overflow),
+                "histogram": np.bincount(occupancy, minlength=buffer.capacity + 1),
+            }
+        return stats
+
+    def report(self):
+        lines = [
+            f"{'buffer':>48} {'size':>5} {'max':>5} {'mean':>7} {'full':>7} "
+            f"{'overflows':>9}"
+        ]
+        for name, s in self.summary().items():
+            lines.append(
+                f"{name:>48} {s['capacity']:5d} {s['high_watermark']:5d} "
+                f"{s['mean']:7.2f} {100 * s['time_at_full']:6.2f}% "
+                f"{s['overflows']:9d}"
+            )
+        return "\n".join(lines)
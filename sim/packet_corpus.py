@@ -0,0 +1,278 @@
+"""
+Builds a randomized regression corpus for `lts_extractor` / `csi_extractor_sv`.
+
+Packets (synthetic 802.11 preambles + OFDM symbols, or the ones recorded in
+samples.dat) go through a random multipath channel, CFO, gain and noise, and
+are stitched together with random gaps into shards. Each shard is a 20 MSPS
+.dat file in the same format as samples.dat, plus an .npz sidecar with the
+ground truth for every packet and the outputs the bit-accurate model expects
+from the RTL, so every shard can be run on its own:
+
+    CORPUS_SHARD=corpus/shard_0000.dat python test_lts_extractor.py
+
+Usage: python packet_corpus.py [--packets 2000] [--shards 8] [--seed 0]
+                               [--out corpus] [--workers N]
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from golden_cache import SAMPLES_PATH, load_samples, lts_ref
+from csi_model import MODEL_VERSION, csi_extractor, find_lts, lts_frames
+from test_utils import upsample_data, DESIRED_SAMPLE_RATE, DATA_SAMPLE_RATE
+
+CORPUS_PATH = Path(__file__).resolve().parent / "corpus"
+
+# Short training symbol on subcarriers -26..26 (802.11a-1999, 17.3.3)
+STS_FREQ = np.sqrt(13 / 6) * np.array(
+    [0, 0, 1 + 1j, 0, 0, 0, -1 - 1j, 0, 0, 0, 1 + 1j, 0, 0, 0, -1 - 1j, 0, 0, 0]
+    + [-1 - 1j, 0, 0, 0, 1 + 1j, 0, 0, 0, 0, 0, 0, 0, -1 - 1j, 0, 0, 0, -1 - 1j]
+    + [0, 0, 0, 1 + 1j, 0, 0, 0, 1 + 1j, 0, 0, 0, 1 + 1j, 0, 0, 0, 1 + 1j, 0, 0]
+)
+# Where the LTS starts in a synthetic packet (10 STS + the double guard interval)
+LTS_OFFSET = 160 + 32
+
+# Ranges the per-packet randomization is drawn from
+DEFAULT_RANGES = {
+    "gap": (100, 2000),  # Samples of noise before each packet
+    "rms": (20.0, 6000.0),  # Packet RMS in ADC counts (log-uniform)
+    "snr_db": (5.0, 40.0),
+    "cfo_hz": (-60e3, 60e3),
+    "delay_spread": (0.0, 1.5),  # RMS delay spread of the channel in samples
+    "data_symbols": (4, 20),
+    "recorded": 0.25,  # Fraction of packets taken from samples.dat
+}
+
+
+def sts():
+    """
+    The 160 sample short training field
+    """
+    freq = np.zeros(64, dtype=complex)
+    freq[np.arange(-26, 27)] = STS_FREQ
+    return np.tile(np.fft.ifft(freq), 3)[:160]
+
+
+def synthetic_packet(rng, num_symbols):
+    """
+    A preamble followed by num_symbols OFDM symbols of random QPSK
+    """
+    lts = np.array(lts_ref())
+    used = np.concatenate((np.arange(1, 27), np.arange(38, 64)))
+    freq = np.zeros((num_symbols, 64), dtype=complex)
+    freq[:, used] = (
+        rng.choice([-1, 1], (num_symbols, 52))
+        + 1j * rng.choice([-1, 1], (num_symbols, 52))
+    ) / np.sqrt(2)
+    symbols = np.fft.ifft(freq, axis=1)
+    # 16 sample cyclic prefix on each data symbol
+    data = np.concatenate((symbols[:, -16:], symbols), axis=1).ravel()
+    return np.concatenate((sts(), lts[-32:], lts, lts, data))
+
+
+def recorded_packets(samples_path=SAMPLES_PATH):
+    """
+    Cut the packets out of a recording, returning a list of (packet, LTS offset)
+    """
+    i, q = load_samples(samples_path)
+    x = i.astype(float) + 1j * q.astype(float)
+    starts = find_lts(i, q)
+    # Packets end where the signal falls back to the noise floor
+    power = np.convolve(np.abs(x), np.ones(32) / 32, mode="same")
+    floor = np.median(power)
+    packets = []
+    for lts in starts:
+        begin = max(lts - LTS_OFFSET, 0)
+        quiet = np.flatnonzero(power[lts + 128 :] < 3 * floor)
+        end = lts + 128 + (quiet[0] if len(quiet) else len(x) - lts - 128)
+        packet = x[begin:end]
+        packets.append((packet / np.sqrt(np.mean(np.abs(packet) ** 2)), lts - begin))
+    return packets
+
+
+def channel(rng, delay_spread):
+    """
+    Random multipath taps with an exponential power delay profile
+    """
+    if delay_spread <= 0:
+        return np.ones(1, dtype=complex)
+    n = np.arange(int(np.ceil(5 * delay_spread)) + 1)
+    power = np.exp(-n / delay_spread)
+    taps = np.sqrt(power / 2) * (
+        rng.standard_normal(len(n)) + 1j * rng.standard_normal(len(n))
+    )
+    return taps / np.sqrt(np.sum(np.abs(taps) ** 2))
+
+
+def build_shard(seed, num_packets, ranges=DEFAULT_RANGES, samples_path=SAMPLES_PATH):
+    """
+    Generate one shard, returning the 20 MSPS I/Q samples and the ground truth
+    """
+    rng = np.random.default_rng(seed)
+    recorded = recorded_packets(samples_path)
+    used = np.concatenate((np.arange(1, 27), np.arange(38, 64)))
+    pieces = []
+    truth = {
+        k: []
+        for k in ("packet_start", "lts_start", "rms", "snr_db", "cfo_hz", "recorded")
+    }
+    truth["channel"] = []
+    pos = 0
+    for _ in range(num_packets):
+        if rng.uniform() < ranges["recorded"]:
+            packet, lts_offset = recorded[rng.integers(len(recorded))]
+            is_recorded = True
+        else:
+            packet = synthetic_packet(rng, rng.integers(*ranges["data_symbols"]))
+            packet /= np.sqrt(np.mean(np.abs(packet) ** 2))
+            lts_offset = LTS_OFFSET
+            is_recorded = False
+        taps = channel(rng, rng.uniform(*ranges["delay_spread"]))
+        rms = np.exp(rng.uniform(*np.log(ranges["rms"])))
+        snr_db = rng.uniform(*ranges["snr_db"])
+        cfo = rng.uniform(*ranges["cfo_hz"])
+        gap = rng.integers(*ranges["gap"])
+        rx = np.convolve(packet, taps) * rms
+        rx *= np.exp(2j * np.pi * cfo / DATA_SAMPLE_RATE * np.arange(len(rx)))
+        segment = np.concatenate((np.zeros(gap), rx))
+        noise_rms = rms * 10 ** (-snr_db / 20)
+        segment += (
+            noise_rms
+            / np.sqrt(2)
+            * (
+                rng.standard_normal(len(segment))
+                + 1j * rng.standard_normal(len(segment))
+            )
+        )
+        pieces.append(segment)
+        truth["packet_start"].append(pos + gap)
+        truth["lts_start"].append(pos + gap + lts_offset)
+        truth["rms"].append(rms)
+        truth["snr_db"].append(snr_db)
+        truth["cfo_hz"].append(cfo)
+        truth["recorded"].append(is_recorded)
+        # Frequency response of the channel on the 52 subcarriers (unknown for
+        # recorded packets, which already went through a real channel)
+        response = np.fft.fft(taps, 64)[used]
+        truth["channel"].append(response if not is_recorded else np.full(52, np.nan))
+        pos += len(segment)
+    x = np.concatenate(pieces)
+    i = np.clip(np.round(x.real), -(2**15), 2**15 - 1).astype(np.int16)
+    q = np.clip(np.round(x.imag), -(2**15), 2**15 - 1).astype(np.int16)
+    return i, q, {k: np.array(v) for k, v in truth.items()}
+
+
+def expected_outputs(i, q, sw=4):
+    """
+    What the models expect from lts_extractor (fed the 20 MSPS samples
+    directly) and csi_extractor_sv (fed them upsampled like the testbench does)
+    """
+    lts_starts = find_lts(i, q, sw)
+    i_up = upsample_data(i, DATA_SAMPLE_RATE, DESIRED_SAMPLE_RATE)
+    q_up = upsample_data(q, DATA_SAMPLE_RATE, DESIRED_SAMPLE_RATE)
+    csi, csi_starts = csi_extractor(i_up.astype(np.int32), q_up.astype(np.int32), sw)
+    return {
+        "lts_starts": lts_starts,
+        "lts": lts_frames(i, q, lts_starts),
+        "csi_lts_starts": csi_starts,
+        "csi": csi,
+    }
+
+
+def write_shard(path, seed, num_packets, ranges=DEFAULT_RANGES, sw=4):
+    """
+    Build a shard and write it to path (.dat) with its .npz sidecar
+    """
+    i, q, truth = build_shard(seed, num_packets, ranges)
+    path = Path(path)
+    np.stack((i, q), axis=1).tofile(path)
+    expected = expected_outputs(i, q, sw)
+    np.savez(
+        path.with_suffix(".npz"),
+        sw=sw,
+        seed=seed,
+        model_version=MODEL_VERSION,
+        **{f"truth_{k}": v for k, v in truth.items()},
+        **expected,
+    )
+    return path
+
+
+def found_packets(truth_lts, found, tolerance=2):
+    """
+    Which packets have an LTS found within `tolerance` samples of the true
+    position, and which of the found LTSs match no packet
+    """
+    hits = np.abs(np.asarray(found)[:, None] - np.asarray(truth_lts)[None, :])
+    hits = hits <= tolerance
+    return hits.any(axis=0), ~hits.any(axis=1)
+
+
+def detection_stats(sidecar, tolerance=2):
+    """
+    How many packets the model found at (within `tolerance` samples of) the
+    true LTS position, and how many it found that aren't there
+    """
+    truth = sidecar["truth_lts_start"]
+    detected, false = found_packets(truth, sidecar["lts_starts"], tolerance)
+    return {
+        "packets": len(truth),
+        "detected": int(np.count_nonzero(detected)),
+        "false": int(np.count_nonzero(false)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--packets", type=int, default=2000)
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sw", type=int, default=4)
+    parser.add_argument("--out", default=str(CORPUS_PATH))
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    # Independent random streams for each shard
+    seeds = [
+        int(s.generate_state(1)[0])
+        for s in np.random.SeedSequence(args.seed).spawn(args.shards)
+    ]
+    counts = np.diff(np.linspace(0, args.packets, args.shards + 1).astype(int))
+    paths = [out / f"shard_{n:04d}.dat" for n in range(args.shards)]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        list(
+            executor.map(
+                write_shard,
+                paths,
+                seeds,
+                counts,
+                [DEFAULT_RANGES] * args.shards,
+                [args.sw] * args.shards,
+            )
+        )
+    manifest = {
+        "seed": args.seed,
+        "sw": args.sw,
+        "model_version": MODEL_VERSION,
+        "ranges": DEFAULT_RANGES,
+        "shards": [{"path": p.name, "packets": int(c)} for p, c in zip(paths, counts)],
+    }
+    (out / "corpus.json").write_text(json.dumps(manifest, indent=2))
+    totals = {"packets": 0, "detected": 0, "false": 0}
+    for path in paths:
+        for k, v in detection_stats(np.load(path.with_suffix(".npz"))).items():
+            totals[k] += v
+    print(
+        f"{args.shards} shards, {totals['packets']} packets in "
+        f"{time.perf_counter() - start:.1f}s -> {out}\n"
+        f"Model detection rate: {totals['detected'] / totals['packets']:.3f}, "
+        f"{totals['false']} false detections"
+    )
@@ -5,6 +5,7 @@ from pathlib import Path
 import numpy as np
 import matplotlib.pyplot as plt
 
+import analytics
 from fft_helpers import generate_sample_data, plot_results
 
 # cocotb imports
@@ -115,6 +116,81 @@ async def reset(clk, reset_wire, num_cycles, active_val):
     reset_wire.value = 1 - active_val
 
 
+# The core's output is np.fft.fft scaled by 1/FFT_SCALE
+FFT_SCALE = 32
+
+
+def benchmark_blocks(rng, num_blocks):
+    """
+    Random (complex Gaussian) and tone blocks at input levels from -60 to
+    0 dBFS. Returns the (num_blocks, 64) inputs, their levels and which are
+    tones.
+    """
+    levels = rng.uniform(-60, 0, num_blocks)
+    amplitude = (2**15 - 1) * 10 ** (levels / 20)
+    tone = rng.uniform(size=num_blocks) < 0.5
+    n = np.arange(64)
+    freq = rng.uniform(0, 64, num_blocks)
+    phase = rng.uniform(0, 2 * np.pi, num_blocks)
+    tones = amplitude[:, None] * np.exp(
+        1j * (2 * np.pi * freq[:, None] * n / 64 + phase[:, None])
+    )
+    noise = (amplitude[:, None] / np.sqrt(2)) * (
+        rng.standard_normal((num_blocks, 64))
+        + 1j * rng.standard_normal((num_blocks, 64))
+    )
+    x = np.where(tone[:, None], tones, noise)
+    re = np.clip(np.round(x.real), -(2**15), 2**15 - 1)
+    im = np.clip(np.round(x.imag), -(2**15), 2**15 - 1)
+    return re + 1j * im, levels, tone
+
+
+def fft_accuracy(x, y, levels, headroom_db=-6):
+    """
+    Compare block_fft outputs y with np.fft.fft of the inputs x. Returns the
+    per-bin RMS error in output LSBs and the SQNR of every block, and which
+    blocks are at or below headroom_db; above it a tone can overflow the
+    output, so the per-bin error only covers the blocks below.
+    """
+    ref = np.fft.fft(x, axis=1) / FFT_SCALE
+    err = np.abs(y - ref) ** 2
+    safe = levels <= headroom_db
+    per_bin = np.sqrt(err[safe].mean(axis=0)) if safe.any() else np.full(64, np.nan)
+    return per_bin, analytics.sqnr(y, ref), safe
+
+
+def accuracy_report(per_bin, sqnr, safe, levels, tone, blocks_per_us):
+    """
+    Per-bin error, median SQNR by input level (of the blocks within the
+    headroom, with the ones above it apart) and throughput as text
+    """
+
+    def medians(blocks):
+        values = [sqnr[blocks & kind] for kind in (tone, ~tone)]
+        return " ".join(f"{np.median(v) if len(v) else np.nan:7.1f}" for v in values)
+
+    lines = ["RMS error per bin (output LSBs):"]
+    for row in range(0, 64, 16):
+        lines.append(
+            f"  {row:2d}-{row + 15:2d} "
+            + " ".join(f"{e:5.2f}" for e in per_bin[row : row + 16])
+        )
+    lines.append("Median SQNR (dB) by input level:")
+    lines.append(f"  {'dBFS':>11} {'tone':>7} {'noise':>7}")
+    edges = np.arange(-60, 1, 6)
+    for low, high in zip(edges[:-1], edges[1:]):
+        bucket = (levels >= low) & (levels < high) & safe
+        if bucket.any():
+            lines.append(f"  {low:4d} to {high:3d} " + medians(bucket))
+    if (~safe).any():
+        lines.append(
+            f"  {'above':>11} {medians(~safe)}"
+            f"  ({np.sum(~safe)} blocks above the headroom, tones can overflow)"
+        )
+    lines.append(f"Throughput: {blocks_per_us:.3f} blocks per simulated us")
+    return "\n".join(lines)
+
+
 # @cocotb.test()
 async def test_lot_of_data(dut):
     """
@@ -188,6 +264,54 @@ async def test_with_lts(dut):
     plt.show()
 
 
+@cocotb.test(skip=os.getenv("FFT_BENCH_BLOCKS") is None)
+async def block_fft_benchmark(dut):
+    """
+    Streams FFT_BENCH_BLOCKS random and tone blocks back to back with
+    fft_axis_tready high on FFT_BENCH_READY (default 0.5) of the cycles,
+    checks them bit-exactly against the model and reports their accuracy
+    against np.fft.fft and the throughput.
+
+    axis_fft starts a frame at o_sync and the core's bitreverse stage puts
+    the bins in natural order, so frames are split on tlast.
+    """
+    import golden_cache  # noqa: F401 (puts model/ on the path)
+    from csi_model import fftmain
+    from cocotb.utils import get_sim_time
+
+    num_blocks = int(os.environ["FFT_BENCH_BLOCKS"])
+    duty = float(os.getenv("FFT_BENCH_READY", "0.5"))
+    rng = np.random.default_rng(int(os.getenv("FFT_BENCH_SEED", "0")))
+    x, levels, tone = benchmark_blocks(rng, num_blocks)
+    outm = AXISMonitor(dut, "fft", dut.clk_in)
+    ind = AXISDriver(dut, "sample", dut.clk_in)
+    # Setup the DUT
+    cocotb.start_soon(Clock(dut.clk_in, 10, units="ns").start())
+    await reset(dut.clk_in, dut.rst_in, 2, 1)
+    await set_ready(dut, 1)
+    # Stream every block in while applying random back pressure
+    start = get_sim_time("ns")
+    samples = np.stack((x.real, x.imag), axis=-1).reshape(-1, 2).astype(np.int64)
+    ind.append({"type": "burst", "contents": {"data": samples}})
+    cycles = 0
+    limit = 1000 + int(num_blocks * 64 * 4 / duty)
+    while outm.transactions < num_blocks and cycles < limit:
+        await set_ready(dut, int(rng.uniform() < duty))
+        cycles += 1
+    elapsed_us = (get_sim_time("ns") - start) / 1000
+    await set_ready(dut, 1)
+    # Check the frames
+    assert outm.transactions == num_blocks, "Received the wrong number of blocks!"
+    frames = outm.data[:num_blocks]
+    assert all(len(f) == 64 for f in frames), "A block wasn't 64 bins long!"
+    y = np.array(frames)[..., 0] + 1j * np.array(frames)[..., 1]
+    assert (y == fftmain(x)).all(), "The FFT differs from the model!"
+    per_bin, sqnr, safe = fft_accuracy(x, y, levels)
+    dut._log.info(
+        accuracy_report(per_bin, sqnr, safe, levels, tone, num_blocks / elapsed_us)
+    )
+
+
 def block_fft_runner():
     """Simulate the downsampler using the Python runner."""
     sim = os.getenv("SIM", "icarus")
@@ -213,6 +337,8 @@ def block_fft_runner():
     parameters = {}
     sys.path.append(str(proj_path / "sim"))
     runner = get_runner(sim)
+    # The benchmark is too long to dump waves for
+    waves = os.getenv("FFT_BENCH_BLOCKS") is None
     runner.build(
         sources=sources,
         hdl_toplevel="block_fft",
@@ -220,14 +346,14 @@ def block_fft_runner():
         build_args=build_test_args,
         parameters=parameters,
         timescale=("1ns", "1ps"),
-        waves=True,
+        waves=waves,
     )
     run_test_args = []
     runner.test(
         hdl_toplevel="block_fft",
         test_module="test_block_fft",
         test_args=run_test_args,
-        waves=True,
+        waves=waves,
     )
 
 
@@ -1,4 +1,5 @@
 # General imports
+import json
 import os
 import sys
 from pathlib import Path
@@ -14,6 +15,7 @@ from cocotb.runner import get_runner
 from cocotb.clock import Clock
 from cocotb_bus.drivers import BusDriver
 from cocotb_bus.monitors import BusMonitor
+import golden_cache
 from test_utils import upsample_data, DESIRED_SAMPLE_RATE, DATA_SAMPLE_RATE
 
 
@@ -111,6 +113,60 @@ class AXISDriver(BusDriver):
         self.bus.axis_tvalid.value = 0
 
 
+class ADCSource:
+    """
+    Drives signal_axis like the ADC does: a sample is presented on roughly
+    `duty` of the cycles and is lost if tready is low, since the ADC can't
+    wait for the DUT. The samples that got in and the cycles they got in on
+    (counted from the first cycle of send) are kept for the model.
+    """
+
+    def __init__(self, dut, clk, duty=1.0, seed=None):
+        self.dut = dut
+        self.clock = clk
+        self.duty = duty
+        self.rng = np.random.default_rng(seed)
+        self.offered = 0
+        self.lost = 0
+        self.cycles = 0
+        self.accepted = []
+        self.accepted_cycles = []
+        dut.signal_axis_tdata.value = 0
+        dut.signal_axis_tvalid.value = 0
+
+    async def send(self, i, q):
+        for n, (sample_i, sample_q) in enumerate(zip(i, q)):
+            # Sample clock ticks land on ~duty of the cycles
+            while True:
+                await FallingEdge(self.clock)
+                self.cycles += 1
+                if self.rng.uniform() < self.duty:
+                    break
+                self.dut.signal_axis_tvalid.value = 0
+            self.dut.signal_axis_tdata.value = int(
+                (np.int32(sample_q) << 16) | (np.int32(sample_i) & 0xFFFF)
+            )
+            self.dut.signal_axis_tvalid.value = 1
+            await ReadOnly()
+            self.offered += 1
+            if self.dut.signal_axis_tready.value:
+                self.accepted.append(n)
+                self.accepted_cycles.append(self.cycles - 1)
+            else:
+                self.lost += 1
+        await FallingEdge(self.clock)
+        self.dut.signal_axis_tvalid.value = 0
+
+
+async def random_ready(dut, duty, seed=None):
+    """
+    Hold csi_axis_tready high on ~duty of the cycles
+    """
+    rng = np.random.default_rng(seed)
+    while True:
+        await set_ready(dut, int(rng.uniform() < duty))
+
+
 async def set_ready(dut, ready_val):
     await FallingEdge(dut.clk_in)
     dut.csi_axis_tready.value = ready_val
@@ -122,6 +178,19 @@ async def reset(clk, reset_wire, num_cycles, active_val):
     reset_wire.value = 1 - active_val
 
 
+def start_wave_dump(dut, packet_offsets=()):
+    """
+    Dump waves around the WAVE_TRIGGERS events (see wave_dump.py), with
+    packets starting packet_offsets cycles from now
+    """
+    from wave_dump import WaveDump
+
+    dump = WaveDump(10)
+    dump.from_env(dut, dump.now() + np.asarray(packet_offsets, dtype=np.int64))
+    cocotb.start_soon(dump.run())
+    return dump
+
+
 # @cocotb.test()
 # async def partial_filter_and_downsample_test(dut):
 #     """
@@ -201,11 +270,15 @@ async def reset(clk, reset_wire, num_cycles, active_val):
 #     # Check that we sent and received the correct amount of data
 #     assert inm.transactions == len(i), "Sent the wrong number of samples!"
 #     assert outm.transactions == 128 * 19, "Received the wrong number of samples!"
-#     # Save the LTS data
+#     # Check the LTS data
+#     expected_lts_arr = golden_cache.lts_arr_from_csi_extractor(sw=4)
 #     lts_arr = np.array(
-#         [np.array(outm.data_i[i]) + 1j * np.array(outm.data_q[i]) for i in range(30)]
+#         [
+#             np.array(outm.data_i[i]) + 1j * np.array(outm.data_q[i])
+#             for i in range(len(expected_lts_arr))
+#         ]
 #     )
-#     np.save(os.path.join(cwd, "lts_arr_from_csi_extractor.npy"), lts_arr)
+#     assert (lts_arr == expected_lts_arr).all(), "LTS data is incorrect!"
 #     # Check (visually) that it worked
 #     for i in range(19):
 #         lts1 = np.array(outm.data_i[2 * i]) + 1j * np.array(outm.data_q[2 * i])
@@ -240,6 +313,7 @@ async def partial_lts_extractor_test(dut):
     q = upsample_data(q, DATA_SAMPLE_RATE, DESIRED_SAMPLE_RATE)
     # Drive the DUT
     await ClockCycles(dut.clk_in, 1)
+    start_wave_dump(dut)
     ind.append({"type": "burst", "contents": {"data": zip(q, i)}})
     ready_cycles = 0
 
@@ -297,11 +371,15 @@ async def partial_lts_extractor_test(dut):
         plt.legend(["Real", "Imaginary"])
         plt.show()
     # assert outm.transactions == 128 * 19, "Received the wrong number of samples!"
-    # # Save the LTS data
+    # # Check the LTS data
+    # expected_lts_arr = golden_cache.lts_arr_from_csi_extractor(sw=4)
     # lts_arr = np.array(
-    #     [np.array(outm.data_i[i]) + 1j * np.array(outm.data_q[i]) for i in range(30)]
+    #     [
+    #         np.array(outm.data_i[i]) + 1j * np.array(outm.data_q[i])
+    #         for i in range(len(expected_lts_arr))
+    #     ]
     # )
-    # np.save(os.path.join(cwd, "lts_arr_from_csi_extractor.npy"), lts_arr)
+    # assert (lts_arr == expected_lts_arr).all(), "LTS data is incorrect!"
     # # Check (visually) that it worked
     # for i in range(19):
     #     lts1 = np.array(outm.data_i[2 * i]) + 1j * np.array(outm.data_q[2 * i])
@@ -312,12 +390,326 @@ async def partial_lts_extractor_test(dut):
     #     plt.show()
 
 
-def sync_short_runner():
-    """Simulate the downsampler using the Python runner."""
-    sim = os.getenv("SIM", "icarus")
-    proj_path = Path(__file__).resolve().parent.parent
-    sys.path.append(str(proj_path / "sim" / "model"))
-    sources = [
+@cocotb.test(skip=os.getenv("CORPUS_SHARD") is None)
+async def csi_extractor_corpus_shard_test(dut):
+    """
+    Runs one shard built by packet_corpus.py (given by CORPUS_SHARD)
+    """
+    inm = AXISMonitor(dut, "signal", dut.clk_in)
+    outm = AXISMonitor(dut, "csi", dut.clk_in)
+    ind = AXISDriver(dut, "signal", dut.clk_in, False)
+    shard_path = Path(os.environ["CORPUS_SHARD"])
+    expected = np.load(shard_path.with_suffix(".npz"))
+    # Setup the DUT
+    cocotb.start_soon(Clock(dut.clk_in, 10, units="ns").start())
+    dut.sw_in.value = int(expected["sw"])
+    await set_ready(dut, 1)
+    await reset(dut.clk_in, dut.rst_in, 2, 1)
+    # Feed in the shard, extended for the filter and downsample
+    signal = np.fromfile(shard_path, dtype=np.int16)
+    i = upsample_data(signal[::2], DATA_SAMPLE_RATE, DESIRED_SAMPLE_RATE)
+    q = upsample_data(signal[1::2], DATA_SAMPLE_RATE, DESIRED_SAMPLE_RATE)
+    await ClockCycles(dut.clk_in, 1)
+    from latency_probe import upsampled_index
+
+    packet_starts = expected["truth_packet_start"]
+    packet_offsets = upsampled_index(packet_starts, len(signal) // 2, len(i))
+    dump = start_wave_dump(dut, packet_offsets)
+    first = dump.now()
+    ind.append({"type": "burst", "contents": {"data": zip(q, i)}})
+    await ClockCycles(dut.clk_in, len(i) * 3 // 2)
+    # Check that the data is what we expect
+    expected_csi = expected["csi"]
+    assert inm.transactions == len(i), "Sent the wrong number of samples!"
+    assert (
+        outm.transactions == 52 * len(expected_csi)
+    ), "Received the wrong number of samples!"
+    # The CSI is {re, im}, so the monitor's "q" is the real part
+    csi = np.array(
+        [
+            np.array(outm.data_q[i]) + 1j * np.array(outm.data_i[i])
+            for i in range(len(expected_csi))
+        ]
+    )
+    for k in np.flatnonzero((csi != expected_csi).any(axis=1)):
+        dump.mismatch(first + int(expected["csi_lts_starts"][k]), f"CSI {k}")
+    assert (csi == expected_csi).all(), "CSI is incorrect!"
+
+
+@cocotb.test(skip=os.getenv("STIMULUS") is None)
+async def csi_extractor_stimulus_test(dut):
+    """
+    Replays a minimize.py stimulus (given by STIMULUS), checking the CSI
+    against the model and writing what went wrong to STIMULUS_OUT
+    """
+    from minimize import load_stimulus, replay_ready
+    from packet_corpus import expected_outputs
+
+    stimulus = load_stimulus(os.environ["STIMULUS"])
+    outm = AXISMonitor(dut, "csi", dut.clk_in)
+    ind = AXISDriver(dut, "signal", dut.clk_in, False)
+    cocotb.start_soon(Clock(dut.clk_in, 10, units="ns").start())
+    dut.sw_in.value = stimulus["sw"]
+    await set_ready(dut, 1)
+    await reset(dut.clk_in, dut.rst_in, 2, 1)
+    i = upsample_data(stimulus["i"], DATA_SAMPLE_RATE, DESIRED_SAMPLE_RATE)
+    q = upsample_data(stimulus["q"], DATA_SAMPLE_RATE, DESIRED_SAMPLE_RATE)
+    await ClockCycles(dut.clk_in, 1)
+    dump = start_wave_dump(dut)
+    first = dump.now()
+    low_runs = stimulus["low_runs"]
+    cocotb.start_soon(replay_ready(dut.clk_in, dut.csi_axis_tready, low_runs))
+    ind.append({"type": "burst", "contents": {"data": zip(q, i)}})
+    last_low = int(low_runs[-1, 1]) if len(low_runs) else 0
+    await ClockCycles(dut.clk_in, max(len(i) * 3 // 2, last_low + len(i) // 2))
+    # Check the CSI against the model
+    expected = expected_outputs(stimulus["i"], stimulus["q"], stimulus["sw"])
+    expected_csi = expected["csi"]
+    failure = None
+    if outm.transactions != 52 * len(expected_csi):
+        failure = "Received the wrong number of samples!"
+    elif len(expected_csi):
+        csi = np.array(
+            [
+                np.array(outm.data_q[i]) + 1j * np.array(outm.data_i[i])
+                for i in range(len(expected_csi))
+            ]
+        )
+        if not (csi == expected_csi).all():
+            failure = "CSI is incorrect!"
+        for k in np.flatnonzero((csi != expected_csi).any(axis=1)):
+            dump.mismatch(first + int(expected["csi_lts_starts"][k]), f"CSI {k}")
+    if os.getenv("STIMULUS_OUT"):
+        out = Path(os.environ["STIMULUS_OUT"])
+        out.write_text(json.dumps({"failure": failure}))
+    assert failure is None, failure
+
+
+@cocotb.test(skip=os.getenv("LATENCY_PACKETS") is None)
+async def csi_extractor_latency_test(dut):
+    """
+    Measures how many cycles each of LATENCY_PACKETS packets spends in each
+    stage, from its first STF sample going in to the last CSI word of it
+    coming out. Budgets (in cycles per stage, or "total") can be given as JSON
+    in LATENCY_BUDGETS, LATENCY_PLOT saves the histograms to that file and
+    LATENCY_OUT the latencies, as JSON for perf_model.calibrate().
+    """
+    from latency_probe import LatencyProbe, upsampled_index
+    from packet_corpus import (
+        DEFAULT_RANGES,
+        build_shard,
+        expected_outputs,
+        found_packets,
+    )
+
+    # Levels the model detects nearly every packet at
+    ranges = dict(
+        DEFAULT_RANGES,
+        gap=(1000, 2000),
+        rms=(2000.0, 4000.0),
+        snr_db=(30.0, 40.0),
+        data_symbols=(4, 8),
+        recorded=0.0,
+    )
+    num_packets = int(os.environ["LATENCY_PACKETS"])
+    i, q, truth = build_shard(seed=0, num_packets=num_packets, ranges=ranges)
+    # Only follow the packets the model says come out
+    expected = expected_outputs(i, q)
+    detected, _ = found_packets(truth["lts_start"], expected["csi_lts_starts"])
+    budgets = json.loads(os.getenv("LATENCY_BUDGETS", "{}"))
+    probe = LatencyProbe(dut, dut.clk_in)
+    ind = AXISDriver(dut, "signal", dut.clk_in, False)
+    # Setup the DUT
+    cocotb.start_soon(Clock(dut.clk_in, 10, units="ns").start())
+    dut.sw_in.value = 4
+    await set_ready(dut, 1)
+    await reset(dut.clk_in, dut.rst_in, 2, 1)
+    cocotb.start_soon(probe.run())
+    # Feed in the packets, extended for the filter and downsample
+    i_up = upsample_data(i, DATA_SAMPLE_RATE, DESIRED_SAMPLE_RATE)
+    q_up = upsample_data(q, DATA_SAMPLE_RATE, DESIRED_SAMPLE_RATE)
+    await ClockCycles(dut.clk_in, 1)
+    ind.append({"type": "burst", "contents": {"data": zip(q_up, i_up)}})
+    await ClockCycles(dut.clk_in, len(i_up) * 3 // 2)
+    # Follow every packet through the stages
+    starts = upsampled_index(truth["packet_start"][detected], len(i), len(i_up))
+    times = probe.breakdown(starts)
+    latencies = LatencyProbe.latencies(times)
+    dut._log.info(
+        f"Latency in cycles ({len(starts)} of {num_packets} packets detected):\n"
+        + LatencyProbe.report(latencies, 10)
+    )
+    if os.getenv("LATENCY_PLOT"):
+        histograms = LatencyProbe.histograms(latencies)
+        fig, axes = plt.subplots(len(histograms), 1, figsize=(6, 2 * len(histograms)))
+        for ax, (stage, (counts, edges)) in zip(axes, histograms.items()):
+            ax.stairs(counts, edges)
+            ax.set_title(stage)
+        fig.tight_layout()
+        fig.savefig(os.environ["LATENCY_PLOT"])
+    if os.getenv("LATENCY_OUT"):
+        # One 122.88 MSPS sample goes in every cycle
+        with open(os.environ["LATENCY_OUT"], "w") as f:
+            json.dump(
+                {
+                    "samples_per_cycle": 1.0,
+                    "latencies": {k: v.tolist() for k, v in latencies.items()},
+                },
+                f,
+            )
+    frames = len(probe.lasts["csi"])
+    assert frames == len(expected["csi"]), "Received the wrong number of CSI frames!"
+    assert len(latencies["total"]) == len(starts), "Not every packet came out!"
+    LatencyProbe.check_budgets(latencies, budgets)
+
+
+# csi_axis_tready duty cycle and gap between packets (20 MSPS samples) for
+# csi_extractor_buffer_test
+STRESS_PROFILES = {
+    "nominal": {"ready_duty": 1.0, "gap": (1000, 2000)},
+    "slow_host": {"ready_duty": 0.25, "gap": (1000, 2000)},
+    "back_to_back": {"ready_duty": 0.5, "gap": (20, 100)},
+}
+
+
+@cocotb.test(skip=os.getenv("BUFFER_PROFILES") is None)
+async def csi_extractor_buffer_test(dut):
+    """
+    Reports the occupancy of every bram_fifo, sync_long's input buffer and the
+    equalizer's FFT cache under the STRESS_PROFILES named in BUFFER_PROFILES
+    (comma-separated, or "all"), and checks that no bram_fifo lost a beat
+    """
+    from occupancy_probe import (
+        BufferProbes,
+        bram_fifo,
+        equalizer_cache,
+        find_bram_fifos,
+        sync_long,
+    )
+    from packet_corpus import DEFAULT_RANGES, build_shard, expected_outputs
+
+    names = os.environ["BUFFER_PROFILES"]
+    names = list(STRESS_PROFILES) if names == "all" else names.split(",")
+    cocotb.start_soon(Clock(dut.clk_in, 10, units="ns").start())
+    dut.sw_in.value = 4
+    ind = AXISDriver(dut, "signal", dut.clk_in, False)
+    fifos = find_bram_fifos(dut)
+    assert len(fifos) == 3, f"Expected 3 bram_fifos, found {len(fifos)}"
+    for name in names:
+        profile = STRESS_PROFILES[name]
+        seed = list(STRESS_PROFILES).index(name)
+        # Levels the model detects every packet at, so the FFT and equalizer
+        # see a packet's worth of traffic for each one
+        ranges = dict(
+            DEFAULT_RANGES,
+            gap=profile["gap"],
+            rms=(4000.0, 8000.0),
+            snr_db=(20.0, 40.0),
+            recorded=0.0,
+        )
+        i, q, _ = build_shard(seed, num_packets=10, ranges=ranges)
+        detected = len(expected_outputs(i, q)["csi"])
+        i = upsample_data(i, DATA_SAMPLE_RATE, DESIRED_SAMPLE_RATE)
+        q = upsample_data(q, DATA_SAMPLE_RATE, DESIRED_SAMPLE_RATE)
+        await set_ready(dut, 1)
+        await reset(dut.clk_in, dut.rst_in, 2, 1)
+        probes = BufferProbes(dut.clk_in)
+        for inst in fifos:
+            probes.add(bram_fifo(inst))
+        probes.add(sync_long(dut.lts_extractor_inst.sync_long_inst))
+        probes.add(equalizer_cache(dut.equalizer_inst))
+        probe_task = cocotb.start_soon(probes.run())
+        ready_task = cocotb.start_soon(random_ready(dut, profile["ready_duty"], seed))
+        await ClockCycles(dut.clk_in, 1)
+        ind.append({"type": "burst", "contents": {"data": zip(q, i)}})
+        await ClockCycles(dut.clk_in, len(i) * 3 // 2)
+        probe_task.kill()
+        ready_task.kill()
+        dut._log.info(
+            f"Buffer occupancy, {name} ({probes.cycles} cycles, model detects "
+            f"{detected} of 10 packets):\n" + probes.report()
+        )
+        stats = probes.summary()
+        for inst in fifos:
+            overflows = stats[bram_fifo(inst).name]["overflows"]
+            assert not overflows, f"{inst._path} lost {overflows} beats ({name})"
+
+
+@cocotb.test(skip=os.getenv("THROUGHPUT_POINT") is None)
+async def csi_extractor_throughput_test(dut):
+    """
+    Runs one point of throughput_sweep.py (JSON in THROUGHPUT_POINT) and
+    writes what happened to THROUGHPUT_OUT
+    """
+    from csi_model import csi_extractor
+    from packet_corpus import DEFAULT_RANGES, build_shard
+
+    point = json.loads(os.environ["THROUGHPUT_POINT"])
+    # Levels the model detects every packet at, so that packets lost to
+    # backpressure show up against the ones injected
+    ranges = dict(
+        DEFAULT_RANGES,
+        gap=(point["gap"] // 2, point["gap"] * 3 // 2 + 1),
+        rms=(4000.0, 8000.0),
+        snr_db=(30.0, 40.0),
+        recorded=0.0,
+    )
+    i, q, _ = build_shard(point["seed"], point["packets"], ranges)
+    outm = AXISMonitor(dut, "csi", dut.clk_in)
+    source = ADCSource(dut, dut.clk_in, point["valid_duty"], point["seed"])
+    # Setup the DUT
+    cocotb.start_soon(Clock(dut.clk_in, 10, units="ns").start())
+    dut.sw_in.value = 4
+    await set_ready(dut, 1)
+    await reset(dut.clk_in, dut.rst_in, 2, 1)
+    cocotb.start_soon(random_ready(dut, point["ready_duty"], point["seed"]))
+    # Feed in the packets, extended for the filter and downsample
+    i_up = upsample_data(i, DATA_SAMPLE_RATE, DESIRED_SAMPLE_RATE)
+    q_up = upsample_data(q, DATA_SAMPLE_RATE, DESIRED_SAMPLE_RATE)
+    await ClockCycles(dut.clk_in, 1)
+    await source.send(i_up, q_up)
+    # Let the last packet drain through at the output duty cycle
+    drain = int(4000 / max(point["ready_duty"], 0.01))
+    await ClockCycles(dut.clk_in, drain)
+    # What the model makes of the samples that got in, on the cycles they did
+    accepted = np.array(source.accepted, dtype=np.int64)
+    expected_csi, _ = csi_extractor(
+        i_up[accepted].astype(np.int32),
+        q_up[accepted].astype(np.int32),
+        cycles=source.accepted_cycles,
+    )
+    # The CSI is {re, im}, so the monitor's "q" is the real part
+    frames = [
+        np.array(outm.data_q[n]) + 1j * np.array(outm.data_i[n])
+        for n in range(len(outm.data_q))
+        if len(outm.data_q[n]) == 52
+    ]
+    # Frames that came out exactly as the model expects
+    correct = sum(
+        any((frame == expected).all() for expected in expected_csi) for frame in frames
+    )
+    result = dict(
+        point,
+        cycles=source.cycles + drain,
+        samples=source.offered,
+        lost_samples=source.lost,
+        input_rate=source.offered / source.cycles,
+        expected_packets=len(expected_csi),
+        received_packets=len(frames),
+        dropped_packets=point["packets"] - correct,
+        corrupted_packets=len(frames) - correct,
+        output_beats_per_cycle=outm.transactions / (source.cycles + drain),
+    )
+    Path(os.environ.get("THROUGHPUT_OUT", "throughput.json")).write_text(
+        json.dumps(result)
+    )
+
+
+def hdl_sources(proj_path):
+    """
+    The RTL that makes up csi_extractor_sv
+    """
+    return [
         proj_path / "WaveSense/ip_repo/csi_extractor_1_0/hdl/csi_extractor.sv",
         proj_path / "WaveSense/ip_repo/csi_extractor_1_0/hdl/fir_17.sv",
         proj_path / "WaveSense/ip_repo/csi_extractor_1_0/hdl/downsample.sv",
@@ -349,9 +741,27 @@ def sync_short_runner():
         proj_path / "WaveSense/ip_repo/csi_extractor_1_0/src/fft-core/qtrstage.v",
         proj_path / "WaveSense/ip_repo/csi_extractor_1_0/hdl/equalizer.sv",
     ]
+
+
+def sync_short_runner():
+    """Simulate the downsampler using the Python runner."""
+    sim = os.getenv("SIM", "icarus")
+    proj_path = Path(__file__).resolve().parent.parent
+    sys.path.append(str(proj_path / "sim" / "model"))
+    sources = hdl_sources(proj_path)
     build_test_args = ["-Wall"]  # ,"COCOTB_RESOLVE_X=ZEROS"]
     parameters = {}
     sys.path.append(str(proj_path / "sim"))
+    from wave_dump import dump_build_args, dump_plusargs, dump_source
+
+    # Dumping everything is slow, so by default only the WAVE_TRIGGERS
+    # windows are dumped; WAVES=full dumps the whole run
+    waves = os.getenv("WAVES") == "full"
+    plusargs = []
+    if not waves:
+        sources.append(dump_source("sim_build", "csi_extractor_sv", sim))
+        build_test_args += dump_build_args(sim)
+        plusargs = dump_plusargs(sim)
     runner = get_runner(sim)
     runner.build(
         sources=sources,
@@ -360,14 +770,19 @@ def sync_short_runner():
         build_args=build_test_args,
         parameters=parameters,
         timescale=("1ns", "1ps"),
-        waves=True,
+        waves=waves,
     )
     run_test_args = []
+    # The simulator runs in sim_build, so take output paths relative to here
+    for name in ("LATENCY_OUT", "LATENCY_PLOT"):
+        if os.getenv(name):
+            os.environ[name] = str(Path(os.environ[name]).resolve())
     runner.test(
         hdl_toplevel="csi_extractor_sv",
         test_module="test_csi_extractor",
         test_args=run_test_args,
-        waves=True,
+        plusargs=plusargs,
+        waves=waves,
     )
 
 
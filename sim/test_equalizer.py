@@ -13,6 +13,7 @@ from cocotb.runner import get_runner
 from cocotb.clock import Clock
 from cocotb_bus.drivers import BusDriver
 from cocotb_bus.monitors import BusMonitor
+import golden_cache
 
 
 class AXISMonitor(BusMonitor):
@@ -155,7 +156,7 @@ async def test_sync_long_with_invalid(dut):
         + 1j * q[ref_lts_loc + 96 : ref_lts_loc + 160]
     )
     fft2 = np.fft.fft(lts2) / len(lts2) / 2 / np.pi
-    lts_ref = np.loadtxt(os.path.join(cwd, "lts.txt")).view(complex)
+    lts_ref = golden_cache.lts_ref()
     fft_ref = np.fft.fft(lts_ref)
     # Drive the DUT
     await ClockCycles(dut.clk_in, 1)
@@ -218,7 +219,7 @@ async def test_sync_long_no_invalid(dut):
         + 1j * q[ref_lts_loc + 96 : ref_lts_loc + 160]
     )
     fft2 = np.fft.fft(lts2) / len(lts2) / 2 / np.pi
-    lts_ref = np.loadtxt(os.path.join(cwd, "lts.txt")).view(complex)
+    lts_ref = golden_cache.lts_ref()
     fft_ref = np.fft.fft(lts_ref)
     # Drive the DUT
     await ClockCycles(dut.clk_in, 1)
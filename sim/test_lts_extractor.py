@@ -1,4 +1,5 @@
 # General imports
+import json
 import os
 import sys
 from pathlib import Path
@@ -13,6 +14,7 @@ from cocotb.runner import get_runner
 from cocotb.clock import Clock
 from cocotb_bus.drivers import BusDriver
 from cocotb_bus.monitors import BusMonitor
+import golden_cache
 
 
 class AXISMonitor(BusMonitor):
@@ -160,12 +162,14 @@ async def test_lts_extractor_with_invalid(dut):
     assert inm.transactions == len(i), "Sent the wrong number of samples!"
     assert outm.transactions == 128 * 19, "Received the wrong number of samples!"
     # Check (visually) that it worked
+    expected_lts_arr = golden_cache.lts_arr(sw=4)
     lts_arr = np.array(
-        [np.array(outm.data_i[i]) + 1j * np.array(outm.data_q[i]) for i in range(30)]
+        [
+            np.array(outm.data_i[i]) + 1j * np.array(outm.data_q[i])
+            for i in range(len(expected_lts_arr))
+        ]
     )
-    expected_lts_arr = np.load(os.path.join(cwd, "lts_arr.npy"))
     assert (lts_arr == expected_lts_arr).all(), "LTS data is incorrect!"
-    # np.save(os.path.join(cwd, "lts_arr.npy"), lts_arr)
     # for i in range(19):
     #     lts1 = np.array(outm.data_i[2 * i]) + 1j * np.array(outm.data_q[0])
     #     lts2 = np.array(outm.data_i[2 * i + 1]) + 1j * np.array(outm.data_q[1])
@@ -215,12 +219,14 @@ async def test_lts_extractor_no_invalid(dut):
     assert inm.transactions == len(i), "Sent the wrong number of samples!"
     assert outm.transactions == 128 * 19, "Received the wrong number of samples!"
     # Check (visually) that it worked
+    expected_lts_arr = golden_cache.lts_arr(sw=4)
     lts_arr = np.array(
-        [np.array(outm.data_i[i]) + 1j * np.array(outm.data_q[i]) for i in range(30)]
+        [
+            np.array(outm.data_i[i]) + 1j * np.array(outm.data_q[i])
+            for i in range(len(expected_lts_arr))
+        ]
     )
-    expected_lts_arr = np.load(os.path.join(cwd, "lts_arr.npy"))
     assert (lts_arr == expected_lts_arr).all(), "LTS data is incorrect!"
-    # np.save(os.path.join(cwd, "lts_arr.npy"), lts_arr)
     for i in range(19):
         lts1 = np.array(outm.data_i[2 * i]) + 1j * np.array(outm.data_q[2 * i])
         lts2 = np.array(outm.data_i[2 * i + 1]) + 1j * np.array(outm.data_q[2 * i + 1])
@@ -230,13 +236,92 @@ async def test_lts_extractor_no_invalid(dut):
         plt.show()
 
 
-def lts_extractor_runner():
-    """Simulate the LTS extractor using the Python runner."""
-    sim = os.getenv("SIM", "icarus")
-    proj_path = Path(__file__).resolve().parent.parent
-    hdl_path = proj_path / "WaveSense/ip_repo/csi_extractor_1_0/hdl"
-    sys.path.append(str(proj_path / "sim" / "model"))
-    sources = [
+@cocotb.test(skip=os.getenv("CORPUS_SHARD") is None)
+async def test_lts_extractor_corpus_shard(dut):
+    """
+    Runs one shard built by packet_corpus.py (given by CORPUS_SHARD)
+    """
+    inm = AXISMonitor(dut, "signal", dut.clk_in)
+    outm = AXISMonitor(dut, "lts", dut.clk_in)
+    ind = AXISDriver(dut, "signal", dut.clk_in, False)
+    shard_path = Path(os.environ["CORPUS_SHARD"])
+    expected = np.load(shard_path.with_suffix(".npz"))
+    # Setup the DUT
+    cocotb.start_soon(Clock(dut.clk_in, 10, units="ns").start())
+    dut.sw_in.value = int(expected["sw"])
+    await set_ready(dut, 1)
+    await reset(dut.clk_in, dut.rst_in, 2, 1)
+    # Feed in the shard
+    signal = np.fromfile(shard_path, dtype=np.int16)
+    i = signal[::2]
+    q = signal[1::2]
+    await ClockCycles(dut.clk_in, 1)
+    ind.append({"type": "burst", "contents": {"data": zip(q, i)}})
+    await ClockCycles(dut.clk_in, len(i) * 3 // 2)
+    # Check that the data is what we expect
+    expected_lts_arr = expected["lts"]
+    assert inm.transactions == len(i), "Sent the wrong number of samples!"
+    assert (
+        outm.transactions == 64 * len(expected_lts_arr)
+    ), "Received the wrong number of samples!"
+    lts_arr = np.array(
+        [
+            np.array(outm.data_i[i]) + 1j * np.array(outm.data_q[i])
+            for i in range(len(expected_lts_arr))
+        ]
+    )
+    assert (lts_arr == expected_lts_arr).all(), "LTS data is incorrect!"
+
+
+@cocotb.test(skip=os.getenv("STIMULUS") is None)
+async def lts_extractor_stimulus_test(dut):
+    """
+    Replays a minimize.py stimulus (given by STIMULUS), checking the LTS
+    against the model and writing what went wrong to STIMULUS_OUT
+    """
+    from minimize import load_stimulus, replay_ready
+    from packet_corpus import expected_outputs
+
+    stimulus = load_stimulus(os.environ["STIMULUS"])
+    outm = AXISMonitor(dut, "lts", dut.clk_in)
+    ind = AXISDriver(dut, "signal", dut.clk_in, False)
+    cocotb.start_soon(Clock(dut.clk_in, 10, units="ns").start())
+    dut.sw_in.value = stimulus["sw"]
+    await set_ready(dut, 1)
+    await reset(dut.clk_in, dut.rst_in, 2, 1)
+    i = stimulus["i"]
+    q = stimulus["q"]
+    await ClockCycles(dut.clk_in, 1)
+    low_runs = stimulus["low_runs"]
+    cocotb.start_soon(replay_ready(dut.clk_in, dut.lts_axis_tready, low_runs))
+    ind.append({"type": "burst", "contents": {"data": zip(q, i)}})
+    last_low = int(low_runs[-1, 1]) if len(low_runs) else 0
+    await ClockCycles(dut.clk_in, max(len(i) * 3 // 2, last_low + len(i) // 2))
+    # Check the LTS against the model
+    expected_lts_arr = expected_outputs(i, q, stimulus["sw"])["lts"]
+    failure = None
+    if outm.transactions != 64 * len(expected_lts_arr):
+        failure = "Received the wrong number of samples!"
+    elif len(expected_lts_arr):
+        lts_arr = np.array(
+            [
+                np.array(outm.data_i[i]) + 1j * np.array(outm.data_q[i])
+                for i in range(len(expected_lts_arr))
+            ]
+        )
+        if not (lts_arr == expected_lts_arr).all():
+            failure = "LTS data is incorrect!"
+    if os.getenv("STIMULUS_OUT"):
+        out = Path(os.environ["STIMULUS_OUT"])
+        out.write_text(json.dumps({"failure": failure}))
+    assert failure is None, failure
+
+
+def hdl_sources(hdl_path):
+    """
+    The RTL that makes up lts_extractor
+    """
+    return [
         hdl_path / "lts_extractor.sv",
         hdl_path / "power_trigger.sv",
         hdl_path / "sync_short.sv",
@@ -251,6 +336,15 @@ def lts_extractor_runner():
         hdl_path / "xilinx_true_dual_port_read_first_2_clock_ram.v",
         hdl_path / "bram_fifo.sv",
     ]
+
+
+def lts_extractor_runner():
+    """Simulate the LTS extractor using the Python runner."""
+    sim = os.getenv("SIM", "icarus")
+    proj_path = Path(__file__).resolve().parent.parent
+    hdl_path = proj_path / "WaveSense/ip_repo/csi_extractor_1_0/hdl"
+    sys.path.append(str(proj_path / "sim" / "model"))
+    sources = hdl_sources(hdl_path)
     build_test_args = ["-Wall"]  # ,"COCOTB_RESOLVE_X=ZEROS"]
     parameters = {}
     sys.path.append(str(proj_path / "sim"))
@@ -1,3 +1,7 @@
+import json
+import tempfile
+from pathlib import Path
+
 import numpy as np
 
 DATA_SAMPLE_RATE = 20e6
@@ -24,3 +28,30 @@ def upsample_data(data, original_rate, new_rate):
     resampled_data = np.interp(t_target, t_original, data)
 
     return resampled_data
+
+
+def run_in_project(sim, out_env, extra_env=None, test_dir=None, **test_args):
+    """
+    Run get_runner(sim).test(**test_args) in a temporary directory one level
+    below the project root, since under COCOTB_SIM fftstage reads its
+    coefficients from ../WaveSense. The test writes its results as JSON to
+    the path in the out_env variable; returns them, or None if the
+    simulation died first. extra_env can also be a function of the run
+    directory, for inputs written there, and test_dir moves the simulator's
+    working directory (where waves are written) elsewhere.
+    """
+    from cocotb.runner import get_runner
+
+    project = Path(__file__).resolve().parent.parent
+    with tempfile.TemporaryDirectory(dir=project) as run_dir:
+        run_dir = Path(run_dir)
+        env = extra_env(run_dir) if callable(extra_env) else dict(extra_env or {})
+        out = run_dir / "out.json"
+        get_runner(sim).test(
+            test_dir=test_dir or run_dir,
+            extra_env={**env, out_env: str(out)},
+            **test_args,
+        )
+        if not out.exists():
+            return None
+        return json.loads(out.read_text())
@@ -0,0 +1,144 @@
+"""
+Finds the input rates `csi_extractor_sv` can sustain without dropping
+`signal_axis_tready`.
+
+fir_17 ties its tready to the downstream tready, so any backpressure from
+sync_long / block_fft / the equalizer / the host reaches the ADC stream,
+which can't wait: every cycle tready is low while a sample is presented, that
+sample is lost. This sweeps
+
+    valid_duty   fraction of cycles with an input sample (1 = one per clock)
+    gap          mean gap between packets in 20 MSPS samples (packet density)
+    ready_duty   fraction of cycles csi_axis_tready is high
+
+running csi_extractor_throughput_test once per point (in parallel, against a
+single build), and records the lost input samples, packets dropped (of
+those injected) or corrupted (merged with a neighbour or damaged by lost
+samples, against the bit-accurate model fed the samples that got in on the
+cycles they got in on), and output beats per cycle. The results go to a CSV
+table, followed by the highest input rate with no lost samples for each
+packet density and output duty cycle.
+
+Usage: python throughput_sweep.py [--workers N] [--out table.csv]
+                                  [--param valid_duty=1,0.5 ...]
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from cocotb.runner import get_runner
+
+from fixed_point_sweep import grid, write_table
+from test_csi_extractor import hdl_sources
+from test_utils import run_in_project
+
+SIM_PATH = Path(__file__).resolve().parent
+BUILD_DIR = SIM_PATH / "sim_build" / "throughput"
+
+DEFAULT_POINT = {
+    "valid_duty": 1.0,
+    "gap": 1000,
+    "ready_duty": 1.0,
+    "packets": 8,
+    "seed": 0,
+}
+
+SWEEP = {
+    "valid_duty": [1.0, 0.75, 0.5, 0.25],
+    "gap": [100, 500, 2000],
+    "ready_duty": [1.0, 0.5, 0.1],
+}
+
+
+def build(sim="icarus"):
+    """
+    Compile the DUT once for every point
+    """
+    runner = get_runner(sim)
+    runner.build(
+        sources=hdl_sources(SIM_PATH.parent),
+        hdl_toplevel="csi_extractor_sv",
+        build_args=["-Wall"],
+        build_dir=BUILD_DIR,
+        timescale=("1ns", "1ps"),
+    )
+
+
+def run_point(point, sim="icarus"):
+    """
+    Simulate one point in its own directory and return its results
+    """
+    point = {**DEFAULT_POINT, **point}
+    result = run_in_project(
+        sim,
+        "THROUGHPUT_OUT",
+        {"THROUGHPUT_POINT": json.dumps(point)},
+        hdl_toplevel="csi_extractor_sv",
+        test_module="test_csi_extractor",
+        testcase="csi_extractor_throughput_test",
+        build_dir=BUILD_DIR,
+    )
+    if result is None:
+        raise RuntimeError(f"The simulation of {point} didn't finish")
+    return result
+
+
+def sweep(points, workers=None, sim="icarus"):
+    """
+    Run every point over a process pool
+    """
+    build(sim)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_point, points, [sim] * len(points)))
+
+
+def envelope(rows):
+    """
+    The highest input rate with no lost samples or damaged packets for each
+    (gap, ready_duty), None if even the lowest rate tried loses samples
+    """
+    safe = {}
+    for row in rows:
+        key = (row["gap"], row["ready_duty"])
+        safe.setdefault(key, None)
+        clean = not (
+            row["lost_samples"] or row["dropped_packets"] or row["corrupted_packets"]
+        )
+        if clean and row["input_rate"] > (safe[key] or 0):
+            safe[key] = row["input_rate"]
+    return safe
+
+
+def parse_param(arg):
+    """
+    Parse a --param name=v1,v2,... argument
+    """
+    name, values = arg.split("=")
+    if name not in DEFAULT_POINT:
+        raise argparse.ArgumentTypeError(f"Unknown parameter {name}")
+    kind = type(DEFAULT_POINT[name])
+    return name, [kind(v) for v in values.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--sim", default=os.getenv("SIM", "icarus"))
+    parser.add_argument("--out", default=str(SIM_PATH / "throughput_sweep.csv"))
+    parser.add_argument("--param", type=parse_param, action="append", default=[])
+    args = parser.parse_args()
+    points = grid({**SWEEP, **dict(args.param)})
+    start = time.perf_counter()
+    rows = sweep(points, args.workers, args.sim)
+    write_table(rows, args.out)
+    print(
+        f"{len(rows)} points in {time.perf_counter() - start:.1f}s "
+        f"with {args.workers} workers -> {args.out}"
+    )
+    for (gap, ready_duty), rate in sorted(envelope(rows).items()):
+        limit = f"{rate:.2f} samples/cycle" if rate else "none of the rates tried"
+        print(f"gap {gap:5d}, csi tready duty {ready_duty:.2f}: {limit}")
@@ -0,0 +1,273 @@
+"""
+Triggered wave dumping for long cocotb simulations.
+
+Dumping every signal of a 140k cycle `csi_extractor_sv` run makes a huge
+file and slows icarus down, so instead of the runner's `waves=True` this
+builds a `wave_dump` module next to the toplevel that starts with dumping
+off, and WaveDump switches it on only for windows around trigger events:
+
+    at(cycle)                a known cycle, e.g. a packet's first sample,
+                             with `pre` cycles before it and `post` after
+    watch(signal, test)      whenever test(signal value) becomes true, e.g.
+                             short_preamble_detected or a FIFO filling up
+    trigger(reason)          now
+    mismatch(cycle)          a scoreboard mismatch traced back to the cycle
+                             its packet went in (needs WAVE_TRIGGERS=mismatch)
+
+Live triggers can only dump from the event on. Every trigger's cycle is
+logged, so a rerun with WAVE_TRIGGERS=cycle=N,... gets the `pre` cycles
+before it as well. The simulation is deterministic, so the second run hits
+the same event. Waves are written as FST with icarus and as VCD otherwise.
+
+Build with the extra source and arguments:
+
+    runner.build(
+        sources=sources + [dump_source(build_dir, toplevel, sim)],
+        build_args=build_args + dump_build_args(sim),
+        ...
+    )
+    runner.test(..., plusargs=dump_plusargs(sim))
+
+and in the test:
+
+    dump = WaveDump(period_ns=10)
+    dump.at(5000)
+    dump.watch(dut.lts_extractor_inst.short_preamble_detected, "short preamble")
+    cocotb.start_soon(dump.run())
+"""
+
+import os
+from pathlib import Path
+
+import cocotb
+from cocotb import simulator
+from cocotb.handle import SimHandle
+from cocotb.triggers import Edge, Event, First, Timer
+from cocotb.utils import get_sim_time
+
+MODULE = "wave_dump"
+
+# Default window: cycles dumped before and after a trigger
+PRE = 500
+POST = 2000
+
+
+def dump_format(sim="icarus"):
+    return "fst" if sim == "icarus" else "vcd"
+
+
+def dump_source(build_dir, toplevel, sim="icarus"):
+    """
+    Write the wave_dump module into build_dir and return its path
+    """
+    # Absolute, since the simulator runs in build_dir rather than here
+    build_dir = Path(build_dir).resolve()
+    build_dir.mkdir(parents=True, exist_ok=True)
+    waves = (build_dir / f"{toplevel}.{dump_format(sim)}").as_posix()
+    path = build_dir / f"{MODULE}.v"
+    path.write_text(
+        f"module {MODULE}();\n"
+        "reg enable = 0;\n"
+        "initial begin\n"
+        f'    $dumpfile("{waves}");\n'
+        f"    $dumpvars(0, {toplevel});\n"
+        "    $dumpoff;\n"
+        "end\n"
+        "always @(enable) begin\n"
+        "    if (enable) $dumpon;\n"
+        "    else $dumpoff;\n"
+        "end\n"
+        "endmodule\n"
+    )
+    return path
+
+
+def dump_build_args(sim="icarus"):
+    # Other simulators need wave_dump elaborated as a second root their own way
+    return ["-s", MODULE] if sim == "icarus" else []
+
+
+def dump_plusargs(sim="icarus"):
+    return ["-fst"] if dump_format(sim) == "fst" else []
+
+
+def parse_triggers(spec):
+    """
+    Parse WAVE_TRIGGERS, a comma-separated list of names and name=value
+    pairs, into [(name, value or None)]
+    """
+    triggers = []
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        name, _, value = item.partition("=")
+        triggers.append((name, int(value) if value else None))
+    return triggers
+
+
+class WaveDump:
+    """
+    Switches dumping on for [cycle - pre, cycle + post] around each trigger,
+    with cycles counted from the start of the simulation. Does nothing if
+    the wave_dump module wasn't built in.
+    """
+
+    def __init__(self, period_ns, pre=PRE, post=POST, max_windows=16):
+        self.period = period_ns
+        self.pre = pre
+        self.post = post
+        self.max_windows = max_windows
+        self.windows = []
+        self.triggers = []
+        self.on_mismatch = False
+        self._changed = Event()
+        # The module's `enable` reg, not the module itself
+        handle = simulator.get_root_handle(MODULE)
+        self.enable = SimHandle(handle).enable if handle else None
+
+    def now(self):
+        return int(get_sim_time("ns") // self.period)
+
+    def at(self, cycle, reason="cycle"):
+        """
+        Dump around a cycle, which can still be to come
+        """
+        if len(self.windows) == self.max_windows:
+            return
+        self.windows.append((max(cycle - self.pre, 0), cycle + self.post))
+        self.triggers.append((cycle, reason))
+        self._changed.set()
+
+    def trigger(self, reason="trigger"):
+        """
+        Dump from now on for `post` cycles
+        """
+        cycle = self.now()
+        cocotb.log.info(f"Wave trigger at cycle {cycle}: {reason}")
+        self.at(cycle, reason)
+
+    def mismatch(self, cycle, reason="mismatch"):
+        """
+        Dump around the cycle a mismatching output came from if mismatches
+        are a trigger. Scoreboards mostly check at the end, once the window
+        has gone by, so this logs the cycle for a rerun.
+        """
+        if self.on_mismatch:
+            cocotb.log.info(
+                f"Wave trigger at cycle {cycle}: {reason}, "
+                f"rerun with WAVE_TRIGGERS=cycle={cycle}"
+            )
+            self.at(cycle, reason)
+
+    def watch(self, signal, reason, test=bool):
+        """
+        Trigger whenever test(int(signal.value)) becomes true
+        """
+
+        async def watcher():
+            was = False
+            while len(self.windows) < self.max_windows:
+                await Edge(signal)
+                try:
+                    now = bool(test(int(signal.value)))
+                except ValueError:
+                    now = False
+                if now and not was:
+                    self.trigger(reason)
+                was = now
+
+        return cocotb.start_soon(watcher())
+
+    def from_env(self, dut, packet_cycles=()):
+        """
+        Add the triggers in WAVE_TRIGGERS, with the window from
+        WAVE_WINDOW=pre,post:
+
+            cycle=N           around cycle N
+            packet=K          around the K-th entry of packet_cycles
+            short_preamble    whenever short_preamble_detected goes high
+            fifo_full         whenever a bram_fifo fills up
+            mismatch          around outputs the scoreboard rejects
+        """
+        from occupancy_probe import find_bram_fifos
+
+        if os.getenv("WAVE_WINDOW"):
+            self.pre, self.post = map(int, os.environ["WAVE_WINDOW"].split(","))
+        triggers = parse_triggers(os.getenv("WAVE_TRIGGERS", ""))
+        if triggers and self.enable is None:
+            cocotb.log.warning(f"No {MODULE} module, so no waves will be dumped")
+        for name, value in triggers:
+            if name == "cycle":
+                self.at(value)
+            elif name == "packet":
+                if not 0 <= value < len(packet_cycles):
+                    raise ValueError(
+                        f"WAVE_TRIGGERS=packet={value}, but this test has "
+                        f"{len(packet_cycles)} known packet starts"
+                    )
+                self.at(int(packet_cycles[value]), f"packet {value}")
+            elif name == "short_preamble":
+                signal = _find(dut, "short_preamble_detected")
+                if signal is None:
+                    raise ValueError("No short_preamble_detected to trigger on")
+                self.watch(signal, "short preamble")
+            elif name == "mismatch":
+                self.on_mismatch = True
+            elif name == "fifo_full":
+                for fifo in find_bram_fifos(dut):
+                    top = len(fifo.valid_buf) - 1
+                    self.watch(
+                        fifo.valid_buf,
+                        f"{fifo._name} full",
+                        lambda v, top=top: (v >> top) & 1,
+                    )
+            else:
+                raise ValueError(f"Unknown wave trigger {name}")
+        return self
+
+    def _enabled(self, cycle):
+        return any(start <= cycle < stop for start, stop in self.windows)
+
+    async def run(self):
+        """
+        Follow the windows, sleeping until the next window edge or trigger
+        """
+        if self.enable is None:
+            return
+        state = None
+        while True:
+            cycle = self.now()
+            enabled = self._enabled(cycle)
+            if enabled != state:
+                self.enable.value = int(enabled)
+                state = enabled
+            edges = [e for w in self.windows for e in w if e > cycle]
+            self._changed.clear()
+            if edges:
+                wait = Timer((min(edges) - cycle) * self.period, units="ns")
+                await First(wait, self._changed.wait())
+            else:
+                await self._changed.wait()
+
+    def summary(self):
+        """
+        Cycles dumped, and the rerun that gets the `pre` cycles before the
+        live triggers too
+        """
+        dumped = set().union(*(range(start, stop) for start, stop in self.windows))
+        cycles = ",".join(f"cycle={c}" for c, _ in self.triggers)
+        return f"{len(dumped)} cycles dumped, rerun with WAVE_TRIGGERS={cycles}"
+
+
+def _find(handle, name):
+    """
+    The first signal called name at or below handle
+    """
+    from cocotb.handle import HierarchyObject
+
+    if hasattr(handle, name):
+        return getattr(handle, name)
+    for child in handle:
+        if isinstance(child, HierarchyObject):
+            found = _find(child, name)
+            if found is not None:
+                return found
+    return None